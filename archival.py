@@ -0,0 +1,60 @@
+# archival.py
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+# --- НАСТРОЙКИ ---
+ARCHIVE_INACTIVE_DAYS = int(os.getenv("ARCHIVE_INACTIVE_DAYS", "90"))    # 0 — архивация выключена
+ARCHIVE_CHUNK = int(os.getenv("ARCHIVE_CHUNK", "200"))                   # Пользователей за одну транзакцию
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+ARCHIVE_CHUNK_PAUSE = 0.2  # Пауза между порциями: блокировки на запись короткие и редкие
+
+
+class UserArchiver:
+    """
+    Перенос давно неактивных пользователей в архивные таблицы (задача лидера).
+
+    Пользователи, не заходившие ARCHIVE_INACTIVE_DAYS дней, порциями по ARCHIVE_CHUNK
+    переезжают из users и таблиц фермы в *_archive — рабочие таблицы и их индексы
+    остаются размером с живую аудиторию. Первое же обращение архивного пользователя
+    (Database.touch_user из DbSessionMiddleware) возвращает его обратно.
+    """
+
+    def __init__(self, inactive_days: int = ARCHIVE_INACTIVE_DAYS, chunk: int = ARCHIVE_CHUNK):
+        self.inactive_days = inactive_days
+        self.chunk = chunk
+        self.db = None
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def supported(self) -> bool:
+        return self.db is not None and hasattr(self.db, "archive_inactive_users") and self.inactive_days > 0
+
+    async def run_once(self) -> int:
+        started = time.perf_counter()
+        before = datetime.now() - timedelta(days=self.inactive_days)
+        total = 0
+        while True:
+            moved = await self.db.archive_inactive_users(before, self.chunk)
+            total += moved
+            if moved < self.chunk:
+                break
+            await asyncio.sleep(ARCHIVE_CHUNK_PAUSE)
+        if total:
+            logging.info(f"[Archive] В архив перенесено пользователей: {total} за {time.perf_counter() - started:.1f} с")
+        return total
+
+    async def run(self, interval_hours: float = ARCHIVE_INTERVAL_HOURS):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"[Archive] Ошибка архивации: {e}", exc_info=True)
+            await asyncio.sleep(interval_hours * 3600)
+
+
+archiver = UserArchiver()
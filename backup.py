@@ -0,0 +1,189 @@
+# backup.py
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# --- НАСТРОЙКИ ---
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")                            # Пусто — папка backups рядом с базой
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "5"))                    # Сколько архивов хранить
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))                # Страниц за один шаг backup API
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))  # Пауза между шагами (копия не забирает весь диск)
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))  # 0 — только по /get_db
+BACKUP_MAX_AGE = float(os.getenv("BACKUP_MAX_AGE", "300"))          # /get_db отдает архив не старше (сек), иначе делает новый
+
+
+@dataclass
+class BackupResult:
+    path: str
+    files: int
+    raw_size: int        # Сумма снимков до сжатия
+    size: int            # Размер архива
+    duration: float
+    created_at: float    # time.time()
+
+    def describe(self) -> str:
+        return (f"{os.path.basename(self.path)}: {self.files} файл(ов), "
+                f"{self.raw_size / 1024 / 1024:.1f} МБ → {self.size / 1024 / 1024:.1f} МБ, {self.duration:.1f} с")
+
+
+def _pin_snapshots(paths: List[str], lock_path: str) -> List[sqlite3.Connection]:
+    """
+    Открывает по читающей транзакции на каждый файл, пока удерживается блокировка записи lock_path (core).
+    Межфайловые операции проходят через core: архивация и возврат из архива переносят ферму
+    под блокировкой core, передача между шардами меняет состояние в core между шагами в шардах.
+    Пока core заблокирован, ни одна из них не перейдет к следующему шагу — снимки всех файлов
+    согласованы с записью в core (незавершенные передачи доводит recover_transfers).
+    Блокировка держится миллисекунды: только пока открываются снимки, не на время копирования.
+    """
+    lock = sqlite3.connect(lock_path, timeout=20, isolation_level=None)
+    sources = []
+    try:
+        lock.execute("BEGIN IMMEDIATE")
+        for path in paths:
+            src = sqlite3.connect(path, timeout=20, isolation_level=None)
+            sources.append(src)
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # Снимок фиксируется первым чтением
+        return sources
+    except Exception:
+        for src in sources:
+            src.close()
+        raise
+    finally:
+        lock.close()  # Откатывает BEGIN IMMEDIATE
+
+
+def _copy_consistent(pairs: List[Tuple[str, str]], lock_path: str, pages: int, sleep: float):
+    """
+    Согласованный снимок живой базы (пары источник -> копия) через SQLite online backup API.
+    Копирование идет шагами по `pages` страниц из зафиксированных снимков (_pin_snapshots):
+    в WAL читатель не мешает писателям, изменения после снимка в копию не попадают
+    и не перезапускают ее. Пока копия идет, checkpoint не может обнулить WAL дальше снимка.
+    """
+    sources = _pin_snapshots([src for src, _ in pairs], lock_path)
+    try:
+        for src, (_, dst_path) in zip(sources, pairs):
+            dst = sqlite3.connect(dst_path)
+            try:
+                src.backup(dst, pages=pages, sleep=sleep)
+            finally:
+                dst.close()
+    finally:
+        for src in sources:
+            src.close()
+
+
+def _pack(snapshots: List[str], archive_path: str) -> int:
+    tmp_path = archive_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        for snapshot in snapshots:
+            archive.write(snapshot, arcname=os.path.basename(snapshot))
+    os.replace(tmp_path, archive_path)  # Архив появляется целиком или не появляется вовсе
+    return os.path.getsize(archive_path)
+
+
+class BackupManager:
+    """
+    Резервные копии базы без остановки бота.
+
+    Все файлы базы (core, домены, шарды фермы — Storage.data_files(), core первым) копируются
+    online backup API в отдельном потоке из снимков одного момента (_pin_snapshots), снимки
+    сжимаются в zip (тоже в потоке), в BACKUP_DIR остаются последние BACKUP_KEEP архивов.
+    Одновременно идет не больше одного бэкапа: второй запрос ждет и получает тот же архив.
+
+    Передача между шардами может попасть в архив на середине (state preparing/committed в core,
+    метки в шардах). После восстановления из архива ее доводит или откатывает recover_transfers —
+    он вызывается в Database.initialize при старте, отдельно запускать ничего не нужно.
+    """
+
+    def __init__(self, keep: int = BACKUP_KEEP, pages: int = BACKUP_PAGES):
+        self.keep = keep
+        self.pages = pages
+        self.db = None
+        self.last: Optional[BackupResult] = None
+        self._lock = asyncio.Lock()
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def supported(self) -> bool:
+        return self.db is not None and bool(self.db.data_files())
+
+    def backup_dir(self) -> str:
+        if BACKUP_DIR:
+            return BACKUP_DIR
+        return os.path.join(os.path.dirname(os.path.abspath(self.db.data_files()[0])), "backups")
+
+    def archives(self) -> List[str]:
+        """Архивы на диске, от новых к старым."""
+        folder = self.backup_dir()
+        if not os.path.isdir(folder):
+            return []
+        names = sorted((n for n in os.listdir(folder) if n.startswith("backup_") and n.endswith(".zip")), reverse=True)
+        return [os.path.join(folder, n) for n in names]
+
+    async def create(self) -> BackupResult:
+        async with self._lock:
+            return await self._create()
+
+    async def latest(self, max_age: float = BACKUP_MAX_AGE) -> BackupResult:
+        """Свежий согласованный архив: готовый (если не старше max_age) или новый."""
+        async with self._lock:
+            if self.last and os.path.exists(self.last.path) and time.time() - self.last.created_at <= max_age:
+                return self.last
+            return await self._create()
+
+    async def _create(self) -> BackupResult:
+        started = time.perf_counter()
+        folder = self.backup_dir()
+        os.makedirs(folder, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        workdir = os.path.join(folder, f".snapshot_{stamp}")
+        os.makedirs(workdir, exist_ok=True)
+
+        files = self.db.data_files()
+        pairs = [(path, os.path.join(workdir, os.path.basename(path))) for path in files if os.path.exists(path)]
+        snapshots = [snapshot for _, snapshot in pairs]
+        try:
+            await asyncio.to_thread(_copy_consistent, pairs, files[0], self.pages, BACKUP_STEP_SLEEP)
+            raw_size = sum(os.path.getsize(s) for s in snapshots)
+            archive_path = os.path.join(folder, f"backup_{stamp}.zip")
+            size = await asyncio.to_thread(_pack, snapshots, archive_path)
+        finally:
+            # Вместе с недописанным снимком; ошибки уборки не должны скрыть ошибку бэкапа
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self._rotate()
+        self.last = BackupResult(
+            path=archive_path, files=len(snapshots), raw_size=raw_size, size=size,
+            duration=time.perf_counter() - started, created_at=time.time(),
+        )
+        logging.info(f"[Backup] Готово: {self.last.describe()}")
+        return self.last
+
+    def _rotate(self):
+        for old in self.archives()[self.keep:]:
+            try:
+                os.remove(old)
+            except OSError as e:
+                logging.warning(f"[Backup] Не удалось удалить {old}: {e}")
+
+    async def run(self, interval_hours: float = BACKUP_INTERVAL_HOURS):
+        """Плановые бэкапы (задача лидера)."""
+        while True:
+            await asyncio.sleep(interval_hours * 3600)
+            try:
+                await self.create()
+            except Exception as e:
+                logging.error(f"[Backup] Ошибка планового бэкапа: {e}", exc_info=True)
+
+
+backups = BackupManager()
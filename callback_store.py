@@ -0,0 +1,159 @@
+# callback_store.py
+import json
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Union
+
+from aiogram.filters.callback_data import CallbackData, CallbackQueryFilter
+from aiogram.types import CallbackQuery
+
+# --- НАСТРОЙКИ ---
+DEFAULT_TTL = 3600                  # Обычная клавиатура живет час
+PERSISTENT_TTL = 7 * 24 * 3600      # "Долгие" клавиатуры (уведомления и т.п.) — неделю
+MAX_ENTRIES = 50_000                # Предел LRU в памяти
+# Сохранять "долгие" payload'ы в SQLite (put_persistent). По умолчанию выключено: тогда промах
+# кэша в PayloadFilter не ходит в БД, а кнопка после перезапуска отвечает STALE_TEXT
+CALLBACK_STORE_PERSIST = os.getenv("CALLBACK_STORE_PERSIST", "0") == "1"
+
+STALE_TEXT = "⌛ Кнопка устарела. Открой меню заново."
+
+
+class PayloadCallback(CallbackData, prefix="p"):
+    """Кнопка с коротким токеном вместо данных. Сами данные лежат в CallbackStore."""
+    kind: str
+    token: str
+
+
+class CallbackStore:
+    """
+    Хранилище данных для inline-кнопок (обход лимита 64 байта у callback_data).
+
+    Хэндлер кладет любой JSON-совместимый payload и получает короткий токен.
+    Payload живет в LRU-кэше с TTL; put_persistent() при CALLBACK_STORE_PERSIST=1 дополнительно
+    сохраняет его в SQLite, чтобы кнопка пережила вытеснение из кэша и перезапуск бота.
+    Чтение — один поиск в словаре (в SQLite идем только при промахе и подключенной БД).
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (expires_at, payload)
+        self.db = None
+
+    def attach(self, db):
+        """Подключает БД для долгоживущих payload'ов (см. CALLBACK_STORE_PERSIST)."""
+        self.db = db
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _new_token(self) -> str:
+        while True:
+            token = secrets.token_urlsafe(6)  # 8 символов
+            if token not in self._items:
+                return token
+
+    def _remember(self, token: str, payload: Any, expires_at: float):
+        self._items[token] = (expires_at, payload)
+        self._items.move_to_end(token)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    # --- ЗАПИСЬ ---
+
+    def put(self, payload: Any, ttl: int = DEFAULT_TTL) -> str:
+        """Кладет payload только в память. Возвращает токен."""
+        token = self._new_token()
+        self._remember(token, payload, time.time() + ttl)
+        return token
+
+    async def put_persistent(self, payload: Any, ttl: int = PERSISTENT_TTL) -> str:
+        """Кладет payload в память и в SQLite (если БД подключена)."""
+        token = self._new_token()
+        expires_at = time.time() + ttl
+        self._remember(token, payload, expires_at)
+        if self.db is not None:
+            await self.db.save_callback_payload(token, json.dumps(payload, ensure_ascii=False), expires_at)
+        return token
+
+    # --- ЧТЕНИЕ ---
+
+    def get(self, token: str) -> Optional[Any]:
+        item = self._items.get(token)
+        if item is None:
+            return None
+        expires_at, payload = item
+        if expires_at < time.time():
+            del self._items[token]
+            return None
+        self._items.move_to_end(token)
+        return payload
+
+    async def load(self, token: str) -> Optional[Any]:
+        """Как get(), но при промахе ищет payload в SQLite и возвращает его в кэш."""
+        payload = self.get(token)
+        if payload is not None or self.db is None:
+            return payload
+        row = await self.db.get_callback_payload(token)
+        if not row:
+            return None
+        payload_json, expires_at = row
+        if expires_at < time.time():
+            return None
+        payload = json.loads(payload_json)
+        self._remember(token, payload, expires_at)
+        return payload
+
+    async def purge_expired(self) -> int:
+        """Удаляет просроченные записи из памяти и SQLite."""
+        now = time.time()
+        expired = [t for t, (exp, _) in self._items.items() if exp < now]
+        for token in expired:
+            del self._items[token]
+        removed = len(expired)
+        if self.db is not None:
+            removed += await self.db.purge_callback_payloads(now)
+        if removed:
+            logging.info(f"[Callback Store] Удалено просроченных токенов: {removed}")
+        return removed
+
+
+callback_store = CallbackStore()
+
+
+# --- УПАКОВКА / ФИЛЬТР ---
+
+def pack_payload(kind: str, payload: Any, ttl: int = DEFAULT_TTL) -> str:
+    """Готовая строка callback_data для кнопки."""
+    return PayloadCallback(kind=kind, token=callback_store.put(payload, ttl)).pack()
+
+
+async def pack_persistent_payload(kind: str, payload: Any, ttl: int = PERSISTENT_TTL) -> str:
+    return PayloadCallback(kind=kind, token=await callback_store.put_persistent(payload, ttl)).pack()
+
+
+class PayloadFilter(CallbackQueryFilter):
+    """
+    Фильтр для кнопок из pack_payload(): PayloadFilter("plant_do").
+    Передает в хэндлер аргумент payload (None — если токен устарел).
+    Наследует CallbackQueryFilter, поэтому CallbackPrefixDispatcher индексирует его по префиксу "p".
+    """
+
+    __slots__ = ("kind",)
+
+    def __init__(self, kind: str):
+        super().__init__(callback_data=PayloadCallback)
+        self.kind = kind
+
+    async def __call__(self, query: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        if not isinstance(query, CallbackQuery) or not query.data:
+            return False
+        try:
+            data = PayloadCallback.unpack(query.data)
+        except (TypeError, ValueError):
+            return False
+        if data.kind != self.kind:
+            return False
+        return {"callback_data": data, "payload": await callback_store.load(data.token)}
@@ -1,81 +1,409 @@
 # database.py
+import asyncio
 import aiosqlite
 import logging
 import json
+import os
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Optional
 
-# --- КОНСТАНТЫ ---
-DEFAULT_INVENTORY = {
-    'зерно': 0, 'хмель': 0,
-    'семя_зерна': 5, 'семя_хмеля': 3
+from monitoring.sql import SQL_STATS, InstrumentedConnection, instrument_methods
+from monitoring.tracing import TRACING
+from logs import hot_logger
+from storage import Storage, TransferAbortedError, TransferPendingError, DEFAULT_INVENTORY, DEFAULT_SETTINGS
+
+
+def _row_to_dict(cursor, row) -> Dict[str, Any]:
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+# --- ДОМЕНЫ (ОТДЕЛЬНЫЕ ФАЙЛЫ) ---
+# У каждого домена свой файл SQLite, а значит своя блокировка на запись:
+# пачка отметок уведомлений не ждет удары по рейду, ферма не ждет рейтинг и т.д.
+# core — основной файл (db_name), остальные рядом: bot_database_games.db и т.д.
+
+DOMAIN_TABLES = {
+    "core": ("users", "users_archive", "chats", "game_data", "callback_payloads", "leases", "broadcasts",
+             "db_meta", "transfers"),
+    "farm": ("user_farm_data", "user_plots", "user_inventory", "user_orders", "user_orders_meta"),
+    "games": ("active_raids", "raid_participants", "mafia_games", "mafia_players", "ladder_games"),
+    "notify": ("farm_notifications",),
 }
 
-class Database:
-    def __init__(self, db_name='bot_database.db'):
+# --- ШАРДЫ ФЕРМЫ ---
+# Данные фермы (по пользователю) разложены по FARM_SHARDS файлам по хэшу user_id:
+# bot_database_farm.db при одном шарде, bot_database_farm_0.db ... _farm_{N-1}.db при нескольких.
+# Число шардов записано в db_meta; сменить его можно только офлайн: python -m tools.reshard --to N
+FARM_SHARDS = int(os.getenv("FARM_SHARDS", "1"))
+
+# --- АКТИВНОСТЬ ПОЛЬЗОВАТЕЛЕЙ ---
+HOT_USERS_CACHE = int(os.getenv("HOT_USERS_CACHE", "10000"))  # Сколько недавно активных держим в памяти
+HOT_USER_TOUCH_SECONDS = 3600                                  # last_seen пишется не чаще раза в час
+
+# Возвраты из архива идут по записи на пользователя — с ограничением частоты (logs.py)
+archive_log = hot_logger("archive")
+
+# Таблицы шарда с данными пользователя (все с колонкой user_id): переносятся при решардинге и архивации
+FARM_TABLES = ("user_farm_data", "user_plots", "user_inventory", "user_orders", "user_orders_meta")
+ARCHIVE_SUFFIX = "_archive"
+
+FARM_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS user_farm_data (
+        user_id INTEGER PRIMARY KEY,
+        field_level INTEGER DEFAULT 1,
+        brewery_level INTEGER DEFAULT 1,
+        brewery_batch_size INTEGER DEFAULT 0,
+        brewery_batch_timer_end TEXT,
+        field_upgrade_timer_end TEXT,
+        brewery_upgrade_timer_end TEXT
+    )''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_plots (
+        user_id INTEGER,
+        plot_number INTEGER,
+        crop_id TEXT,
+        ready_time TEXT,
+        PRIMARY KEY (user_id, plot_number)
+    )''',
+    # Инвентарь (JSON)
+    '''
+    CREATE TABLE IF NOT EXISTS user_inventory (
+        user_id INTEGER PRIMARY KEY,
+        items_json TEXT DEFAULT '{}'
+    )''',
+    # Заказы
+    '''
+    CREATE TABLE IF NOT EXISTS user_orders (
+        user_id INTEGER,
+        slot_id INTEGER, -- 1, 2 или 3
+        order_id TEXT,   -- ID заказа из конфига (например, 'grain_10')
+        is_completed INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, slot_id)
+    )''',
+    # Таблица для таймера сброса заказов (раз в 24ч)
+    '''
+    CREATE TABLE IF NOT EXISTS user_orders_meta (
+        user_id INTEGER PRIMARY KEY,
+        last_reset_time TEXT
+    )''',
+    # Метки двухфазной передачи между шардами (см. Database.transfer_item)
+    '''
+    CREATE TABLE IF NOT EXISTS transfer_markers (
+        tx_id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        item_id TEXT,
+        amount INTEGER,
+        role TEXT        -- debit (уже списано) / credit (еще не зачислено)
+    )''',
+    # Архив неактивных пользователей (archival.py): копии таблиц без первичных ключей + индекс по user_id
+    *(f"CREATE TABLE IF NOT EXISTS {t}{ARCHIVE_SUFFIX} AS SELECT * FROM {t} WHERE 0" for t in FARM_TABLES),
+    *(f"CREATE INDEX IF NOT EXISTS idx_{t}{ARCHIVE_SUFFIX}_user ON {t}{ARCHIVE_SUFFIX} (user_id)" for t in FARM_TABLES),
+)
+
+
+
+def shard_of(user_id: int, shards: int) -> int:
+    """Шард пользователя. crc32 — стабилен между процессами и перезапусками (в отличие от hash())."""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(user_id.to_bytes(8, "big", signed=True)) % shards
+
+
+def farm_shard_path(db_name: str, shard: int, shards: int) -> str:
+    root, ext = os.path.splitext(db_name)
+    if shards <= 1:
+        return f"{root}_farm{ext or '.db'}"
+    return f"{root}_farm_{shard}{ext or '.db'}"
+
+
+# --- СЕССИЯ (UNIT OF WORK) ---
+# Пока апдейт обрабатывается внутри db.session(), все методы Database работают
+# через одно соединение на домен: коммит — в конце, откат — при исключении.
+# Соединение домена открывается при первом обращении, поэтому апдейт фермы
+# не берет блокировку файла рейдов. Транзакция записи открыта не больше чем в одном домене:
+# при переходе к другому домену предыдущий коммитится. Иначе два апдейта, которые пишут
+# core -> farm и farm -> core, ждут друг друга до таймаута (database is locked).
+# Атомарность — в пределах домена (между файлами ее не было и раньше).
+#
+# Границы коммита внутри апдейта (между ними — одна транзакция домена):
+#   1) перед каждым вызовом Bot API (SessionCommitMiddleware) — блокировка не ждет Telegram;
+#   2) при переходе к другому домену (core / farm.N / games / notify) — см. выше;
+#   3) в конце хэндлера; при исключении откатывается только незакоммиченное после последней границы;
+#   4) перед возвратом пользователя из архива при записи (_restore_on_write) и межшардовой передачей.
+# Поэтому "один апдейт — одна транзакция" не гарантируется: операция, которая пишет в два домена
+# (выполнение заказа фермы: ферма, потом награда в core), при сбое между коммитами сделана наполовину.
+# Чтение до первой записи идет вне блокировки, поэтому счетчики меняются без read-modify-write
+# в Python: одним UPDATE (change_rating) или чтением после первой записи (modify_inventory).
+# Сессия привязана к задаче: фоновые задачи (asyncio.create_task), запущенные из хэндлера,
+# наследуют contextvar, но открывают свои соединения, как и раньше.
+
+WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "BEGIN")
+
+
+class SessionConnection:
+    """
+    Соединение домена внутри сессии. Первая запись в транзакции берет asyncio-блокировку
+    файла домена (очередь по порядку), коммит/откат ее отпускает. Писатели одного процесса
+    ждут друг друга в очереди, а не в busy-ожидании SQLite (опрос с паузами до 100 мс
+    и без очередности — при десятках писателей хвосты в секунды).
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, lock: asyncio.Lock):
+        self._conn = conn
+        self._lock = lock
+        self._held = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def _before(self, sql: str):
+        if not self._held and sql.lstrip()[:7].upper().startswith(WRITE_VERBS):
+            await self._lock.acquire()
+            self._held = True
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._lock.release()
+
+    async def execute(self, sql: str, parameters=None):
+        await self._before(sql)
+        return await self._conn.execute(sql, parameters)
+
+    async def executemany(self, sql: str, parameters):
+        await self._before(sql)
+        return await self._conn.executemany(sql, parameters)
+
+    async def commit(self):
+        try:
+            await self._conn.commit()
+        finally:
+            self._release()
+
+    async def rollback(self):
+        try:
+            await self._conn.rollback()
+        finally:
+            self._release()
+
+    async def close(self):
+        try:
+            await self._conn.close()
+        finally:
+            self._release()
+
+
+class DbSession:
+    def __init__(self, db: "Database"):
+        self.db = db
+        self.conns: Dict[str, SessionConnection] = {}
+        self.task = asyncio.current_task()
+
+    async def connection(self, domain: str) -> aiosqlite.Connection:
+        # Блокировка записи другого домена отпускается до того, как понадобится эта
+        await self.flush(except_domain=domain)
+        conn = self.conns.get(domain)
+        if conn is None:
+            conn = self.conns[domain] = SessionConnection(
+                await self.db._open_connection(domain), self.db._write_lock(domain))
+        return conn
+
+    async def flush(self, except_domain: Optional[str] = None):
+        """Коммитит то, что уже сделано в сессии (соединения остаются открытыми)."""
+        for domain, conn in self.conns.items():
+            if domain != except_domain and conn.in_transaction:
+                await conn.commit()
+
+    async def close(self, commit: bool):
+        """Коммит (или откат) и закрытие всех соединений. Если коммит одного домена упал — остальные откатываются."""
+        conns, self.conns = list(self.conns.values()), {}
+        error = None
+        for conn in conns:
+            try:
+                if commit and error is None:
+                    await conn.commit()
+                else:
+                    await conn.rollback()
+            except Exception as e:
+                error = error or e
+            finally:
+                await conn.close()
+        if error is not None:
+            raise error
+
+
+_current_session: ContextVar[Optional[DbSession]] = ContextVar("db_session", default=None)
+
+
+async def flush_current_session():
+    """
+    Коммитит сессию текущей задачи, если она есть. Вызывается перед запросами к Bot API:
+    пока ждем Telegram, блокировку записи держать нельзя — за ней встают все писатели.
+    """
+    session = _current_session.get()
+    if session is not None and session.task is asyncio.current_task():
+        await session.flush()
+
+
+class Database(Storage):
+    """Хранилище на SQLite (aiosqlite), по файлу на домен."""
+
+    def __init__(self, db_name='bot_database.db', farm_shards: int = FARM_SHARDS):
         self.db_name = db_name
+        self.farm_shards = farm_shards
+        # user_id -> monotonic последней отметки активности (LRU недавно активных, см. touch_user)
+        self._hot_users: "OrderedDict[int, float]" = OrderedDict()
+        # Домен -> очередь писателей сессий (SessionConnection)
+        self._write_locks: Dict[str, asyncio.Lock] = {}
+
+    # --- СОЕДИНЕНИЯ ---
+
+    def domain_path(self, domain: str) -> str:
+        """Путь к файлу домена. Шард фермы — "farm.<номер>"."""
+        name, _, shard = domain.partition(".")
+        if name == "core":
+            return self.db_name
+        if name == "farm":
+            return farm_shard_path(self.db_name, int(shard or 0), self.farm_shards)
+        root, ext = os.path.splitext(self.db_name)
+        return f"{root}_{name}{ext or '.db'}"
+
+    def data_files(self) -> List[str]:
+        domains = ["core", "games", "notify"] + [f"farm.{i}" for i in range(self.farm_shards)]
+        return [self.domain_path(domain) for domain in domains]
+
+    def _write_lock(self, domain: str) -> asyncio.Lock:
+        lock = self._write_locks.get(domain)
+        if lock is None:
+            lock = self._write_locks[domain] = asyncio.Lock()
+        return lock
+
+    def _domain_key(self, domain: str, user_id: Optional[int]) -> str:
+        if domain == "farm":
+            return f"farm.{shard_of(user_id, self.farm_shards)}"
+        return domain
+
+    async def _open_connection(self, domain: str) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.domain_path(domain), timeout=20)
+        # Учет запросов по шаблонам + лог медленных с планом (monitoring/sql.py)
+        return InstrumentedConnection(conn) if SQL_STATS or TRACING else conn
+
+    @asynccontextmanager
+    async def _open(self, domain: str):
+        conn = await self._open_connection(domain)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+    def _active_session(self) -> Optional[DbSession]:
+        session = _current_session.get()
+        if session is not None and session.db is self and session.task is asyncio.current_task():
+            return session
+        return None
+
+    @asynccontextmanager
+    async def _connect(self, domain: str = "core", user_id: Optional[int] = None):
+        """Соединение домена для одного метода: соединение сессии или новое (как раньше).
+        Для фермы нужен user_id — по нему выбирается шард."""
+        domain = self._domain_key(domain, user_id)
+        session = self._active_session()
+        if session is not None:
+            yield await session.connection(domain)
+            return
+        async with self._open(domain) as db:
+            yield db
+
+    async def _commit(self, db: aiosqlite.Connection):
+        """Коммит вне сессии. Внутри сессии коммитит сама сессия в конце апдейта."""
+        if self._active_session() is None:
+            await db.commit()
+
+    @asynccontextmanager
+    async def session(self):
+        """Одна транзакция на домен на весь блок (апдейт)."""
+        active = self._active_session()
+        if active is not None:  # Вложенная сессия — работаем в уже открытой
+            yield active
+            return
+        session = DbSession(self)
+        token = _current_session.set(session)
+        try:
+            yield session
+        except BaseException:
+            await session.close(commit=False)
+            raise
+        else:
+            await session.close(commit=True)
+        finally:
+            _current_session.reset(token)
 
     async def initialize(self):
         logging.info("Инициализация базы данных...")
-        async with aiosqlite.connect(self.db_name, timeout=20) as db:
+        await self._check_farm_shards()
+        async with AsyncExitStack() as stack:
+            core = await stack.enter_async_context(self._open("core"))
+            games = await stack.enter_async_context(self._open("games"))
+            notify = await stack.enter_async_context(self._open("notify"))
+            farm_shards = [
+                await stack.enter_async_context(self._open(f"farm.{i}")) for i in range(self.farm_shards)
+            ]
+            connections = [core, games, notify, *farm_shards]
+            for conn in connections:
+                # Новые файлы — с incremental vacuum (свободные страницы возвращает maintenance.py);
+                # на уже созданных базах pragma ничего не меняет до полного VACUUM
+                await conn.execute("PRAGMA main.auto_vacuum=INCREMENTAL")
+                # WAL: читатели не блокируют писателя (важно, когда транзакция живет весь апдейт)
+                await conn.execute("PRAGMA main.journal_mode=WAL")
+
             # --- ОСНОВНЫЕ ТАБЛИЦЫ ---
-            await db.execute('''
+            await core.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER PRIMARY KEY, 
                     first_name TEXT, 
                     last_name TEXT,
                     username TEXT, 
                     beer_rating INTEGER DEFAULT 0, 
-                    last_beer_time TEXT
+                    last_beer_time TEXT,
+                    last_seen TEXT
                 )
             ''')
-            await db.execute('CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY, title TEXT)')
-            await db.execute('CREATE TABLE IF NOT EXISTS game_data (key TEXT PRIMARY KEY, value INTEGER)')
+            await self._ensure_last_seen(core)
+            await core.execute('CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)')
+            # Архив неактивных пользователей (archival.py): те же колонки, без нагрузки на горячие индексы
+            await core.execute('CREATE TABLE IF NOT EXISTS users_archive AS SELECT * FROM users WHERE 0')
+            await core.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_archive_user ON users_archive (user_id)')
+            await core.execute('CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY, title TEXT)')
+            await core.execute('CREATE TABLE IF NOT EXISTS game_data (key TEXT PRIMARY KEY, value INTEGER)')
             
             # --- ТАБЛИЦЫ РЕЙДОВ ---
-            await db.execute('''
+            await games.execute('''
                 CREATE TABLE IF NOT EXISTS active_raids (
                     chat_id INTEGER PRIMARY KEY, message_id INTEGER, boss_health INTEGER,
                     boss_max_health INTEGER, reward_pool INTEGER, end_time TEXT
                 )
             ''')
-            await db.execute('''
+            await games.execute('''
                 CREATE TABLE IF NOT EXISTS raid_participants (
                     raid_id INTEGER, user_id INTEGER, damage_dealt INTEGER DEFAULT 0,
                     last_hit_time TEXT, PRIMARY KEY (raid_id, user_id)
                 )
             ''')
             
-            # --- ТАБЛИЦЫ ФЕРМЫ ---
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_farm_data (
-                    user_id INTEGER PRIMARY KEY,
-                    field_level INTEGER DEFAULT 1,
-                    brewery_level INTEGER DEFAULT 1,
-                    brewery_batch_size INTEGER DEFAULT 0,
-                    brewery_batch_timer_end TEXT,
-                    field_upgrade_timer_end TEXT,
-                    brewery_upgrade_timer_end TEXT
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_plots (
-                    user_id INTEGER,
-                    plot_number INTEGER,
-                    crop_id TEXT,
-                    ready_time TEXT,
-                    PRIMARY KEY (user_id, plot_number)
-                )
-            ''')
-            # Инвентарь (JSON)
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_inventory (
-                    user_id INTEGER PRIMARY KEY,
-                    items_json TEXT DEFAULT '{}'
-                )
-            ''')
+            # --- ТАБЛИЦЫ ФЕРМЫ (в каждом шарде, см. FARM_SCHEMA) ---
+            for farm in farm_shards:
+                for statement in FARM_SCHEMA:
+                    await farm.execute(statement)
+
             # Уведомления
-            await db.execute('''
+            await notify.execute('''
                 CREATE TABLE IF NOT EXISTS farm_notifications (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER,
@@ -84,27 +412,9 @@ class Database:
                     is_sent INTEGER DEFAULT 0
                 )
             ''')
-            
-            # --- ✅ ТАБЛИЦА: ЗАКАЗЫ (ORDERS) ---
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_orders (
-                    user_id INTEGER,
-                    slot_id INTEGER, -- 1, 2 или 3
-                    order_id TEXT,   -- ID заказа из конфига (например, 'grain_10')
-                    is_completed INTEGER DEFAULT 0,
-                    PRIMARY KEY (user_id, slot_id)
-                )
-            ''')
-            # Таблица для таймера сброса заказов (раз в 24ч)
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_orders_meta (
-                    user_id INTEGER PRIMARY KEY,
-                    last_reset_time TEXT
-                )
-            ''')
 
             # --- ТАБЛИЦА МАФИИ ---
-            await db.execute('''
+            await games.execute('''
                 CREATE TABLE IF NOT EXISTS mafia_games (
                     chat_id INTEGER PRIMARY KEY,
                     message_id INTEGER,
@@ -114,7 +424,7 @@ class Database:
                     timer_task_id TEXT
                 )
             ''')
-            await db.execute('''
+            await games.execute('''
                 CREATE TABLE IF NOT EXISTS mafia_players (
                     chat_id INTEGER,
                     user_id INTEGER,
@@ -127,45 +437,142 @@ class Database:
                 )
             ''')
             
+            # --- ЛЕСЕНКА: только итог игры (само состояние живет в подписанных кнопках) ---
+            await games.execute('''
+                CREATE TABLE IF NOT EXISTS ladder_games (
+                    game_id TEXT PRIMARY KEY,
+                    status TEXT,     -- playing / timeout / paid / lost
+                    created_at TEXT
+                )
+            ''')
+
+            # --- ДАННЫЕ INLINE-КНОПОК (callback_store.py) ---
+            await core.execute('''
+                CREATE TABLE IF NOT EXISTS callback_payloads (
+                    token TEXT PRIMARY KEY,
+                    payload_json TEXT,
+                    expires_at REAL
+                )
+            ''')
+
+            # --- АРЕНДА ЛИДЕРСТВА (leader.py) ---
+            await core.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT,
+                    token INTEGER,   -- fencing token: растет при каждой смене владельца
+                    expires_at REAL
+                )
+            ''')
+
+            # --- ОЧЕРЕДЬ РАССЫЛОК (выполняет лидер) ---
+            await core.execute('''
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_chat_id INTEGER,
+                    message_id INTEGER,
+                    status TEXT DEFAULT 'pending',  -- pending / done
+                    last_user_id INTEGER DEFAULT 0, -- докуда дошли (рассылка продолжается после смены лидера)
+                    sent INTEGER DEFAULT 0,
+                    errors INTEGER DEFAULT 0,
+                    created_at TEXT
+                )
+            ''')
+
+            # --- ЖУРНАЛ ПЕРЕДАЧ МЕЖДУ ШАРДАМИ (координатор двухфазного коммита) ---
+            await core.execute('''
+                CREATE TABLE IF NOT EXISTS transfers (
+                    tx_id TEXT PRIMARY KEY,
+                    from_user INTEGER,
+                    to_user INTEGER,
+                    item_id TEXT,
+                    amount INTEGER,
+                    state TEXT,      -- preparing / committed / aborted / done
+                    created_at TEXT
+                )
+            ''')
+
             # Настройки по умолчанию
-            default_settings = [
-                ('beer_cooldown', 7200), ('jackpot_chance', 100),
-                ('roulette_cooldown', 300), ('roulette_min_bet', 10), ('roulette_max_bet', 1000),
-                ('ladder_min_bet', 10), ('ladder_max_bet', 500),
-                ('raid_boss_health', 1000), ('raid_reward_pool', 5000),
-                ('raid_duration_hours', 24), ('raid_hit_cooldown_minutes', 0),
-                ('raid_strong_hit_cost', 50), ('raid_strong_hit_damage_min', 30), ('raid_strong_hit_damage_max', 60),
-                ('raid_normal_hit_damage_min', 10), ('raid_normal_hit_damage_max', 20),
-                ('raid_reminder_hours', 4),
-                ('mafia_min_players', 4), ('mafia_max_players', 12),
-                ('mafia_lobby_timer', 60), ('mafia_night_timer', 60),
-                ('mafia_day_timer', 120), ('mafia_vote_timer', 60),
-                ('mafia_win_reward', 100), ('mafia_lose_reward', 10),
-                ('mafia_win_authority', 5), ('mafia_lose_authority', 1)
-            ]
-            for key, value in default_settings:
-                await db.execute('INSERT OR IGNORE INTO game_data (key, value) VALUES (?, ?)', (key, value))
-            
-            await db.commit()
-            logging.info("БД инициализирована.")
+            for key, value in DEFAULT_SETTINGS:
+                await core.execute('INSERT OR IGNORE INTO game_data (key, value) VALUES (?, ?)', (key, value))
+
+            for conn in connections:
+                await conn.commit()
+
+        await self._migrate_single_file()
+        await self.recover_transfers()
+        logging.info("БД инициализирована.")
+
+    @staticmethod
+    async def _ensure_last_seen(db: aiosqlite.Connection):
+        """Миграция: колонка last_seen (последняя активность) для старых баз."""
+        cursor = await db.execute("PRAGMA table_info(users)")
+        if any(col[1] == "last_seen" for col in await cursor.fetchall()):
+            return
+        await db.execute("ALTER TABLE users ADD COLUMN last_seen TEXT")
+        await db.execute("UPDATE users SET last_seen = COALESCE(last_beer_time, ?)", (datetime.now().isoformat(),))
+        logging.info("[DB] Добавлена колонка users.last_seen")
+
+    async def _check_farm_shards(self):
+        """Сверяет FARM_SHARDS с числом шардов, в котором лежат данные (db_meta)."""
+        async with self._open("core") as db:
+            await db.execute("PRAGMA main.auto_vacuum=INCREMENTAL")  # До первой таблицы (см. initialize)
+            await db.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT)")
+            cursor = await db.execute("SELECT value FROM db_meta WHERE key = 'farm_shards'")
+            row = await cursor.fetchone()
+            if row is None:
+                await db.execute("INSERT INTO db_meta (key, value) VALUES ('farm_shards', ?)", (str(self.farm_shards),))
+                await db.commit()
+                return
+            stored = int(row[0])
+        if stored != self.farm_shards:
+            raise RuntimeError(
+                f"Данные фермы разложены на {stored} шард(ов), а FARM_SHARDS={self.farm_shards}. "
+                f"Остановите бота и выполните: python -m tools.reshard --to {self.farm_shards}"
+            )
+
+    async def _migrate_single_file(self):
+        """Переносит таблицы доменов из старого единого файла (до разделения) в их файлы."""
+        async with aiosqlite.connect(self.db_name, timeout=20) as db:
+            for domain, tables in DOMAIN_TABLES.items():
+                if domain == "core":
+                    continue
+                present = [t for t in tables if await (await db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (t,)
+                )).fetchone()]
+                if not present:
+                    continue
+                if domain == "farm" and self.farm_shards > 1:
+                    # Раскладывать по шардам — задача tools.reshard; сначала запуск с FARM_SHARDS=1
+                    logging.warning(f"[DB] Таблицы фермы в {self.db_name} не перенесены: запустите бота с FARM_SHARDS=1")
+                    continue
+                await db.execute("ATTACH DATABASE ? AS dom", (self.domain_path(domain),))
+                for table in present:
+                    await db.execute(f"INSERT OR IGNORE INTO dom.{table} SELECT * FROM main.{table}")
+                    await db.execute(f"DROP TABLE main.{table}")
+                    logging.info(f"[DB] Таблица {table} перенесена в {self.domain_path(domain)}")
+                await db.commit()
+                await db.execute("DETACH DATABASE dom")
 
     # --- ОБЩИЕ МЕТОДЫ ---
 
     async def user_exists(self, user_id: int) -> bool:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
             return await cursor.fetchone() is not None
 
     async def add_user(self, user_id: int, first_name: str, last_name: str, username: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             await db.execute(
-                "INSERT OR IGNORE INTO users (user_id, first_name, last_name, username) VALUES (?, ?, ?, ?)",
-                (user_id, first_name, last_name, username)
+                "INSERT OR IGNORE INTO users (user_id, first_name, last_name, username, last_seen) VALUES (?, ?, ?, ?, ?)",
+                (user_id, first_name, last_name, username, datetime.now().isoformat())
             )
             await db.execute(
                 "UPDATE users SET first_name = ?, last_name = ?, username = ? WHERE user_id = ?",
                 (first_name, last_name, username, user_id)
             )
+            await self._commit(db)
+        async with self._connect("farm", user_id) as db:
             # Инициализация фермы
             await db.execute("INSERT OR IGNORE INTO user_farm_data (user_id) VALUES (?)", (user_id,))
             # Инициализация инвентаря
@@ -173,10 +580,10 @@ class Database:
                 "INSERT OR IGNORE INTO user_inventory (user_id, items_json) VALUES (?, ?)", 
                 (user_id, json.dumps(DEFAULT_INVENTORY))
             )
-            await db.commit()
+            await self._commit(db)
 
     async def get_user_profile(self, user_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 "SELECT first_name, last_name, username, beer_rating, last_beer_time FROM users WHERE user_id = ?", 
                 (user_id,)
@@ -184,7 +591,7 @@ class Database:
             return await cursor.fetchone()
 
     async def get_user_beer_rating(self, user_id: int) -> int:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute("SELECT beer_rating FROM users WHERE user_id = ?", (user_id,))
             result = await cursor.fetchone()
             return result[0] if result else 0
@@ -192,29 +599,41 @@ class Database:
     # --- ИЗМЕНЕНИЕ РЕЙТИНГА И ВРЕМЕНИ ---
     
     async def change_rating(self, user_id: int, amount: int):
-        """Изменяет рейтинг пользователя на amount (может быть отрицательным)."""
-        async with aiosqlite.connect(self.db_name) as db:
-            # Получаем текущий рейтинг
-            cursor = await db.execute("SELECT beer_rating FROM users WHERE user_id = ?", (user_id,))
+        """Изменяет рейтинг пользователя на amount (может быть отрицательным). Не уходит в минус."""
+        async with self._connect() as db:
+            # Одним запросом: параллельные изменения рейтинга не затирают друг друга
+            cursor = await db.execute(
+                "UPDATE users SET beer_rating = MAX(0, beer_rating + ?) WHERE user_id = ? RETURNING beer_rating",
+                (amount, user_id)
+            )
             row = await cursor.fetchone()
-            current_rating = row[0] if row else 0
-            
-            new_rating = current_rating + amount
-            if new_rating < 0: new_rating = 0 # Не уходим в минус
-            
-            await db.execute("UPDATE users SET beer_rating = ? WHERE user_id = ?", (new_rating, user_id))
-            await db.commit()
-            return new_rating
+            await self._commit(db)
+        if row is None and await self._restore_on_write(user_id):
+            return await self.change_rating(user_id, amount)
+        return row[0] if row else max(0, amount)
+
+    async def spend_rating(self, user_id: int, amount: int) -> bool:
+        """Условное списание одним запросом: проверка баланса и списание не разрываются
+        чужой записью (ставка в рулетке идет в очереди чата, /beer — в очереди пользователя)."""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "UPDATE users SET beer_rating = beer_rating - ? WHERE user_id = ? AND beer_rating >= ?",
+                (amount, user_id, amount)
+            )
+            await self._commit(db)
+        if cursor.rowcount == 0 and await self._restore_on_write(user_id):
+            return await self.spend_rating(user_id, amount)
+        return cursor.rowcount > 0
 
     async def update_last_beer_time(self, user_id: int):
         """Обновляет время последнего использования /beer."""
         now_iso = datetime.now().isoformat()
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             await db.execute("UPDATE users SET last_beer_time = ? WHERE user_id = ?", (now_iso, user_id))
-            await db.commit()
+            await self._commit(db)
 
     async def get_last_beer_time(self, user_id: int) -> datetime | None:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute("SELECT last_beer_time FROM users WHERE user_id = ?", (user_id,))
             result = await cursor.fetchone()
             if result and result[0]:
@@ -222,7 +641,7 @@ class Database:
             return None
 
     async def get_top_users(self, limit: int = 10):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute(
                 "SELECT first_name, last_name, beer_rating FROM users ORDER BY beer_rating DESC LIMIT ?", 
                 (limit,)
@@ -232,70 +651,68 @@ class Database:
     # --- НАСТРОЙКИ ---
     
     async def get_setting(self, key: str) -> int | None:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute("SELECT value FROM game_data WHERE key = ?", (key,))
             result = await cursor.fetchone()
             return result[0] if result else None
 
     async def get_all_settings(self) -> Dict[str, int]:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             cursor = await db.execute("SELECT key, value FROM game_data")
             rows = await cursor.fetchall()
             return {key: value for key, value in rows}
 
     async def update_setting(self, key: str, value: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect() as db:
             await db.execute("INSERT OR REPLACE INTO game_data (key, value) VALUES (?, ?)", (key, value))
-            await db.commit()
+            await self._commit(db)
 
-    # --- ДЖЕКПОТ ---
-    async def get_jackpot(self) -> int:
-        return await self.get_setting("jackpot_value") or 0
+    # (Джекпот — общие методы Storage поверх get_setting/update_setting)
 
-    async def reset_jackpot(self):
-        await self.update_setting("jackpot_value", 0)
+    async def take_jackpot(self) -> int:
+        """Забирает джекпот одним запросом: два одновременных /beer не сорвут один банк дважды."""
+        async with self._connect() as db:
+            cursor = await db.execute("DELETE FROM game_data WHERE key = 'jackpot_value' RETURNING value")
+            row = await cursor.fetchone()
+            await self._commit(db)
+            return row[0] if row else 0
 
-    async def increase_jackpot(self, amount: int):
-        current = await self.get_jackpot()
-        await self.update_setting("jackpot_value", current + amount)
-        
     # --- 👹 РЕЙДЫ (ВОССТАНОВЛЕНЫ) ---
 
     async def get_all_active_raids(self):
         """Возвращает список chat_id активных рейдов."""
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             cursor = await db.execute("SELECT chat_id FROM active_raids")
             return await cursor.fetchall()
 
     async def get_active_raid(self, chat_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect("games") as db:
             cursor = await db.execute("SELECT * FROM active_raids WHERE chat_id = ?", (chat_id,))
             row = await cursor.fetchone()
-            return dict(row) if row else None
+            return _row_to_dict(cursor, row) if row else None
 
     async def create_raid(self, chat_id: int, message_id: int, boss_health: int, max_health: int, reward: int, end_time: datetime):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             await db.execute(
                 "INSERT OR REPLACE INTO active_raids (chat_id, message_id, boss_health, boss_max_health, reward_pool, end_time) VALUES (?, ?, ?, ?, ?, ?)",
                 (chat_id, message_id, boss_health, max_health, reward, end_time.isoformat())
             )
-            await db.commit()
+            await self._commit(db)
 
     async def update_raid_health(self, chat_id: int, damage: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             await db.execute("UPDATE active_raids SET boss_health = boss_health - ? WHERE chat_id = ?", (damage, chat_id))
-            await db.commit()
+            await self._commit(db)
 
     async def end_raid(self, chat_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             await db.execute("DELETE FROM active_raids WHERE chat_id = ?", (chat_id,))
             await db.execute("DELETE FROM raid_participants WHERE raid_id = ?", (chat_id,))
-            await db.commit()
+            await self._commit(db)
 
     async def add_raid_participant(self, chat_id: int, user_id: int, damage: int):
         now = datetime.now().isoformat()
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             await db.execute("""
                 INSERT INTO raid_participants (raid_id, user_id, damage_dealt, last_hit_time)
                 VALUES (?, ?, ?, ?)
@@ -303,62 +720,85 @@ class Database:
                 damage_dealt = damage_dealt + excluded.damage_dealt,
                 last_hit_time = excluded.last_hit_time
             """, (chat_id, user_id, damage, now))
-            await db.commit()
+            await self._commit(db)
             
     async def get_raid_participants(self, chat_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             cursor = await db.execute("SELECT user_id, damage_dealt FROM raid_participants WHERE raid_id = ?", (chat_id,))
             return await cursor.fetchall()
             
+    # --- 🪜 ЛЕСЕНКА ---
+
+    async def claim_ladder_game(self, game_id: str, status: str) -> bool:
+        """Первая запись об игре (первый ход или таймаут). False — игру уже кто-то занял."""
+        async with self._connect("games") as db:
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO ladder_games (game_id, status, created_at) VALUES (?, ?, ?)",
+                (game_id, status, datetime.now().isoformat())
+            )
+            await self._commit(db)
+            return cursor.rowcount == 1
+
+    async def finish_ladder_game(self, game_id: str, status: str) -> bool:
+        """Завершает игру ровно один раз. False — игра уже завершена (повторное нажатие)."""
+        async with self._connect("games") as db:
+            cursor = await db.execute(
+                "UPDATE ladder_games SET status = ? WHERE game_id = ? AND status = 'playing'",
+                (status, game_id)
+            )
+            await self._commit(db)
+            return cursor.rowcount == 1
+
     # --- 🕵️ МАФИЯ (ВОССТАНОВЛЕНЫ) ---
     
     async def get_mafia_game(self, chat_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             cursor = await db.execute("SELECT * FROM mafia_games WHERE chat_id = ?", (chat_id,))
             return await cursor.fetchone()
             
     async def get_mafia_players(self, chat_id: int):
-         async with aiosqlite.connect(self.db_name) as db:
+         async with self._connect("games") as db:
              cursor = await db.execute("SELECT user_id, role, is_alive FROM mafia_players WHERE chat_id = ?", (chat_id,))
              return await cursor.fetchall()
 
     async def get_mafia_player_count(self, chat_id: int):
-         async with aiosqlite.connect(self.db_name) as db:
+         async with self._connect("games") as db:
              cursor = await db.execute("SELECT COUNT(*) FROM mafia_players WHERE chat_id = ?", (chat_id,))
              res = await cursor.fetchone()
              return res[0] if res else 0
 
     async def create_mafia_game(self, chat_id: int, message_id: int, creator_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
             await db.execute("INSERT OR REPLACE INTO mafia_games (chat_id, message_id, creator_id, status) VALUES (?, ?, ?, 'lobby')", (chat_id, message_id, creator_id))
-            await db.commit()
+            await self._commit(db)
             
     async def join_mafia(self, chat_id: int, user_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("games") as db:
              await db.execute("INSERT OR IGNORE INTO mafia_players (chat_id, user_id, is_alive) VALUES (?, ?, 1)", (chat_id, user_id))
-             await db.commit()
+             await self._commit(db)
 
     async def end_mafia_game(self, chat_id: int):
-         async with aiosqlite.connect(self.db_name) as db:
+         async with self._connect("games") as db:
              await db.execute("DELETE FROM mafia_games WHERE chat_id = ?", (chat_id,))
              await db.execute("DELETE FROM mafia_players WHERE chat_id = ?", (chat_id,))
-             await db.commit()
+             await self._commit(db)
 
     # --- 🌾 ФЕРМА (ОСНОВНОЕ) ---
 
     async def get_user_farm_data(self, user_id: int) -> Dict[str, Any]:
-        async with aiosqlite.connect(self.db_name) as db:
-            # Убедимся, что запись существует
-            await db.execute("INSERT OR IGNORE INTO user_farm_data (user_id) VALUES (?)", (user_id,))
-            await db.commit()
-            
-            db.row_factory = aiosqlite.Row
+        async with self._connect("farm", user_id) as db:
             cursor = await db.execute("SELECT * FROM user_farm_data WHERE user_id = ?", (user_id,))
             row = await cursor.fetchone()
+            if not row:
+                # Убедимся, что запись существует (пишем только если ее нет — без лишней блокировки на запись)
+                await db.execute("INSERT OR IGNORE INTO user_farm_data (user_id) VALUES (?)", (user_id,))
+                await self._commit(db)
+                cursor = await db.execute("SELECT * FROM user_farm_data WHERE user_id = ?", (user_id,))
+                row = await cursor.fetchone()
             
             if not row: return {}
 
-            data = dict(row)
+            data = _row_to_dict(cursor, row)
             # Конвертируем строки дат в datetime
             for key in ['brewery_batch_timer_end', 'field_upgrade_timer_end', 'brewery_upgrade_timer_end']:
                 if data.get(key):
@@ -369,12 +809,12 @@ class Database:
             return data
 
     async def get_user_plots(self, user_id: int) -> List[Tuple]:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             cursor = await db.execute("SELECT plot_number, crop_id, ready_time FROM user_plots WHERE user_id = ?", (user_id,))
             return await cursor.fetchall()
 
     async def get_user_inventory(self, user_id: int) -> Dict[str, int]:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             cursor = await db.execute("SELECT items_json FROM user_inventory WHERE user_id = ?", (user_id,))
             row = await cursor.fetchone()
             if row and row[0]:
@@ -383,39 +823,190 @@ class Database:
 
     async def modify_inventory(self, user_id: int, item_id: str, amount: int) -> bool:
         """Изменяет кол-во предмета. Возвращает False, если предмета не хватает."""
-        inv = await self.get_user_inventory(user_id)
+        async with self._connect("farm", user_id) as db:
+            # Сначала запись: блокировка записи шарда берется до чтения инвентаря,
+            # и параллельное изменение не затирается старой копией JSON
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO user_inventory (user_id, items_json) VALUES (?, ?)",
+                (user_id, json.dumps(DEFAULT_INVENTORY))
+            )
+            created = cursor.rowcount > 0
+            changed = await self._inventory_add(db, user_id, item_id, amount)
+            await self._commit(db)
+        if created and await self._restore_on_write(user_id):
+            # Инвентарь был в архиве: созданную выше строку заменила архивная — повторяем на ней
+            return await self.modify_inventory(user_id, item_id, amount)
+        return changed
+
+    # --- ПЕРЕДАЧА ПРЕДМЕТОВ (МЕЖДУ ШАРДАМИ) ---
+    # В одном шарде — одна транзакция. Между шардами — двухфазный коммит:
+    # 1) в core пишется запись transfers (preparing);
+    # 2) prepare: у отправителя предмет списывается вместе с меткой debit, у получателя пишется метка credit;
+    # 3) точка коммита — state = committed в core; после нее передача доводится до конца при любом сбое;
+    # 4) зачисление получателю + удаление его метки, удаление метки отправителя, state = done.
+    # Метки делают шаги идемпотентными: recover_transfers() (при старте и задачей лидера) доигрывает
+    # или откатывает зависшие передачи. Сбой до точки коммита — TransferAbortedError, после — TransferPendingError.
+
+    @staticmethod
+    async def _inventory_add(db: aiosqlite.Connection, user_id: int, item_id: str, amount: int) -> bool:
+        """Изменяет количество в уже открытой транзакции. False — предмета не хватает."""
+        cursor = await db.execute("SELECT items_json FROM user_inventory WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+        inv = json.loads(row[0]) if row and row[0] else DEFAULT_INVENTORY.copy()
         current_qty = inv.get(item_id, 0)
-        
         if current_qty + amount < 0:
             return False
-        
         inv[item_id] = current_qty + amount
-        
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute(
-                "INSERT OR REPLACE INTO user_inventory (user_id, items_json) VALUES (?, ?)", 
-                (user_id, json.dumps(inv))
-            )
+        await db.execute(
+            "INSERT OR REPLACE INTO user_inventory (user_id, items_json) VALUES (?, ?)",
+            (user_id, json.dumps(inv))
+        )
+        return True
+
+    async def _set_transfer_state(self, tx_id: str, state: str):
+        async with self._open("core") as db:
+            await db.execute("UPDATE transfers SET state = ? WHERE tx_id = ?", (state, tx_id))
             await db.commit()
+
+    async def transfer_item(self, from_id: int, to_id: int, item_id: str, amount: int) -> bool:
+        """
+        Переносит amount предмета от from_id к to_id. False — у отправителя не хватает.
+        Сбой до точки коммита — TransferAbortedError, после — TransferPendingError.
+        """
+        if amount <= 0:
+            return False
+        try:
+            session = self._active_session()
+            if session is not None:
+                # Передача коммитится сама (в несколько файлов) — сначала фиксируем уже сделанное в апдейте
+                await session.flush()
+
+            await self.touch_user(to_id, activity=False)  # Получатель мог быть в архиве
+
+            from_shard = self._domain_key("farm", from_id)
+            to_shard = self._domain_key("farm", to_id)
+            if from_shard == to_shard:
+                async with self._open(from_shard) as db:
+                    await db.execute("BEGIN IMMEDIATE")
+                    if not await self._inventory_add(db, from_id, item_id, -amount):
+                        await db.rollback()
+                        return False
+                    await self._inventory_add(db, to_id, item_id, amount)
+                    await db.commit()
+                return True
+
+            tx_id = uuid.uuid4().hex
+            async with self._open("core") as db:
+                await db.execute(
+                    "INSERT INTO transfers (tx_id, from_user, to_user, item_id, amount, state, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'preparing', ?)",
+                    (tx_id, from_id, to_id, item_id, amount, datetime.now().isoformat())
+                )
+                await db.commit()
+        except Exception as e:
+            raise TransferAbortedError(f"Передача не выполнена: {e}") from e
+
+        # --- Фаза 1: prepare ---
+        try:
+            async with self._open(from_shard) as db:
+                await db.execute("BEGIN IMMEDIATE")
+                if not await self._inventory_add(db, from_id, item_id, -amount):
+                    await db.rollback()
+                    await self._set_transfer_state(tx_id, 'aborted')
+                    return False
+                await db.execute(
+                    "INSERT INTO transfer_markers (tx_id, user_id, item_id, amount, role) VALUES (?, ?, ?, ?, 'debit')",
+                    (tx_id, from_id, item_id, amount)
+                )
+                await db.commit()
+            async with self._open(to_shard) as db:
+                await db.execute(
+                    "INSERT INTO transfer_markers (tx_id, user_id, item_id, amount, role) VALUES (?, ?, ?, ?, 'credit')",
+                    (tx_id, to_id, item_id, amount)
+                )
+                await db.commit()
+            # Точка коммита: дальше передача только доводится до конца (сейчас или в recover_transfers)
+            await self._set_transfer_state(tx_id, 'committed')
+        except Exception as e:
+            try:
+                await self._abort_transfer(tx_id, from_id, item_id, amount)
+            except Exception as abort_error:
+                # Откат доделает recover_transfers: запись осталась в preparing
+                logging.error(f"[DB] Откат передачи {tx_id} не удался: {abort_error}")
+            raise TransferAbortedError(f"Передача {tx_id} отменена: {e}") from e
+
+        # --- Фаза 2 ---
+        try:
+            await self._finish_transfer(tx_id, from_id, to_id, item_id, amount)
+        except Exception as e:
+            raise TransferPendingError(f"Передача {tx_id} будет завершена позже: {e}") from e
         return True
 
+    async def _finish_transfer(self, tx_id: str, from_id: int, to_id: int, item_id: str, amount: int):
+        async with self._open(self._domain_key("farm", to_id)) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("DELETE FROM transfer_markers WHERE tx_id = ?", (tx_id,))
+            if cursor.rowcount:  # Метки нет — уже зачислено
+                await self._inventory_add(db, to_id, item_id, amount)
+            await db.commit()
+        async with self._open(self._domain_key("farm", from_id)) as db:
+            await db.execute("DELETE FROM transfer_markers WHERE tx_id = ?", (tx_id,))
+            await db.commit()
+        await self._set_transfer_state(tx_id, 'done')
+
+    async def _abort_transfer(self, tx_id: str, from_id: int, item_id: str, amount: int):
+        """Откат до точки коммита: возвращаем списанное (если метка debit есть), удаляем метку получателя."""
+        async with self._open(self._domain_key("farm", from_id)) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("DELETE FROM transfer_markers WHERE tx_id = ?", (tx_id,))
+            if cursor.rowcount:
+                await self._inventory_add(db, from_id, item_id, amount)
+            await db.commit()
+        for shard in range(self.farm_shards):
+            async with self._open(f"farm.{shard}") as db:
+                await db.execute("DELETE FROM transfer_markers WHERE tx_id = ?", (tx_id,))
+                await db.commit()
+        await self._set_transfer_state(tx_id, 'aborted')
+
+    async def recover_transfers(self, older_than: float = 60) -> int:
+        """
+        Доводит до конца (committed) или откатывает (preparing) передачи, прерванные сбоем.
+        Committed доводятся сразу: шаги фазы 2 идемпотентны, параллельное завершение безопасно.
+        Свежие preparing (моложе older_than секунд) не трогаем — их может выполнять соседний процесс.
+        """
+        cutoff = (datetime.now() - timedelta(seconds=older_than)).isoformat()
+        async with self._open("core") as db:
+            cursor = await db.execute(
+                "SELECT tx_id, from_user, to_user, item_id, amount, state FROM transfers "
+                "WHERE state = 'committed' OR (state = 'preparing' AND created_at < ?)",
+                (cutoff,)
+            )
+            pending = await cursor.fetchall()
+        for tx_id, from_id, to_id, item_id, amount, state in pending:
+            if state == 'committed':
+                await self._finish_transfer(tx_id, from_id, to_id, item_id, amount)
+            else:
+                await self._abort_transfer(tx_id, from_id, item_id, amount)
+            logging.warning(f"[DB] Передача {tx_id} восстановлена после сбоя ({state})")
+        return len(pending)
+
     # --- ФЕРМА (ДЕЙСТВИЯ) ---
 
     async def plant_crop(self, user_id: int, plot_num: int, crop_id: str, ready_time: datetime) -> bool:
         try:
-            async with aiosqlite.connect(self.db_name) as db:
+            async with self._connect("farm", user_id) as db:
                 await db.execute(
                     "INSERT INTO user_plots (user_id, plot_number, crop_id, ready_time) VALUES (?, ?, ?, ?)",
                     (user_id, plot_num, crop_id, ready_time.isoformat())
                 )
-                await db.commit()
+                await self._commit(db)
             return True
         except aiosqlite.IntegrityError:
             return False
 
     async def harvest_plot(self, user_id: int, plot_num: int) -> str | None:
         """Удаляет растение с грядки и возвращает его crop_id (семя)."""
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             cursor = await db.execute(
                 "SELECT crop_id, ready_time FROM user_plots WHERE user_id = ? AND plot_number = ?", 
                 (user_id, plot_num)
@@ -430,71 +1021,77 @@ class Database:
                      return None # Еще не выросло
 
             await db.execute("DELETE FROM user_plots WHERE user_id = ? AND plot_number = ?", (user_id, plot_num))
-            await db.commit()
+            await self._commit(db)
             return row[0]
 
     async def start_brewing(self, user_id: int, batch_size: int, end_time: datetime):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             await db.execute(
                 "UPDATE user_farm_data SET brewery_batch_size = ?, brewery_batch_timer_end = ? WHERE user_id = ?",
                 (batch_size, end_time.isoformat(), user_id)
             )
-            # Добавляем уведомление
+            await self._commit(db)
+        # Добавляем уведомление
+        async with self._connect("notify") as db:
             await db.execute(
                 "INSERT INTO farm_notifications (user_id, task_type, data_json) VALUES (?, ?, ?)",
                 (user_id, 'batch', str(int(end_time.timestamp())))
             )
-            await db.commit()
+            await self._commit(db)
 
     async def collect_brewery(self, user_id: int, reward_amount: int):
         """Сбор пива: сброс таймера и начисление рейтинга."""
         await self.change_rating(user_id, reward_amount)
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             await db.execute(
                 "UPDATE user_farm_data SET brewery_batch_size = 0, brewery_batch_timer_end = NULL WHERE user_id = ?",
                 (user_id,)
             )
-            await db.commit()
+            await self._commit(db)
 
-    async def start_upgrade(self, user_id: int, building: str, end_time: datetime, cost: int):
-        """Запуск улучшения (building = 'field' или 'brewery')."""
+    async def start_upgrade(self, user_id: int, building: str, end_time: datetime, cost: int) -> bool:
+        """Запуск улучшения (building = 'field' или 'brewery'). False — не хватило рейтинга."""
         # Списание средств
-        await self.change_rating(user_id, -cost)
+        if not await self.spend_rating(user_id, cost):
+            return False
         
         col_name = f"{building}_upgrade_timer_end"
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             await db.execute(
                 f"UPDATE user_farm_data SET {col_name} = ? WHERE user_id = ?",
                 (end_time.isoformat(), user_id)
             )
-            # Добавляем уведомление
+            await self._commit(db)
+        # Добавляем уведомление
+        async with self._connect("notify") as db:
             await db.execute(
                 "INSERT INTO farm_notifications (user_id, task_type, data_json) VALUES (?, ?, ?)",
                 (user_id, f"{building}_upgrade", str(int(end_time.timestamp())))
             )
-            await db.commit()
+            await self._commit(db)
+        return True
 
     async def finish_upgrade(self, user_id: int, building: str):
         """Применяет улучшение (повышает уровень). Вызывается Updater'ом."""
         level_col = f"{building}_level"
         timer_col = f"{building}_upgrade_timer_end"
         
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             await db.execute(
                 f"UPDATE user_farm_data SET {level_col} = {level_col} + 1, {timer_col} = NULL WHERE user_id = ?",
                 (user_id,)
             )
-            await db.commit()
+            await self._commit(db)
 
     # --- ✅ ЗАКАЗЫ (ORDERS) ---
 
     async def check_and_reset_orders(self, user_id: int):
         """Проверяет, прошло ли 24 часа. Если да - удаляет старые заказы."""
-        from handlers.farm_config import get_random_orders # Импорт внутри, чтобы избежать цикличности
+        from handlers.farm_balance import get_balance # Импорт внутри, чтобы избежать цикличности
         
         now = datetime.now()
         
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             # Получаем время последнего сброса
             cursor = await db.execute("SELECT last_reset_time FROM user_orders_meta WHERE user_id = ?", (user_id,))
             row = await cursor.fetchone()
@@ -512,7 +1109,7 @@ class Database:
                 await db.execute("DELETE FROM user_orders WHERE user_id = ?", (user_id,))
                 
                 # Генерируем новые (3 шт)
-                new_order_ids = get_random_orders(3)
+                new_order_ids = get_balance().random_orders(3)
                 for i, order_id in enumerate(new_order_ids):
                     slot_id = i + 1
                     await db.execute(
@@ -525,11 +1122,11 @@ class Database:
                     "INSERT OR REPLACE INTO user_orders_meta (user_id, last_reset_time) VALUES (?, ?)",
                     (user_id, now.isoformat())
                 )
-                await db.commit()
+                await self._commit(db)
 
     async def get_user_orders(self, user_id: int) -> List[Tuple[int, str, int]]:
         """Возвращает список: [(slot_id, order_id, is_completed), ...]"""
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             cursor = await db.execute(
                 "SELECT slot_id, order_id, is_completed FROM user_orders WHERE user_id = ? ORDER BY slot_id ASC", 
                 (user_id,)
@@ -538,7 +1135,7 @@ class Database:
 
     async def complete_order(self, user_id: int, slot_id: int) -> bool:
         """Помечает заказ выполненным. Возвращает False, если уже выполнен."""
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self._connect("farm", user_id) as db:
             cursor = await db.execute(
                 "SELECT is_completed FROM user_orders WHERE user_id = ? AND slot_id = ?", 
                 (user_id, slot_id)
@@ -551,49 +1148,322 @@ class Database:
                 "UPDATE user_orders SET is_completed = 1 WHERE user_id = ? AND slot_id = ?", 
                 (user_id, slot_id)
             )
-            await db.commit()
+            await self._commit(db)
             return True
 
+    # --- ДАННЫЕ INLINE-КНОПОК ---
+
+    async def save_callback_payload(self, token: str, payload_json: str, expires_at: float):
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO callback_payloads (token, payload_json, expires_at) VALUES (?, ?, ?)",
+                (token, payload_json, expires_at)
+            )
+            await self._commit(db)
+
+    async def get_callback_payload(self, token: str) -> Tuple[str, float] | None:
+        async with self._connect() as db:
+            cursor = await db.execute("SELECT payload_json, expires_at FROM callback_payloads WHERE token = ?", (token,))
+            return await cursor.fetchone()
+
+    async def purge_callback_payloads(self, now: float) -> int:
+        async with self._connect() as db:
+            cursor = await db.execute("DELETE FROM callback_payloads WHERE expires_at < ?", (now,))
+            await self._commit(db)
+            return cursor.rowcount
+
+    # --- АРЕНДА ЛИДЕРСТВА ---
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> int | None:
+        """Берет или продлевает аренду. Возвращает fencing token или None, если аренда у другого."""
+        now = time.time()
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT INTO leases (name, holder, token, expires_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(name) DO UPDATE SET "
+                "token = CASE WHEN leases.holder = excluded.holder THEN leases.token ELSE leases.token + 1 END, "
+                "holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (name, holder, now + ttl, now)
+            )
+            await self._commit(db)
+            cursor = await db.execute("SELECT holder, token FROM leases WHERE name = ?", (name,))
+            row = await cursor.fetchone()
+            return row[1] if row and row[0] == holder else None
+
+    async def release_lease(self, name: str, holder: str):
+        """Отдает аренду сразу (при остановке), не дожидаясь истечения."""
+        async with self._connect() as db:
+            await db.execute("UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?", (name, holder))
+            await self._commit(db)
+
+    async def check_lease(self, name: str, token: int) -> bool:
+        """Действует ли еще аренда с этим токеном."""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "SELECT 1 FROM leases WHERE name = ? AND token = ? AND expires_at >= ?",
+                (name, token, time.time())
+            )
+            return await cursor.fetchone() is not None
+
+    # --- РАССЫЛКИ ---
+
+    async def enqueue_broadcast(self, from_chat_id: int, message_id: int) -> int:
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "INSERT INTO broadcasts (from_chat_id, message_id, created_at) VALUES (?, ?, ?)",
+                (from_chat_id, message_id, datetime.now().isoformat())
+            )
+            await self._commit(db)
+            return cursor.lastrowid
+
+    async def get_pending_broadcast(self) -> Tuple | None:
+        """Самая старая незавершенная рассылка: (id, from_chat_id, message_id, last_user_id, sent, errors)."""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "SELECT id, from_chat_id, message_id, last_user_id, sent, errors FROM broadcasts "
+                "WHERE status = 'pending' ORDER BY id LIMIT 1"
+            )
+            return await cursor.fetchone()
+
+    async def get_user_ids_after(self, last_user_id: int, limit: int = 100) -> List[int]:
+        async with self._connect() as db:
+            # Архивные пользователи тоже получают рассылки
+            cursor = await db.execute(
+                "SELECT user_id FROM users WHERE user_id > ? "
+                "UNION SELECT user_id FROM users_archive WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last_user_id, last_user_id, limit)
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def update_broadcast(self, broadcast_id: int, last_user_id: int, sent: int, errors: int,
+                               lease_name: str, token: int, done: bool = False) -> bool:
+        """Сохраняет прогресс рассылки, только если аренда с этим токеном еще действует (fencing).
+        False — лидер сменился, прогресс не записан."""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "UPDATE broadcasts SET last_user_id = ?, sent = ?, errors = ?, status = ? "
+                "WHERE id = ? AND EXISTS (SELECT 1 FROM leases WHERE name = ? AND token = ?)",
+                (last_user_id, sent, errors, "done" if done else "pending", broadcast_id, lease_name, token)
+            )
+            await self._commit(db)
+            return cursor.rowcount == 1
+
     # --- УВЕДОМЛЕНИЯ И ЗАДАЧИ ---
     
     async def get_pending_notifications(self):
         """Возвращает список задач, время которых пришло."""
-        now = datetime.now()
-        async with aiosqlite.connect(self.db_name) as db:
-            # Собираем задачи улучшений
-            cursor_field = await db.execute(
-                "SELECT T1.user_id, T1.task_type, T1.data_json FROM farm_notifications T1 "
-                "JOIN user_farm_data T2 ON T1.user_id = T2.user_id "
-                "WHERE T1.task_type = 'field_upgrade' AND T1.is_sent = 0 AND T2.field_upgrade_timer_end <= ?",
-                (now.isoformat(),)
-            )
-            field_tasks = await cursor_field.fetchall()
-            
-            cursor_brewery = await db.execute(
-                "SELECT T1.user_id, T1.task_type, T1.data_json FROM farm_notifications T1 "
-                "JOIN user_farm_data T2 ON T1.user_id = T2.user_id "
-                "WHERE T1.task_type = 'brewery_upgrade' AND T1.is_sent = 0 AND T2.brewery_upgrade_timer_end <= ?",
-                (now.isoformat(),)
-            )
-            brewery_tasks = await cursor_brewery.fetchall()
-            
-            cursor_batch = await db.execute(
-                "SELECT T1.user_id, T1.task_type, T1.data_json FROM farm_notifications T1 "
-                "JOIN user_farm_data T2 ON T1.user_id = T2.user_id "
-                "WHERE T1.task_type = 'batch' AND T1.is_sent = 0 AND T2.brewery_batch_timer_end <= ?",
-                (now.isoformat(),)
+        now_iso = datetime.now().isoformat()
+        timer_columns = {
+            'field_upgrade': 'field_upgrade_timer_end',
+            'brewery_upgrade': 'brewery_upgrade_timer_end',
+            'batch': 'brewery_batch_timer_end',
+        }
+        async with self._connect("notify") as db:
+            cursor = await db.execute(
+                "SELECT user_id, task_type, data_json FROM farm_notifications "
+                "WHERE is_sent = 0 AND data_json IS NOT NULL AND task_type IN (?, ?, ?)",
+                tuple(timer_columns)
             )
-            batch_tasks = await cursor_batch.fetchall()
-            
-            all_tasks = field_tasks + brewery_tasks + batch_tasks
-            
-            return [(uid, ttype, int(data)) for uid, ttype, data in all_tasks if data is not None]
+            unsent = await cursor.fetchall()
+        if not unsent:
+            return []
+
+        # Таймеры лежат в шардах фермы: один запрос на шард по его пользователям
+        by_shard: Dict[int, set] = {}
+        for uid, _, _ in unsent:
+            by_shard.setdefault(shard_of(uid, self.farm_shards), set()).add(uid)
+        timers: Dict[int, Dict[str, Any]] = {}
+        for user_ids in by_shard.values():
+            async with self._connect("farm", next(iter(user_ids))) as db:
+                placeholders = ", ".join("?" * len(user_ids))
+                cursor = await db.execute(
+                    f"SELECT user_id, {', '.join(timer_columns.values())} FROM user_farm_data "
+                    f"WHERE user_id IN ({placeholders})",
+                    tuple(user_ids)
+                )
+                for row in await cursor.fetchall():
+                    timers[row[0]] = _row_to_dict(cursor, row)
+
+        # Порядок как раньше: сначала поле, потом пивоварня, потом варки
+        all_tasks = []
+        for task_type, column in timer_columns.items():
+            for uid, ttype, data in unsent:
+                timer_end = timers.get(uid, {}).get(column)
+                if ttype == task_type and timer_end is not None and timer_end <= now_iso:
+                    all_tasks.append((uid, ttype, int(data)))
+        return all_tasks
 
     async def mark_notification_sent(self, user_id: int, task_type: str):
         """Помечает уведомление как отправленное."""
-        async with aiosqlite.connect(self.db_name, timeout=20) as db:
+        async with self._connect("notify") as db:
             await db.execute(
                 "UPDATE farm_notifications SET is_sent = 1 WHERE user_id = ? AND task_type = ?",
                 (user_id, task_type)
             )
+            await self._commit(db)
+
+    # --- ОБСЛУЖИВАНИЕ (maintenance.py): удаление отработанных строк порциями ---
+    # Всегда свое соединение и коммит каждой порции: даже внутри сессии апдейта
+    # порция не остается незакоммиченной и не держит блокировку до конца хэндлера.
+
+    async def purge_sent_notifications(self, limit: int = 500) -> int:
+        async with self._open("notify") as db:
+            cursor = await db.execute(
+                "DELETE FROM farm_notifications WHERE id IN "
+                "(SELECT id FROM farm_notifications WHERE is_sent = 1 LIMIT ?)",
+                (limit,)
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def purge_finished_ladder_games(self, before: datetime, limit: int = 500) -> int:
+        # Брошенные в 'playing' тоже: кнопки игры живут минуту (срок токена), доиграть ее уже нельзя
+        async with self._open("games") as db:
+            cursor = await db.execute(
+                "DELETE FROM ladder_games WHERE rowid IN "
+                "(SELECT rowid FROM ladder_games WHERE created_at < ? LIMIT ?)",
+                (before.isoformat(), limit)
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def purge_finished_transfers(self, before: datetime, limit: int = 500) -> int:
+        async with self._open("core") as db:
+            cursor = await db.execute(
+                "DELETE FROM transfers WHERE rowid IN "
+                "(SELECT rowid FROM transfers WHERE state IN ('done', 'aborted') AND created_at < ? LIMIT ?)",
+                (before.isoformat(), limit)
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    # --- АРХИВ НЕАКТИВНЫХ ПОЛЬЗОВАТЕЛЕЙ (archival.py) ---
+    # Порядок шагов выбран так, чтобы сбой посередине не терял данные:
+    # архивация — сначала users (core), потом ферма; восстановление — сначала ферма, потом users.
+    # Признак "в архиве" — строка в users_archive: пока она есть, следующее обращение доведет восстановление.
+# Обращение — это и вход пользователя (touch_user), и запись в его данные с чужого пути (_restore_on_write).
+    # Перенос фермы в обе стороны идет под блокировкой записи core (порядок всегда core -> шард):
+    # архивация переносит ферму только тех, кто еще в users_archive, и не может разойтись
+    # с восстановлением вернувшегося в этот момент пользователя.
+
+    @staticmethod
+    async def _move_rows(db: aiosqlite.Connection, src: str, dst: str, user_ids: List[int]) -> int:
+        cursor = await db.execute(f"PRAGMA table_info({dst})")
+        columns = ", ".join(col[1] for col in await cursor.fetchall())
+        placeholders = ", ".join("?" * len(user_ids))
+        await db.execute(
+            f"INSERT OR REPLACE INTO {dst} ({columns}) SELECT {columns} FROM {src} WHERE user_id IN ({placeholders})",
+            user_ids
+        )
+        cursor = await db.execute(f"DELETE FROM {src} WHERE user_id IN ({placeholders})", user_ids)
+        return cursor.rowcount
+
+    async def _move_farm_rows(self, shard: str, user_ids: List[int], to_archive: bool):
+        async with self._open(shard) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            for table in FARM_TABLES:
+                archive = table + ARCHIVE_SUFFIX
+                src, dst = (table, archive) if to_archive else (archive, table)
+                await self._move_rows(db, src, dst, user_ids)
+            await db.commit()
+
+    async def archive_inactive_users(self, before: datetime, limit: int = 200) -> int:
+        """Переносит до limit пользователей, не заходивших с before, в архивные таблицы."""
+        async with self._open("core") as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                "SELECT user_id FROM users WHERE last_seen < ? ORDER BY last_seen LIMIT ?",
+                (before.isoformat(), limit)
+            )
+            user_ids = [row[0] for row in await cursor.fetchall()]
+            if not user_ids:
+                await db.rollback()
+                return 0
+            await self._move_rows(db, "users", "users_archive", user_ids)
             await db.commit()
+        for uid in user_ids:
+            self._hot_users.pop(uid, None)
+
+        by_shard: Dict[str, List[int]] = {}
+        for uid in user_ids:
+            by_shard.setdefault(self._domain_key("farm", uid), []).append(uid)
+        for shard, uids in by_shard.items():
+            async with self._open("core") as core:
+                # Держим core, пока переносим ферму: вернувшиеся после первого шага уже в users — их пропускаем
+                await core.execute("BEGIN IMMEDIATE")
+                placeholders = ", ".join("?" * len(uids))
+                cursor = await core.execute(
+                    f"SELECT user_id FROM users_archive WHERE user_id IN ({placeholders})", uids
+                )
+                archived = [row[0] for row in await cursor.fetchall()]
+                if archived:
+                    await self._move_farm_rows(shard, archived, to_archive=True)
+                await core.rollback()
+        return len(user_ids)
+
+    async def restore_user(self, user_id: int) -> bool:
+        """Возвращает пользователя из архива. False — его там нет (не зарегистрирован)."""
+        async with self._open("core") as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("SELECT 1 FROM users_archive WHERE user_id = ?", (user_id,))
+            if await cursor.fetchone() is None:
+                await db.rollback()
+                return False
+            await self._move_farm_rows(self._domain_key("farm", user_id), [user_id], to_archive=False)
+            await self._move_rows(db, "users_archive", "users", [user_id])
+            await db.execute("UPDATE users SET last_seen = ? WHERE user_id = ?", (datetime.now().isoformat(), user_id))
+            await db.commit()
+        archive_log.info("[Archive] Пользователь %s восстановлен из архива", user_id)
+        return True
+
+    async def _restore_on_write(self, user_id: int) -> bool:
+        """
+        Запись не нашла строку пользователя: он мог быть в архиве, если пишет не он сам
+        (выдача админом, выплаты рейдов и рулетки, фоновые задачи). Возвращает его и отвечает,
+        стоит ли повторить запись. Недавно виденные (LRU touch_user) в архиве быть не могут.
+        Возврат и повторная запись — разные транзакции: сбой между ними оставит пользователя
+        возвращенным без записи (как после обычного обращения), возврат идемпотентен.
+        """
+        seen = self._hot_users.get(user_id)
+        if seen is not None and time.monotonic() - seen < HOT_USER_TOUCH_SECONDS:
+            return False
+        session = self._active_session()
+        if session is not None:
+            await session.flush()  # restore_user сам берет блокировки core и шарда
+        if not await self.restore_user(user_id):
+            return False
+        self._hot_users[user_id] = time.monotonic()
+        return True
+
+    async def touch_user(self, user_id: int, activity: bool = True):
+        """
+        Отмечает активность и, если нужно, возвращает пользователя из архива — до того,
+        как хэндлер его прочитает. Недавно виденные пользователи (LRU в памяти) базу не трогают.
+        """
+        now = time.monotonic()
+        seen = self._hot_users.get(user_id)
+        if seen is not None and now - seen < HOT_USER_TOUCH_SECONDS:
+            self._hot_users.move_to_end(user_id)
+            return
+        async with self._open("core") as db:
+            if activity:
+                cursor = await db.execute(
+                    "UPDATE users SET last_seen = ? WHERE user_id = ?", (datetime.now().isoformat(), user_id)
+                )
+                await db.commit()
+                hot = cursor.rowcount > 0
+            else:
+                cursor = await db.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+                hot = await cursor.fetchone() is not None
+        if not hot and not await self.restore_user(user_id):
+            return  # Не зарегистрирован — не кэшируем
+        self._hot_users[user_id] = now
+        self._hot_users.move_to_end(user_id)
+        while len(self._hot_users) > HOT_USERS_CACHE:
+            self._hot_users.popitem(last=False)
+
+
+# Время каждого метода, атрибуция запросов к методу (/db_stats, bot_db_method_seconds), span'ы трасс
+if SQL_STATS or TRACING:
+    instrument_methods(Database)
@@ -1,6 +1,8 @@
 # handlers/admin.py
 import asyncio
 import os
+from datetime import datetime
+from html import escape
 from contextlib import suppress
 import logging
 
@@ -13,9 +15,13 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
 
 import config
+from backup import backups
 from database import Database
+from maintenance import maintenance
+from monitoring import loop_monitor, profiler, query_stats, registry
 from settings import SettingsManager
 from .game_raid import start_raid_event # Импортируем функцию запуска
+from .farm_balance import load_balance, publish_reload, BalanceError, BALANCE_FILE
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
 admin_router = Router()
@@ -95,31 +101,179 @@ async def get_settings_menu(settings: SettingsManager) -> (str, InlineKeyboardMa
 async def cmd_admin(message: Message):
     await message.answer("👋 <b>Админ-панель</b>", reply_markup=await get_main_admin_keyboard(), parse_mode='HTML')
 
-# --- ✅ НОВАЯ КОМАНДА: СКАЧАТЬ БД ---
+# --- СКАЧАТЬ БД (согласованный снимок, см. backup.py) ---
 @admin_router.message(Command("get_db"), IsAdmin())
 async def cmd_download_db(message: Message):
-    # Пути для проверки (Render Disk vs Local)
-    paths_to_check = [
-        '/data/bot_database.db',  # Путь на Render (Disk)
-        'bot_database.db'         # Локальный путь
+    if not backups.supported:
+        await message.answer("⛔ Текущее хранилище не хранит данные на диске — бэкап недоступен.")
+        return
+
+    await message.answer("📂 Готовлю снимок базы данных...")
+    try:
+        result = await backups.latest()
+    except Exception as e:
+        logging.error(f"[Backup] Ошибка бэкапа по /get_db: {e}", exc_info=True)
+        await message.answer(f"⚠️ Ошибка при создании бэкапа: {e}")
+        return
+
+    try:
+        await message.answer_document(
+            FSInputFile(result.path),
+            caption=(
+                f"📦 Бэкап базы данных\n"
+                f"Файлов: {result.files}, {result.raw_size / 1024 / 1024:.1f} МБ → {result.size / 1024 / 1024:.1f} МБ (zip)\n"
+                f"Снимок за {result.duration:.1f} с, {datetime.fromtimestamp(result.created_at):%d.%m %H:%M:%S}"
+            )
+        )
+    except Exception as e:
+        await message.answer(f"⚠️ Ошибка при отправке файла: {e}\nАрхив на сервере: {result.path}")
+
+# --- ПРОФИЛИРОВАНИЕ ПО ЗАПРОСУ (см. monitoring/profiler.py) ---
+_profile_tasks = set()
+
+@admin_router.message(Command("profile"), IsAdmin(), flags={"db_session": False})
+async def cmd_profile(message: Message, bot: Bot):
+    args = message.text.split()[1:]
+    seconds = int(args[0]) if args and args[0].isdigit() else 30
+    mode = "pstats" if "pstats" in args else "sampling"
+    if profiler.running:
+        await message.answer("⛔ Профилирование уже идет.")
+        return
+
+    await message.answer(
+        f"🔬 Профилирую {seconds} с ({mode})...\n"
+        f"<i>/profile [секунды] [pstats] — pstats: cProfile (точнее, но дороже)</i>",
+        parse_mode='HTML'
+    )
+    # В фоне: не держим очередь апдейтов админа, пока идет профилирование.
+    # Ссылку храним, иначе задачу может собрать сборщик мусора; ошибки логирует сам _send_profile
+    task = asyncio.create_task(_send_profile(bot, message.chat.id, seconds, mode))
+    _profile_tasks.add(task)
+    task.add_done_callback(_profile_tasks.discard)
+
+async def _send_profile(bot: Bot, chat_id: int, seconds: int, mode: str):
+    try:
+        result = await profiler.profile(seconds, mode)
+        await bot.send_document(chat_id, FSInputFile(result.path), caption=result.describe()[:1024], parse_mode=None)
+    except Exception as e:
+        logging.error(f"[Profiler] Ошибка профилирования: {e}", exc_info=True)
+        with suppress(Exception):
+            await bot.send_message(chat_id, f"⚠️ Ошибка профилирования: {e}", parse_mode=None)
+
+# --- МЕТРИКИ ХЭНДЛЕРОВ (см. middlewares/metrics.py) ---
+STATS_TOP = 15
+
+@admin_router.message(Command("stats"), IsAdmin())
+async def cmd_stats(message: Message):
+    series = registry.histograms.get("bot_handler_seconds", {})
+    if not series:
+        await message.answer("📊 Метрик пока нет — хэндлеры еще не вызывались.")
+        return
+
+    calls = registry.counters.get("bot_handler_calls_total", {})
+    errors = {}
+    for labels, value in calls.items():
+        labels = dict(labels)
+        if labels.pop("status") == "error":
+            errors[tuple(sorted(labels.items()))] = value
+
+    # Сначала те, на кого ушло больше всего времени
+    top = sorted(series.items(), key=lambda item: item[1].total, reverse=True)[:STATS_TOP]
+    lines = ["📊 <b>Хэндлеры</b> (по суммарному времени)", "<code>handler             n    p50    p99  err</code>"]
+    for labels, hist in top:
+        name = dict(labels)["handler"]
+        prefix = dict(labels)["prefix"]
+        title = f"{name}[{prefix}]" if prefix else name
+        lines.append(
+            f"<code>{title[:18]:<18} {hist.count:>5} {hist.quantile(0.5) * 1000:>5.0f}ms {hist.quantile(0.99) * 1000:>5.0f}ms"
+            f" {int(errors.get(labels, 0)):>4}</code>"
+        )
+    in_flight = sum(registry.gauges.get("bot_handler_in_flight", {}).values())
+    lines.append(f"\nВ работе сейчас: {int(in_flight)}")
+    await message.answer("\n".join(lines), parse_mode='HTML')
+
+# --- ЗАПРОСЫ К БД (см. monitoring/sql.py) ---
+@admin_router.message(Command("db_stats"), IsAdmin())
+async def cmd_db_stats(message: Message):
+    if message.text and "reset" in message.text.split()[1:]:
+        query_stats.reset()
+        await message.answer("🗄 Статистика запросов сброшена.")
+        return
+
+    top = query_stats.top(10)
+    if not top:
+        await message.answer("🗄 Запросов к БД пока не было (или SQL_STATS=0).")
+        return
+
+    total = sum(stat.total for stat in query_stats.stats.values()) or 1e-9
+    lines = [f"🗄 <b>Топ запросов по времени</b> (медленных: {query_stats.slow_count})"]
+    for stat in top:
+        lines.append(
+            f"\n<b>{stat.total:.2f} с</b> ({stat.total / total:.0%}), {stat.count} раз, "
+            f"p50 {stat.hist.quantile(0.5) * 1000:.1f} / p99 {stat.hist.quantile(0.99) * 1000:.1f} ms"
+            f"\n<i>{escape(stat.method or '-')}</i>: <code>{escape(stat.template[:200])}</code>"
+        )
+    lines.append("\n<i>/db_stats reset — обнулить</i>")
+    await message.answer("\n".join(lines), parse_mode='HTML')
+
+# --- ОБСЛУЖИВАНИЕ БД (см. maintenance.py) ---
+@admin_router.message(Command("db_maintenance"), IsAdmin(), flags={"db_session": False})
+async def cmd_db_maintenance(message: Message):
+    if not maintenance.supported:
+        await message.answer("⛔ Текущее хранилище не хранит данные на диске — обслуживать нечего.")
+        return
+    await message.answer("🧹 Запускаю обслуживание БД...")
+    report = await maintenance.run_once()
+    await message.answer(report.describe(), parse_mode='HTML')
+
+def admin_notifier(bot: Bot, preformatted: bool = False):
+    """Функция отправки отчетов админу (для фоновых задач и сторожей). Ошибки отправки глушатся."""
+    async def report_to_admin(text: str):
+        if preformatted:
+            text = f"<pre>{escape(text[:3900])}</pre>"
+        with suppress(Exception):
+            await bot.send_message(config.ADMIN_ID, text, parse_mode='HTML')
+    return report_to_admin
+
+async def maintenance_worker(bot: Bot):
+    """Плановое обслуживание (задача лидера), отчет — админу."""
+    await maintenance.run(notify=admin_notifier(bot))
+
+# --- ЗАВИСАНИЯ EVENT LOOP (см. monitoring/loop.py) ---
+@admin_router.message(Command("loop"), IsAdmin())
+async def cmd_loop(message: Message):
+    lag = loop_monitor.lag_histogram
+    lines = [
+        "⏱ <b>Event loop</b>",
+        f"Задержка: p50 {lag.quantile(0.5) * 1000:.1f} ms, p99 {lag.quantile(0.99) * 1000:.1f} ms, "
+        f"макс {loop_monitor.max_lag * 1000:.0f} ms",
+        f"Зависаний (≥ {loop_monitor.threshold * 1000:.0f} ms): {int(sum(registry.counters.get('bot_loop_stalls_total', {}).values()))}",
+        f"Задач сейчас: {len(asyncio.all_tasks())}",
     ]
-    
-    file_path = None
-    for path in paths_to_check:
-        if os.path.exists(path):
-            file_path = path
-            break
-    
-    if file_path:
-        await message.answer("📂 Загружаю базу данных...")
-        try:
-            # Отправляем файл
-            db_file = FSInputFile(file_path)
-            await message.answer_document(db_file, caption=f"📦 Бэкап базы данных\nПуть: {file_path}")
-        except Exception as e:
-            await message.answer(f"⚠️ Ошибка при отправке файла: {e}")
-    else:
-        await message.answer("⛔ Файл базы данных не найден!\nЯ искал в: /data/bot_database.db и bot_database.db")
+    if loop_monitor.stalls:
+        last = loop_monitor.stalls[-1]
+        lines.append(f"\nПоследнее ({datetime.fromtimestamp(last.at):%d.%m %H:%M:%S}):")
+        lines.append(f"<pre>{escape(last.describe(limit=2500))}</pre>")
+    await message.answer("\n".join(lines), parse_mode='HTML')
+
+# --- ПЕРЕЗАГРУЗКА БАЛАНСА ФЕРМЫ (без рестарта) ---
+@admin_router.message(Command("reload_balance"), IsAdmin())
+async def cmd_reload_balance(message: Message, db: Database):
+    try:
+        tables = await asyncio.to_thread(load_balance, None, True)
+    except BalanceError as e:
+        await message.answer(f"⛔ Баланс не загружен, остаются старые таблицы:\n<code>{escape(str(e))}</code>", parse_mode='HTML')
+        return
+    await publish_reload(db)  # Остальные воркеры перечитают файл (balance_sync)
+    await message.answer(
+        f"✅ Баланс обновлен ({tables.source})\n"
+        f"• Поле: {len(tables.field)} ур.\n"
+        f"• Пивоварня: {len(tables.brewery)} ур.\n"
+        f"• Заказов в пуле: {len(tables.orders)}\n"
+        f"• Товаров в магазине: {len(tables.shop_prices)}\n\n"
+        f"<i>Файл: {BALANCE_FILE}</i>",
+        parse_mode='HTML'
+    )
 
 # --- Callbacks: Главное меню ---
 
@@ -142,38 +296,54 @@ async def cq_admin_broadcast(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @admin_router.message(AdminStates.broadcast_message, IsAdmin())
-async def process_broadcast(message: Message, state: FSMContext, bot: Bot, db: Database):
-    # Получаем список всех пользователей (нужен метод в DB, добавим простой SQL тут или в DB)
-    # В данном примере предположим, что рассылаем по активным чатам из active_raids (для примера) или нужно добавить get_all_users
-    # Лучше добавить метод get_all_users_ids в database.py. 
-    # Пока сделаем простой SQL запрос прямо тут для скорости (хотя лучше в DB)
-    
-    users_count = 0
-    errors_count = 0
-    
-    # ! ВАЖНО: Для реальной рассылки лучше использовать db.get_all_users_ids()
-    # Сейчас возьмем ID из таблицы users
-    try:
-        async with db.execute("SELECT user_id FROM users") as cursor:
-             users = await cursor.fetchall()
-             
-        status_msg = await message.answer(f"⏳ Начинаю рассылку на {len(users)} пользователей...")
-        
-        for user_row in users:
-            user_id = user_row[0]
-            try:
-                await message.copy_to(chat_id=user_id)
-                users_count += 1
+async def process_broadcast(message: Message, state: FSMContext, db: Database):
+    # Рассылку выполняет фоновый broadcast_worker у лидера (см. leader.py):
+    # она не блокирует апдейт и продолжается с того же места после перезапуска/смены лидера.
+    broadcast_id = await db.enqueue_broadcast(message.chat.id, message.message_id)
+    await message.answer(f"⏳ Рассылка #{broadcast_id} поставлена в очередь. Пришлю итог, когда закончу.")
+    await state.clear()
+
+
+BROADCAST_CHUNK = 100
+
+async def broadcast_worker(bot: Bot, db: Database, lease):
+    """Фоновая задача лидера: выполняет рассылки из очереди порциями по BROADCAST_CHUNK."""
+    while True:
+        try:
+            job = await db.get_pending_broadcast()
+            if not job:
+                await asyncio.sleep(10)
+                continue
+
+            broadcast_id, from_chat_id, message_id, last_user_id, sent, errors = job
+            user_ids = await db.get_user_ids_after(last_user_id, BROADCAST_CHUNK)
+            for user_id in user_ids:
+                try:
+                    await bot.copy_message(chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id)
+                    sent += 1
+                except Exception:
+                    errors += 1
                 await asyncio.sleep(0.05) # Избегаем флуд-лимитов
-            except Exception:
-                errors_count += 1
-        
-        await status_msg.edit_text(f"✅ Рассылка завершена!\nОтправлено: {users_count}\nОшибок: {errors_count}")
-            
-    except Exception as e:
-        await message.answer(f"Ошибка БД: {e}")
 
-    await state.clear()
+            done = len(user_ids) < BROADCAST_CHUNK
+            last_user_id = user_ids[-1] if user_ids else last_user_id
+            # Прогресс пишется только с действующим fencing token — бывший лидер остановится здесь
+            if not await db.update_broadcast(broadcast_id, last_user_id, sent, errors, lease.name, lease.token, done=done):
+                logging.warning(f"[Broadcast] Рассылка #{broadcast_id}: лидер сменился, останавливаюсь.")
+                return
+
+            if done:
+                logging.info(f"[Broadcast] Рассылка #{broadcast_id} завершена: {sent} отправлено, {errors} ошибок.")
+                with suppress(Exception):
+                    await bot.send_message(
+                        from_chat_id,
+                        f"✅ Рассылка #{broadcast_id} завершена!\nОтправлено: {sent}\nОшибок: {errors}"
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"[Broadcast] Ошибка: {e}", exc_info=True)
+            await asyncio.sleep(60)
 
 # --- Callbacks: Выдача пива ---
 
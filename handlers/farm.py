@@ -14,21 +14,17 @@ from aiogram.filters.callback_data import CallbackData
 from aiogram.exceptions import TelegramBadRequest
 
 from database import Database
+from callback_store import pack_payload, PayloadFilter, STALE_TEXT
 from .common import check_user_registered
 from utils import format_time_delta
 
 from .farm_config import (
     FARM_ITEM_NAMES, 
     BREWERY_RECIPE, 
-    FIELD_UPGRADES, 
-    BREWERY_UPGRADES, 
-    get_level_data,
-    SHOP_PRICES,
-    CROP_CODE_TO_ID,
     CROP_SHORT,
     SEED_TO_PRODUCT_ID,
-    FARM_ORDER_POOL
 )
+from .farm_balance import get_balance
 
 farm_router = Router()
 
@@ -90,11 +86,12 @@ async def get_farm_dashboard(user_id: int, user_name: str, db: Database) -> (str
     inventory = await db.get_user_inventory(user_id)
     active_plots = await db.get_user_plots(user_id)
     now = datetime.now()
+    balance = get_balance()
 
     # Поле
     field_lvl = farm.get('field_level', 1)
-    field_stats = get_level_data(field_lvl, FIELD_UPGRADES)
-    max_plots = field_stats['plots']
+    field_stats = balance.field_level(field_lvl)
+    max_plots = field_stats.plots
 
     ready_plots_count = 0
     growing_plots_count = 0
@@ -114,7 +111,7 @@ async def get_farm_dashboard(user_id: int, user_name: str, db: Database) -> (str
     
     # Пивоварня
     brew_lvl = farm.get('brewery_level', 1)
-    brew_stats = get_level_data(brew_lvl, BREWERY_UPGRADES)
+    brew_stats = balance.brewery_level(brew_lvl)
     
     brewery_status_text = ""
     brew_upgrade_timer = farm.get('brewery_upgrade_timer_end')
@@ -141,9 +138,9 @@ async def get_farm_dashboard(user_id: int, user_name: str, db: Database) -> (str
     can_upgrade_field = (not field_upgrade_timer_end or now >= field_upgrade_timer_end)
     can_upgrade_brewery = (not brewery_upgrade_timer_end or now >= brewery_upgrade_timer_end)
 
-    if not field_stats['max_level'] and rating >= field_stats.get('next_cost', 999999) and can_upgrade_field:
+    if not field_stats.max_level and rating >= field_stats.next_cost and can_upgrade_field:
         advice = "✨ Совет: У тебя хватает 🍺 на улучшение [🌾 Поля]!"
-    elif not brew_stats['max_level'] and rating >= brew_stats.get('next_cost', 999999) and can_upgrade_brewery:
+    elif not brew_stats.max_level and rating >= brew_stats.next_cost and can_upgrade_brewery:
         advice = "✨ Совет: У тебя хватает 🍺 на улучшение [🏭 Пивоварни]!"
     elif (not batch_timer and not brew_upgrade_timer and 
           inventory['зерно'] >= BREWERY_RECIPE['зерно'] and
@@ -205,7 +202,7 @@ async def get_farm_dashboard(user_id: int, user_name: str, db: Database) -> (str
         )])
     elif batch_timer: 
         if now >= batch_timer:
-            reward = brew_stats.get('reward', 0)
+            reward = brew_stats.reward
             total = reward * farm.get('brewery_batch_size', 0)
             kb.append([InlineKeyboardButton(text=f"🏆 Забрать +{total} 🍺", callback_data=BreweryCallback(action="collect", owner_id=user_id).pack())])
         else:
@@ -236,15 +233,15 @@ async def get_plots_dashboard(user_id: int, db: Database) -> (str, InlineKeyboar
     now = datetime.now()
 
     lvl = farm.get('field_level', 1)
-    stats = get_level_data(lvl, FIELD_UPGRADES)
-    max_plots = stats['plots']
+    stats = get_balance().field_level(lvl)
+    max_plots = stats.plots
     
-    g_time = stats.get('grow_time_min', {}).get('зерно', '??')
-    h_time = stats.get('grow_time_min', {}).get('хмель', '??')
+    g_time = stats.grow_time_min.get('зерно', '??')
+    h_time = stats.grow_time_min.get('хмель', '??')
     
     text = (
         f"<b>🌱 Поле (Ур. {lvl})</b>\n"
-        f"<i>Грядок: {stats.get('plots', '??')}, Шанс x2: {stats.get('chance_x2', '??')}%</i>\n"
+        f"<i>Грядок: {stats.plots}, Шанс x2: {stats.chance_x2}%</i>\n"
         f"<i>Время роста: 🌾 {g_time}м / 🌱 {h_time}м</i>\n\n"
         f"Нажми на <b>Пусто</b>, чтобы посадить.\n"
     )
@@ -370,26 +367,27 @@ async def cq_farm_orders_menu(callback: CallbackQuery, db: Database, callback_da
         await db.check_and_reset_orders(user_id)
         orders = await db.get_user_orders(user_id)
         inventory = await db.get_user_inventory(user_id)
+        order_pool = get_balance().orders
         
         text = "<b>📋 Доска Заказов</b>\nПоручения от бармена. Обновляются раз в 24 часа.\n"
         buttons = []
         
         for slot_id, order_id, is_completed in orders:
-            if order_id not in FARM_ORDER_POOL: continue
-            order = FARM_ORDER_POOL[order_id]
-            reward_text = f"+{order['reward_amount']} 🍺" if order['reward_type'] == 'beer' else "Предметы"
+            if order_id not in order_pool: continue
+            order = order_pool[order_id]
+            reward_text = f"+{order.reward_amount} 🍺" if order.reward_type == 'beer' else "Предметы"
             
             if is_completed:
-                text += f"\n✅ <s>{order['text']}</s> (Выполнено)\n"
+                text += f"\n✅ <s>{order.text}</s> (Выполнено)\n"
             else:
-                has_items = inventory.get(order['item_id'], 0) >= order['item_amount']
+                has_items = inventory.get(order.item_id, 0) >= order.item_amount
                 if has_items:
-                    text += f"\n➡️ <b>{order['text']}</b>\n"
+                    text += f"\n➡️ <b>{order.text}</b>\n"
                     # ✅ OrderCallback
                     cb = OrderCallback(action="complete", owner_id=user_id, slot_id=slot_id, order_id=order_id).pack()
                     buttons.append(InlineKeyboardButton(text=f"✅ Сдать ({reward_text})", callback_data=cb))
                 else:
-                    text += f"\n❌ {order['text']} (Не хватает ресурсов)\n"
+                    text += f"\n❌ {order.text} (Не хватает ресурсов)\n"
 
         kb_rows = [[btn] for btn in buttons]
         kb_rows.append(back_btn_to_farm(user_id))
@@ -405,24 +403,24 @@ async def cq_farm_order_complete(callback: CallbackQuery, db: Database, callback
     if not await check_owner(callback, callback_data.owner_id): return
     try:
         user_id = callback.from_user.id
-        order = FARM_ORDER_POOL.get(callback_data.order_id)
+        order = get_balance().orders.get(callback_data.order_id)
         if not order: return await callback.answer("Заказ устарел", show_alert=True)
 
         inv = await db.get_user_inventory(user_id)
-        if inv.get(order['item_id'], 0) < order['item_amount']:
+        if inv.get(order.item_id, 0) < order.item_amount:
             return await callback.answer("Не хватает ресурсов!", show_alert=True)
 
         if not await db.complete_order(user_id, callback_data.slot_id):
             return await callback.answer("Уже выполнено!", show_alert=True)
             
-        await db.modify_inventory(user_id, order['item_id'], -order['item_amount'])
+        await db.modify_inventory(user_id, order.item_id, -order.item_amount)
         
         msg = ""
-        if order['reward_type'] == 'beer':
-            await db.change_rating(user_id, order['reward_amount'])
-            msg = f"+{order['reward_amount']} 🍺"
-        elif order['reward_type'] == 'item':
-            await db.modify_inventory(user_id, order['reward_id'], order['reward_amount'])
+        if order.reward_type == 'beer':
+            await db.change_rating(user_id, order.reward_amount)
+            msg = f"+{order.reward_amount} 🍺"
+        elif order.reward_type == 'item':
+            await db.modify_inventory(user_id, order.reward_id, order.reward_amount)
             msg = f"+Предметы"
 
         await callback.answer(f"Заказ выполнен! {msg}", show_alert=True)
@@ -440,10 +438,11 @@ async def cq_plot_plant_menu(callback: CallbackQuery, callback_data: PlotCallbac
     
     text = f"<b>🌱 Посадка — Грядка {callback_data.plot_num}</b>\nНа складе:\n🌾 {inv['семя_зерна']} | 🌱 {inv['семя_хмеля']}"
     btns = []
-    if inv['семя_зерна'] > 0:
-        btns.append(InlineKeyboardButton(text="Посадить 🌾 Зерно", callback_data=PlotCallback(action="plant_do", owner_id=user_id, plot_num=callback_data.plot_num, crop_id="g").pack()))
-    if inv['семя_хмеля'] > 0:
-        btns.append(InlineKeyboardButton(text="Посадить 🌱 Хмель", callback_data=PlotCallback(action="plant_do", owner_id=user_id, plot_num=callback_data.plot_num, crop_id="h").pack()))
+    # (Семя передаем через callback_store — без кодов под лимит 64 байта)
+    for seed_id, label in (('семя_зерна', "Посадить 🌾 Зерно"), ('семя_хмеля', "Посадить 🌱 Хмель")):
+        if inv[seed_id] > 0:
+            payload = {"owner_id": user_id, "plot_num": callback_data.plot_num, "crop_id": seed_id}
+            btns.append(InlineKeyboardButton(text=label, callback_data=pack_payload("plant_do", payload)))
     
     rows_kb = rows(btns, 1)
     if not btns:
@@ -455,25 +454,32 @@ async def cq_plot_plant_menu(callback: CallbackQuery, callback_data: PlotCallbac
         await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows_kb))
     await callback.answer()
 
-@farm_router.callback_query(PlotCallback.filter(F.action == "plant_do"))
-async def cq_plot_plant_do(callback: CallbackQuery, callback_data: PlotCallback, db: Database):
-    if not await check_owner(callback, callback_data.owner_id): return
+@farm_router.callback_query(PayloadFilter("plant_do"))
+async def cq_plot_plant_do(callback: CallbackQuery, payload: Optional[dict], db: Database):
+    if payload is None: return await callback.answer(STALE_TEXT, show_alert=True)
+    if not await check_owner(callback, payload["owner_id"]): return
     user_id = callback.from_user.id
-    crop_id = CROP_CODE_TO_ID.get(callback_data.crop_id)
+    crop_id = payload["crop_id"]
+    plot_num = payload["plot_num"]
     
     if await db.modify_inventory(user_id, crop_id, -1):
         farm = await db.get_user_farm_data(user_id)
-        stats = get_level_data(farm.get('field_level', 1), FIELD_UPGRADES)
+        stats = get_balance().field_level(farm.get('field_level', 1))
         prod_id = SEED_TO_PRODUCT_ID[crop_id]
-        minutes = stats['grow_time_min'][prod_id]
+        minutes = stats.grow_time_min[prod_id]
         ready = datetime.now() + timedelta(minutes=minutes)
         
-        await db.plant_crop(user_id, callback_data.plot_num, crop_id, ready)
+        await db.plant_crop(user_id, plot_num, crop_id, ready)
         await callback.answer(f"Посажено! Ждать {minutes} мин.")
         await cq_farm_view_plots(callback, FarmCallback(action="view_plots", owner_id=user_id), db)
     else:
         await callback.answer("Нет семян!", show_alert=True)
 
+@farm_router.callback_query(PlotCallback.filter(F.action == "plant_do"))
+async def cq_plot_plant_do_legacy(callback: CallbackQuery):
+    # (Старые кнопки посадки с кодами "g"/"h" из уже отправленных сообщений)
+    await callback.answer(STALE_TEXT, show_alert=True)
+
 @farm_router.callback_query(PlotCallback.filter(F.action == "harvest"))
 async def cq_plot_harvest(callback: CallbackQuery, callback_data: PlotCallback, db: Database):
     if not await check_owner(callback, callback_data.owner_id): return
@@ -519,8 +525,8 @@ async def cq_brewery_do(callback: CallbackQuery, callback_data: BreweryCallback,
        await db.modify_inventory(uid, 'хмель', -BREWERY_RECIPE['хмель']*qty):
            
         farm = await db.get_user_farm_data(uid)
-        stats = get_level_data(farm.get('brewery_level', 1), BREWERY_UPGRADES)
-        minutes = stats['brew_time_min']
+        stats = get_balance().brewery_level(farm.get('brewery_level', 1))
+        minutes = stats.brew_time_min
         ready = datetime.now() + timedelta(minutes=minutes*qty)
         
         await db.start_brewing(uid, qty, ready)
@@ -534,8 +540,8 @@ async def cq_brewery_collect(callback: CallbackQuery, callback_data: BreweryCall
     if not await check_owner(callback, callback_data.owner_id): return
     uid = callback.from_user.id
     farm = await db.get_user_farm_data(uid)
-    stats = get_level_data(farm.get('brewery_level', 1), BREWERY_UPGRADES)
-    reward = stats['reward'] * farm.get('brewery_batch_size', 1)
+    stats = get_balance().brewery_level(farm.get('brewery_level', 1))
+    reward = stats.reward * farm.get('brewery_batch_size', 1)
     
     await db.collect_brewery(uid, reward)
     await callback.answer(f"Сварено! +{reward} 🍺")
@@ -562,6 +568,7 @@ async def cq_farm_upgrades(callback: CallbackQuery, callback_data: FarmCallback,
     user_id = callback.from_user.id
     balance = await db.get_user_beer_rating(user_id)
     farm = await db.get_user_farm_data(user_id)
+    tables = get_balance()
     
     text = f"<b>⭐ Улучшения</b>\n<i>Твой Рейтинг: {balance} 🍺</i>\n\n"
     buttons = []
@@ -572,11 +579,11 @@ async def cq_farm_upgrades(callback: CallbackQuery, callback_data: FarmCallback,
     if farm.get('field_upgrade_timer_end'):
         text += "<i>(Строится...)</i>\n"
     else:
-        f_next = get_level_data(f_lvl + 1, FIELD_UPGRADES)
-        if f_next.get('max_level'):
+        f_next = tables.field_level(f_lvl + 1)
+        if f_next.max_level:
             text += "<b>⭐ Макс. уровень!</b>\n"
         else:
-             cost = f_next['cost']
+             cost = f_next.cost
              text += f"Цена: {cost} 🍺\n"
              if balance >= cost:
                  buttons.append([InlineKeyboardButton(text=f"⬆️ Улучшить Поле", callback_data=UpgradeCallback(action="buy_field", owner_id=user_id).pack())])
@@ -589,11 +596,11 @@ async def cq_farm_upgrades(callback: CallbackQuery, callback_data: FarmCallback,
     if farm.get('brewery_upgrade_timer_end'):
         text += "<i>(Строится...)</i>\n"
     else:
-        b_next = get_level_data(b_lvl + 1, BREWERY_UPGRADES)
-        if b_next.get('max_level'):
+        b_next = tables.brewery_level(b_lvl + 1)
+        if b_next.max_level:
              text += "<b>⭐ Макс. уровень!</b>\n"
         else:
-             cost = b_next['cost']
+             cost = b_next.cost
              text += f"Цена: {cost} 🍺\n"
              if balance >= cost:
                  buttons.append([InlineKeyboardButton(text=f"⬆️ Улучшить Пивоварню", callback_data=UpgradeCallback(action="buy_brewery", owner_id=user_id).pack())])
@@ -609,9 +616,11 @@ async def cq_upgrade_confirm(callback: CallbackQuery, callback_data: UpgradeCall
     b_type = "field" if callback_data.action == "buy_field" else "brewery"
     farm = await db.get_user_farm_data(callback.from_user.id)
     lvl = farm.get(f'{b_type}_level', 1)
-    stats = get_level_data(lvl + 1, FIELD_UPGRADES if b_type == 'field' else BREWERY_UPGRADES)
+    tables = get_balance()
+    stats = tables.field_level(lvl + 1) if b_type == 'field' else tables.brewery_level(lvl + 1)
     
-    await db.start_upgrade(callback.from_user.id, b_type, datetime.now() + timedelta(hours=stats['time_h']), stats['cost'])
+    if not await db.start_upgrade(callback.from_user.id, b_type, datetime.now() + timedelta(hours=stats.time_h), stats.cost):
+        return await callback.answer(f"⛔ Недостаточно 🍺! Нужно: {stats.cost} 🍺", show_alert=True)
     await callback.answer("Стройка началась!")
     await cq_farm_main_dashboard(callback, FarmCallback(action="main_dashboard", owner_id=callback.from_user.id), db)
 
@@ -0,0 +1,285 @@
+# handlers/farm_balance.py
+import asyncio
+import json
+import logging
+import os
+import random
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from . import farm_config
+
+# Внешний файл баланса (JSON). Если файла нет при запуске — используются значения из farm_config.
+BALANCE_FILE = os.getenv("BALANCE_FILE", "balance.json")
+
+# Таблицы живут в памяти процесса. С WORKERS > 1 /reload_balance попадает в один воркер,
+# остальные подхватывают перезагрузку по счетчику в game_data (balance_sync) за BALANCE_SYNC_SECONDS.
+BALANCE_VERSION_KEY = "balance_version"
+BALANCE_SYNC_SECONDS = 5
+
+
+class BalanceError(ValueError):
+    """Таблица баланса не прошла проверку."""
+
+
+# --- ЗАПИСИ УРОВНЕЙ (неизменяемые) ---
+
+@dataclass(frozen=True, slots=True)
+class FieldLevel:
+    level: int
+    cost: int
+    time_h: int
+    plots: int
+    chance_x2: int
+    grow_time_min: Mapping[str, int]
+    max_level: bool
+    next_cost: Optional[int]
+    next_time_h: Optional[int]
+
+
+@dataclass(frozen=True, slots=True)
+class BreweryLevel:
+    level: int
+    cost: int
+    time_h: int
+    reward: int
+    brew_time_min: int
+    max_level: bool
+    next_cost: Optional[int]
+    next_time_h: Optional[int]
+
+
+@dataclass(frozen=True, slots=True)
+class FarmOrder:
+    order_id: str
+    text: str
+    item_id: str
+    item_amount: int
+    reward_type: str
+    reward_amount: int
+    reward_id: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class BalanceTables:
+    field: Tuple[FieldLevel, ...]      # индекс = уровень - 1
+    brewery: Tuple[BreweryLevel, ...]  # индекс = уровень - 1
+    orders: Mapping[str, FarmOrder]
+    order_ids: Tuple[str, ...]
+    shop_prices: Mapping[str, int]
+    source: str
+
+    def field_level(self, level: int) -> FieldLevel:
+        """Данные уровня Поля. Уровень за пределами таблицы прижимается к краю."""
+        return self.field[min(max(level, 1), len(self.field)) - 1]
+
+    def brewery_level(self, level: int) -> BreweryLevel:
+        """Данные уровня Пивоварни. Уровень за пределами таблицы прижимается к краю."""
+        return self.brewery[min(max(level, 1), len(self.brewery)) - 1]
+
+    def random_orders(self, count: int = 3) -> list:
+        """Возвращает N случайных ID заказов из пула."""
+        if len(self.order_ids) < count:
+            return list(self.order_ids)
+        return random.sample(self.order_ids, count)
+
+
+# --- ПРОВЕРКИ ---
+
+def _int(value: Any, where: str, minimum: int = 0) -> int:
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise BalanceError(f"{where}: ожидается целое число, получено {value!r}")
+    if value < minimum:
+        raise BalanceError(f"{where}: значение {value} меньше {minimum}")
+    return value
+
+
+def _levels(raw: Mapping, section: str) -> Dict[int, Mapping]:
+    """Приводит ключи уровней к int (в JSON они строки) и проверяет, что уровни идут подряд с 1."""
+    if not isinstance(raw, Mapping) or not raw:
+        raise BalanceError(f"{section}: таблица уровней пуста")
+    try:
+        levels = {int(k): v for k, v in raw.items()}
+    except (TypeError, ValueError):
+        raise BalanceError(f"{section}: уровни должны быть числами")
+    if sorted(levels) != list(range(1, len(levels) + 1)):
+        raise BalanceError(f"{section}: уровни должны идти подряд, начиная с 1")
+    for lvl, data in levels.items():
+        if not isinstance(data, Mapping):
+            raise BalanceError(f"{section}[{lvl}]: ожидается объект")
+    return levels
+
+
+def _compile_field(raw: Mapping) -> Tuple[FieldLevel, ...]:
+    levels = _levels(raw, "field_upgrades")
+    products = set(farm_config.SEED_TO_PRODUCT_ID.values())
+    max_lvl = len(levels)
+    records = []
+    for lvl in range(1, max_lvl + 1):
+        data, where = levels[lvl], f"field_upgrades[{lvl}]"
+        grow = data.get("grow_time_min")
+        if not isinstance(grow, Mapping) or set(grow) != products:
+            raise BalanceError(f"{where}.grow_time_min: нужны ключи {sorted(products)}")
+        nxt = levels.get(lvl + 1)
+        chance = _int(data.get("chance_x2"), f"{where}.chance_x2")
+        if chance > 100:
+            raise BalanceError(f"{where}.chance_x2: шанс больше 100%")
+        records.append(FieldLevel(
+            level=lvl,
+            cost=_int(data.get("cost"), f"{where}.cost"),
+            time_h=_int(data.get("time_h"), f"{where}.time_h"),
+            plots=_int(data.get("plots"), f"{where}.plots", minimum=1),
+            chance_x2=chance,
+            grow_time_min=MappingProxyType({p: _int(grow[p], f"{where}.grow_time_min.{p}", minimum=1) for p in grow}),
+            max_level=(lvl == max_lvl),
+            next_cost=nxt.get("cost") if nxt else None,
+            next_time_h=nxt.get("time_h") if nxt else None,
+        ))
+    return tuple(records)
+
+
+def _compile_brewery(raw: Mapping) -> Tuple[BreweryLevel, ...]:
+    levels = _levels(raw, "brewery_upgrades")
+    max_lvl = len(levels)
+    records = []
+    for lvl in range(1, max_lvl + 1):
+        data, where = levels[lvl], f"brewery_upgrades[{lvl}]"
+        nxt = levels.get(lvl + 1)
+        records.append(BreweryLevel(
+            level=lvl,
+            cost=_int(data.get("cost"), f"{where}.cost"),
+            time_h=_int(data.get("time_h"), f"{where}.time_h"),
+            reward=_int(data.get("reward"), f"{where}.reward"),
+            brew_time_min=_int(data.get("brew_time_min"), f"{where}.brew_time_min", minimum=1),
+            max_level=(lvl == max_lvl),
+            next_cost=nxt.get("cost") if nxt else None,
+            next_time_h=nxt.get("time_h") if nxt else None,
+        ))
+    return tuple(records)
+
+
+def _compile_orders(raw: Mapping) -> Mapping[str, FarmOrder]:
+    if not isinstance(raw, Mapping) or not raw:
+        raise BalanceError("farm_order_pool: пул заказов пуст")
+    items = farm_config.FARM_ITEM_NAMES
+    orders = {}
+    for order_id, data in raw.items():
+        where = f"farm_order_pool[{order_id}]"
+        if not isinstance(data, Mapping) or not isinstance(data.get("text"), str):
+            raise BalanceError(f"{where}: нужен объект с полем text")
+        if data.get("item_id") not in items:
+            raise BalanceError(f"{where}.item_id: неизвестный предмет {data.get('item_id')!r}")
+        reward_type = data.get("reward_type")
+        reward_id = data.get("reward_id")
+        if reward_type not in ("beer", "item"):
+            raise BalanceError(f"{where}.reward_type: ожидается 'beer' или 'item'")
+        if reward_type == "item" and reward_id not in items:
+            raise BalanceError(f"{where}.reward_id: неизвестный предмет {reward_id!r}")
+        orders[order_id] = FarmOrder(
+            order_id=order_id,
+            text=data["text"],
+            item_id=data["item_id"],
+            item_amount=_int(data.get("item_amount"), f"{where}.item_amount", minimum=1),
+            reward_type=reward_type,
+            reward_amount=_int(data.get("reward_amount"), f"{where}.reward_amount", minimum=1),
+            reward_id=reward_id if reward_type == "item" else None,
+        )
+    return MappingProxyType(orders)
+
+
+def _compile_prices(raw: Mapping) -> Mapping[str, int]:
+    if not isinstance(raw, Mapping):
+        raise BalanceError("shop_prices: ожидается объект")
+    for item_id, price in raw.items():
+        if item_id not in farm_config.FARM_ITEM_NAMES:
+            raise BalanceError(f"shop_prices: неизвестный предмет {item_id!r}")
+        _int(price, f"shop_prices[{item_id}]", minimum=1)
+    return MappingProxyType(dict(raw))
+
+
+def compile_tables(raw: Mapping, source: str = "farm_config") -> BalanceTables:
+    """Собирает и проверяет таблицы баланса. Отсутствующие разделы берутся из farm_config."""
+    orders = _compile_orders(raw.get("farm_order_pool", farm_config.FARM_ORDER_POOL))
+    return BalanceTables(
+        field=_compile_field(raw.get("field_upgrades", farm_config.FIELD_UPGRADES)),
+        brewery=_compile_brewery(raw.get("brewery_upgrades", farm_config.BREWERY_UPGRADES)),
+        orders=orders,
+        order_ids=tuple(orders),
+        shop_prices=_compile_prices(raw.get("shop_prices", farm_config.SHOP_PRICES)),
+        source=source,
+    )
+
+
+# --- ТЕКУЩИЕ ТАБЛИЦЫ ---
+# Таблицы меняются только целиком (одно присваивание), поэтому читатель
+# всегда видит либо старый, либо новый набор — никогда не наполовину загруженный.
+# Хэндлеру достаточно взять get_balance() один раз и работать с этим снимком.
+
+_tables: BalanceTables = compile_tables({})
+
+
+def get_balance() -> BalanceTables:
+    return _tables
+
+
+def load_balance(path: str | None = None, required: bool = False) -> BalanceTables:
+    """Читает файл баланса, проверяет его и атомарно подменяет текущие таблицы.
+    При ошибке бросает BalanceError, текущие таблицы остаются прежними.
+    required=True (явная перезагрузка) — отсутствие файла тоже ошибка, а не возврат к встроенным таблицам."""
+    global _tables
+    path = path or BALANCE_FILE
+    if not os.path.exists(path):
+        if required:
+            raise BalanceError(f"Файл баланса {path} не найден")
+        logging.info(f"Файл баланса {path} не найден, используются встроенные таблицы.")
+        _tables = compile_tables({})
+        return _tables
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise BalanceError(f"Не удалось прочитать {path}: {e}")
+    if not isinstance(raw, dict):
+        raise BalanceError(f"{path}: ожидается JSON-объект")
+
+    tables = compile_tables(raw, source=path)
+    _tables = tables
+    logging.info(
+        f"Баланс загружен из {path}: поле {len(tables.field)} ур., "
+        f"пивоварня {len(tables.brewery)} ур., заказов {len(tables.orders)}."
+    )
+    return tables
+
+
+# --- ПЕРЕЗАГРУЗКА ВО ВСЕХ ВОРКЕРАХ ---
+
+_synced_version: Optional[int] = None
+
+
+async def publish_reload(db) -> int:
+    """Отмечает перезагрузку баланса в БД (после успешного load_balance в этом процессе)."""
+    global _synced_version
+    version = (await db.get_setting(BALANCE_VERSION_KEY) or 0) + 1
+    await db.update_setting(BALANCE_VERSION_KEY, version)
+    _synced_version = version
+    return version
+
+
+async def balance_sync(db, interval: float = BALANCE_SYNC_SECONDS):
+    """Задача каждого воркера: перечитывает файл баланса, когда /reload_balance выполнили в другом процессе."""
+    global _synced_version
+    _synced_version = await db.get_setting(BALANCE_VERSION_KEY)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = await db.get_setting(BALANCE_VERSION_KEY)
+            if version == _synced_version:
+                continue
+            _synced_version = version
+            await asyncio.to_thread(load_balance, None, True)
+        except BalanceError as e:
+            logging.error(f"Баланс не перезагружен, остаются старые таблицы: {e}")
+        except Exception as e:
+            logging.error(f"Ошибка синхронизации баланса: {e}")
@@ -1,11 +1,6 @@
 # handlers/farm_config.py
-import random # ✅ НОВЫЙ ИМПОРТ
-
-# --- КОДЫ ДЛЯ CALLBACK (Фикс 64 байт) ---
-CROP_CODE_TO_ID = {
-    "g": "семя_зерна", # g = grain (зерно)
-    "h": "семя_хмеля", # h = hops (хмель)
-}
+# (Значения по умолчанию. В игре используются скомпилированные таблицы из farm_balance.py,
+#  которые можно переопределить файлом баланса без перезапуска — /reload_balance)
 
 # --- Короткие имена для UI ---
 CROP_SHORT = {
@@ -81,20 +76,6 @@ BREWERY_UPGRADES = {
 }
 # --- --- ---
 
-# --- ФУНКЦИЯ ДЛЯ УЛУЧШЕНИЙ ---
-def get_level_data(level: int, upgrade_data: dict) -> dict:
-    data = upgrade_data.get(level, {}).copy() 
-    max_level_num = max(upgrade_data.keys())
-    data['max_level'] = (level == max_level_num)
-    if not data and level > max_level_num:
-        data = upgrade_data.get(max_level_num, {}).copy()
-        data['max_level'] = True
-    if not data.get('max_level', False):
-        next_level_data = upgrade_data.get(level + 1, {})
-        data['next_cost'] = next_level_data.get('cost')
-        data['next_time_h'] = next_level_data.get('time_h')
-    return data
-
 # --- ✅✅✅ НОВЫЙ КОД: ДОСКА ЗАКАЗОВ ✅✅✅ ---
 # Пул всех заданий, из которых бот будет выбирать 3.
 FARM_ORDER_POOL = {
@@ -158,10 +139,4 @@ FARM_ORDER_POOL = {
     }
 }
 
-def get_random_orders(count=3) -> list:
-    """Возвращает N случайных ID заказов из пула."""
-    all_order_keys = list(FARM_ORDER_POOL.keys())
-    if len(all_order_keys) < count:
-        return all_order_keys 
-    return random.sample(all_order_keys, count)
 # --- --- ---
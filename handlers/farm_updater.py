@@ -31,7 +31,7 @@ async def farm_background_updater(bot: Bot, db: Database):
             tasks = await db.get_pending_notifications()
             
             for user_id, task_type, data in tasks:
-                logging.info(f"[Farm Updater] Найдена задача (Task): {task_type} для {user_id}")
+                logging.debug("[Farm Updater] Найдена задача (Task): %s для %s", task_type, user_id)
                 
                 text = ""
                 keyboard = get_refresh_button(user_id) # (Кнопка 'Открыть Ферму')
@@ -65,7 +65,7 @@ async def farm_background_updater(bot: Bot, db: Database):
             crop_tasks = await db.get_pending_crop_notifications()
             
             for user_id, plot_num, crop_id in crop_tasks:
-                logging.info(f"[Farm Updater] Найдена задача (Crop): {crop_id} (Plot {plot_num}) для {user_id}")
+                logging.debug("[Farm Updater] Найдена задача (Crop): %s (Plot %s) для %s", crop_id, plot_num, user_id)
                 
                 try:
                     # (Берем имя "🌾 Зерно" из farm_config)
@@ -84,6 +84,10 @@ async def farm_background_updater(bot: Bot, db: Database):
                     logging.error(f"[Farm Updater] Ошибка обработки УРОЖАЯ для {user_id}: {e}")
             # --- ---
 
+            # (Одна строка на цикл вместо строки на каждое уведомление)
+            if tasks or crop_tasks:
+                logging.info("[Farm Updater] Уведомлений: задачи %d, урожай %d", len(tasks), len(crop_tasks))
+
         except Exception as e:
             logging.error(f"[Farm Updater] Критическая ошибка в цикле: {e}")
         
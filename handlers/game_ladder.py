@@ -1,10 +1,15 @@
 # handlers/game_ladder.py
 import asyncio
-import random
-from datetime import datetime, timedelta
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+import time
 from contextlib import suppress
 import logging
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, User, Chat
@@ -24,28 +29,103 @@ ladder_router = Router()
 # --- CALLBACKDATA ---
 class LadderCallbackData(CallbackData, prefix="ladder"):
     action: str
-    level: int = 0
-    choice: int = 0
-    stake: int = 0
+    token: str = ""   # Подписанное состояние игры (play / cash_out)
+    stake: int = 0    # Только для play_again
 
 # --- КЛАССЫ И КОНСТАНТЫ ---
+LADDER_LEVELS = 10
+LADDER_INACTIVITY_TIMEOUT_SECONDS = 60
+
+# Таймеры бездействия, запущенные этим процессом {game_id: asyncio.Task}
+# (Сама игра в памяти не хранится — всё состояние в кнопках)
+ladder_timeouts: Dict[str, asyncio.Task] = {}
+
+
 class LadderGameState:
-    def __init__(self, player_id, chat_id, message_id, stake, correct_path):
+    """Состояние игры, восстановленное из токена кнопки. Правильный путь выводится из seed."""
+
+    def __init__(self, player_id, chat_id, message_id, stake, seed: bytes, current_level: int = 1):
         self.player_id = player_id
         self.chat_id = chat_id
         self.message_id = message_id
         self.stake = stake
-        self.correct_path: List[int] = correct_path
-        self.player_choices = {}
-        self.current_level = 1
-        self.current_win = 0.0
+        self.seed = seed
+        self.correct_path: List[int] = correct_path_for(seed)
+        self.current_level = current_level
         self.is_finished = False
         self.last_choice = -1
-        self.task = None
 
-LADDER_LEVELS = 10
-LADDER_INACTIVITY_TIMEOUT_SECONDS = 60
-active_ladder_games = {}
+    @property
+    def game_id(self) -> str:
+        return self.seed.hex()
+
+    @property
+    def player_choices(self) -> Dict[int, int]:
+        # Пройденные уровни всегда пройдены по правильному пути
+        return {idx: self.correct_path[idx] for idx in range(self.current_level - 1)}
+
+    @property
+    def current_win(self) -> float:
+        if self.current_level <= 1:
+            return 0.0
+        return calculate_ladder_rewards(self.stake)[min(self.current_level, LADDER_LEVELS + 1) - 2]
+
+
+# --- ПОДПИСАННЫЕ ТОКЕНЫ ---
+# Токен = seed(6) | player_id(8) | stake(4) | level(1) | choice(1) | issued(4) | HMAC(8), в base64url (43 символа).
+# HMAC покрывает также action и chat_id, поэтому кнопку нельзя подделать или перенести в другой чат.
+# issued — время выдачи кнопки: токен живет LADDER_INACTIVITY_TIMEOUT_SECONDS. Запись в ladder_games
+# maintenance.py удаляет через дни, а старую кнопку "play" первого уровня без срока можно было бы
+# нажать снова — игра началась бы без списания ставки.
+_TOKEN_BODY = struct.Struct(">6sQIBBI")
+_MAC_SIZE = 8
+_secret: Optional[bytes] = None
+
+
+def _get_secret() -> bytes:
+    global _secret
+    if _secret is None:
+        raw = os.getenv("LADDER_SECRET") or os.getenv("BOT_TOKEN")
+        if not raw:
+            raise RuntimeError("❌ Нет LADDER_SECRET (или BOT_TOKEN) для подписи Лесенки")
+        _secret = hashlib.sha256(b"ladder:" + raw.encode()).digest()
+    return _secret
+
+
+def correct_path_for(seed: bytes) -> List[int]:
+    digest = hmac.new(_get_secret(), b"path:" + seed, hashlib.sha256).digest()
+    return [(digest[i // 8] >> (i % 8)) & 1 for i in range(LADDER_LEVELS)]
+
+
+def _mac(action: str, chat_id: int, body: bytes) -> bytes:
+    msg = f"{action}:{chat_id}:".encode() + body
+    return hmac.new(_get_secret(), msg, hashlib.sha256).digest()[:_MAC_SIZE]
+
+
+def encode_ladder_token(game: LadderGameState, action: str, choice: int = 0) -> str:
+    body = _TOKEN_BODY.pack(game.seed, game.player_id, game.stake, game.current_level, choice, int(time.time()))
+    raw = body + _mac(action, game.chat_id, body)
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_ladder_token(token: str, action: str, chat_id: int) -> Optional[Tuple[LadderGameState, int]]:
+    """Проверяет подпись и срок и возвращает (состояние, выбор). None — токен битый, чужой или устарел."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) != _TOKEN_BODY.size + _MAC_SIZE:
+        return None
+    body, mac = raw[:_TOKEN_BODY.size], raw[_TOKEN_BODY.size:]
+    if not hmac.compare_digest(mac, _mac(action, chat_id, body)):
+        return None
+    seed, player_id, stake, level, choice, issued = _TOKEN_BODY.unpack(body)
+    if not (1 <= level <= LADDER_LEVELS) or choice not in (0, 1):
+        return None
+    if not 0 <= time.time() - issued <= LADDER_INACTIVITY_TIMEOUT_SECONDS:
+        return None
+    return LadderGameState(player_id, chat_id, 0, stake, seed, level), choice
+
 
 LADDER_MULTIPLIERS = [1.2, 1.3, 1.4, 1.5, 1.6, 1.7, 1.8, 2.0, 2.2, 2.5]
 def calculate_ladder_rewards(stake: int) -> List[float]:
@@ -57,26 +137,24 @@ def calculate_ladder_rewards(stake: int) -> List[float]:
     return rewards
 
 # --- ФУНКЦИИ ИГРЫ ---
-async def schedule_ladder_timeout(chat_id: int, player_id: int, message_id: int, stake: int, bot: Bot, db: Database):
+async def schedule_ladder_timeout(game_id: str, chat_id: int, player_id: int, message_id: int, stake: int, bot: Bot, db: Database):
     try:
         await asyncio.sleep(LADDER_INACTIVITY_TIMEOUT_SECONDS)
-        if chat_id in active_ladder_games:
-            game = active_ladder_games[chat_id]
-            if game.player_id == player_id and game.current_level == 1 and not game.is_finished:
-                await db.change_rating(player_id, stake)
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=f"⏰ Игра в 'Лесенку' отменена из-за бездействия. Ваша ставка {stake} 🍺 возвращена."
-                )
-                with suppress(TelegramBadRequest):
-                    await bot.delete_message(chat_id=chat_id, message_id=message_id)
-                del active_ladder_games[chat_id]
+        # Первый ход "занимает" игру в БД. Если хода не было — занимаем ее сами и возвращаем ставку.
+        if await db.claim_ladder_game(game_id, "timeout"):
+            await db.change_rating(player_id, stake)
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"⏰ Игра в 'Лесенку' отменена из-за бездействия. Ваша ставка {stake} 🍺 возвращена."
+            )
+            with suppress(TelegramBadRequest):
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
     except asyncio.CancelledError:
         pass
     except Exception as e:
         logging.error(f"Ошибка в таймере бездействия Лесенки для чата {chat_id}: {e}")
-        if chat_id in active_ladder_games:
-            del active_ladder_games[chat_id]
+    finally:
+        ladder_timeouts.pop(game_id, None)
 
 async def generate_ladder_keyboard(game: LadderGameState, rewards: List[float], reveal: bool = False, is_win: bool = False) -> InlineKeyboardMarkup:
     keyboard = []
@@ -111,14 +189,14 @@ async def generate_ladder_keyboard(game: LadderGameState, rewards: List[float],
             
             callback_data = "do_nothing"
             if is_active:
-                callback_data = LadderCallbackData(action="play", level=i, choice=j, stake=game.stake).pack()
+                callback_data = LadderCallbackData(action="play", token=encode_ladder_token(game, "play", j)).pack()
                 
             row.append(InlineKeyboardButton(text=btn_text, callback_data=callback_data))
         keyboard.append(row)
     
     if not game.is_finished:
         cash_out_text = f"💰 Забрать выигрыш ({game.current_win} 🍺)" if game.current_win > 0 else "💰 Забрать ставку"
-        keyboard.append([InlineKeyboardButton(text=cash_out_text, callback_data=LadderCallbackData(action="cash_out", stake=game.stake).pack())])
+        keyboard.append([InlineKeyboardButton(text=cash_out_text, callback_data=LadderCallbackData(action="cash_out", token=encode_ladder_token(game, "cash_out")).pack())])
     else:
         keyboard.append([InlineKeyboardButton(text=f"🔁 Играть снова ({game.stake} 🍺)", callback_data=LadderCallbackData(action="play_again", stake=game.stake).pack())])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -127,10 +205,11 @@ async def generate_ladder_text(game: LadderGameState) -> str:
     return (f"🪜 <b>Пивная Лесенка</b> 🪜\n\n" f"Ставка: <b>{game.stake} 🍺</b> | Текущий выигрыш: <b>{game.current_win} 🍺</b>")
 
 async def end_ladder_game(bot: Bot, chat_id: int, user: User, game: LadderGameState, is_win: bool, db: Database):
+    # Единственное место, где игра читает БД: завершить (и выплатить) ее можно только один раз,
+    # даже если кнопку нажали дважды или ход пришел в другой процесс.
+    if not await db.finish_ladder_game(game.game_id, "paid" if is_win else "lost"):
+        return
     game.is_finished = True
-    if game.task:
-        game.task.cancel()
-        game.task = None
     
     with suppress(TelegramBadRequest):
         await bot.delete_message(chat_id=game.chat_id, message_id=game.message_id)
@@ -155,9 +234,6 @@ async def end_ladder_game(bot: Bot, chat_id: int, user: User, game: LadderGameSt
 
     await bot.send_message(chat_id=chat_id, text=f"{text}\n\n{final_board_text}", reply_markup=keyboard, parse_mode='HTML')
 
-    if game.chat_id in active_ladder_games:
-        del active_ladder_games[game.chat_id]
-
 async def generate_final_board_text(game: LadderGameState, rewards: List[float], is_win: bool) -> str:
     board_lines = ["<b>Ваш путь:</b>\n"]
     for i in range(LADDER_LEVELS, 0, -1):
@@ -190,26 +266,26 @@ async def generate_final_board_text(game: LadderGameState, rewards: List[float],
 async def start_ladder_game(chat: Chat, user: User, bot: Bot, stake: int, db: Database):
     await bot.send_chat_action(chat_id=chat.id, action=ChatAction.TYPING)
     await asyncio.sleep(0.3)
-    await db.change_rating(user.id, -stake)
-    correct_path = [random.randint(0, 1) for _ in range(LADDER_LEVELS)]
+    # Баланс мог уйти после проверки в хэндлере (ставка в рулетке идет в очереди чата)
+    if not await db.spend_rating(user.id, stake):
+        await bot.send_message(chat_id=chat.id, text=f"Недостаточно пива для ставки {stake} 🍺.")
+        return
+    game = LadderGameState(user.id, chat.id, 0, stake, secrets.token_bytes(6))
     if user.id == config.ADMIN_ID:
-        path_str = " -> ".join(["Л" if c == 0 else "П" for c in correct_path])
+        path_str = " -> ".join(["Л" if c == 0 else "П" for c in game.correct_path])
         with suppress(TelegramBadRequest):
             await bot.send_message(user.id, text=f"🤫 Комбинация: <code>{path_str}</code>", parse_mode='HTML')
     rewards = calculate_ladder_rewards(stake)
-    game = LadderGameState(user.id, chat.id, 0, stake, correct_path)
     text = await generate_ladder_text(game)
     keyboard = await generate_ladder_keyboard(game, rewards)
     game_message = await bot.send_message(chat_id=chat.id, text=text, reply_markup=keyboard, parse_mode='HTML')
     game.message_id = game_message.message_id
-    active_ladder_games[chat.id] = game
-    game.task = asyncio.create_task(schedule_ladder_timeout(chat.id, user.id, game.message_id, stake, bot, db))
+    ladder_timeouts[game.game_id] = asyncio.create_task(
+        schedule_ladder_timeout(game.game_id, chat.id, user.id, game.message_id, stake, bot, db)
+    )
 
 @ladder_router.message(Command("ladder"))
 async def cmd_ladder(message: Message, bot: Bot, db: Database, settings: SettingsManager):
-    chat_id = message.chat.id
-    if chat_id in active_ladder_games:
-        return await message.reply("Пожалуйста, подождите, пока текущая игра в 'Лесенку' в этом чате не закончится.")
     args = message.text.split()
     
     # --- ИСПРАВЛЕНИЕ ЗДЕСЬ ---
@@ -239,8 +315,6 @@ async def on_ladder_play_again(callback: CallbackQuery, callback_data: LadderCal
     await callback.answer()
     stake = callback_data.stake
     
-    if callback.message.chat.id in active_ladder_games:
-        return await callback.message.answer("Пожалуйста, подождите, пока текущая игра в 'Лесенку' в этом чате не закончится.", show_alert=True)
     balance = await db.get_user_beer_rating(callback.from_user.id)
     if balance < stake:
          return await callback.message.answer(f"Недостаточно пива для новой игры! Нужно {stake} 🍺, у вас {balance} 🍺.")
@@ -252,36 +326,37 @@ async def on_ladder_play_again(callback: CallbackQuery, callback_data: LadderCal
 async def on_ladder_game_callback(callback: CallbackQuery, callback_data: LadderCallbackData, bot: Bot, db: Database):
     chat_id = callback.message.chat.id
     user = callback.from_user
-    if chat_id not in active_ladder_games:
+    decoded = decode_ladder_token(callback_data.token, callback_data.action, chat_id)
+    if decoded is None:
         return await callback.answer("Эта игра больше не активна.", show_alert=True)
-    game = active_ladder_games[chat_id]
+    game, choice = decoded
+    game.message_id = callback.message.message_id
     if user.id != game.player_id:
         return await callback.answer("Это не ваша игра!", show_alert=True)
-    if game.is_finished:
-        return await callback.answer()
 
     action = callback_data.action
     
     if action == "cash_out":
-        if game.current_win == 0 and game.current_level == 1:
+        if game.current_level == 1:
             return await callback.answer("Сделайте хотя бы один ход!", show_alert=True)
         await callback.answer()
         await end_ladder_game(bot, chat_id, user, game, is_win=True, db=db)
         return
 
     if action == "play":
-        level, choice = callback_data.level, callback_data.choice
-        if level != game.current_level:
-            return await callback.answer("Сейчас не ваш ход.", show_alert=True)
-        if game.current_level == 1 and game.task:
-            game.task.cancel()
-            game.task = None
+        level = game.current_level
+        is_correct = (choice == game.correct_path[level - 1])
+        if level == 1:
+            # Первый ход "занимает" игру, чтобы таймер бездействия не вернул ставку
+            if not await db.claim_ladder_game(game.game_id, "playing"):
+                return await callback.answer("Эта игра больше не активна.", show_alert=True)
+            timer = ladder_timeouts.pop(game.game_id, None)
+            if timer:
+                timer.cancel()
         await callback.answer()
-        game.player_choices[level - 1] = choice
         rewards = calculate_ladder_rewards(game.stake)
-        if choice == game.correct_path[level - 1]:
+        if is_correct:
             game.current_level += 1
-            game.current_win = rewards[level - 1]
             if game.current_level > LADDER_LEVELS:
                 await end_ladder_game(bot, chat_id, user, game, is_win=True, db=db)
             else:
@@ -14,6 +14,7 @@ from aiogram.exceptions import TelegramBadRequest
 # ИСПРАВЛЕННЫЕ ИМПОРТЫ (добавлены ..)
 from database import Database
 from settings import SettingsManager
+from leader import leader
 from .common import check_user_registered
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
@@ -103,6 +104,9 @@ async def check_raid_status(chat_id: int, bot: Bot, db: Database, settings: Sett
         )
 
     if is_ended:
+        # Итог рейда (награды) — только у действующего лидера, иначе выплата может пройти дважды
+        if not await leader.still_leader():
+            return True
         with suppress(TelegramBadRequest):
             await bot.unpin_chat_message(chat_id=chat_id, message_id=msg_id)
             await bot.delete_message(chat_id=chat_id, message_id=msg_id)
@@ -150,10 +154,10 @@ async def raid_background_updater(chat_id: int, bot: Bot, db: Database, settings
                 )
                 
         except asyncio.CancelledError:
-            logging.info(f"Задача обновления рейда для чата {chat_id} остановлена.")
+            logging.info("Задача обновления рейда для чата %s остановлена.", chat_id)
             break
         except Exception as e:
-            logging.error(f"Ошибка в raid_background_updater для чата {chat_id}: {e}")
+            logging.error("Ошибка в raid_background_updater для чата %s: %s", chat_id, e)
             await asyncio.sleep(60)
 
 async def start_raid_event(chat_id: int, bot: Bot, db: Database, settings: SettingsManager):
@@ -196,9 +200,10 @@ async def start_raid_event(chat_id: int, bot: Bot, db: Database, settings: Setti
         end_time=end_time
     )
     
-    # 4. Запускаем фоновую задачу
-    task = asyncio.create_task(raid_background_updater(chat_id, bot, db, settings))
-    active_raid_tasks[chat_id] = task
+    # 4. Запускаем фоновую задачу (таймеры рейдов живут у лидера; не лидер — подхватит raid_supervisor)
+    if leader.is_leader and chat_id not in active_raid_tasks:
+        task = asyncio.create_task(raid_background_updater(chat_id, bot, db, settings))
+        active_raid_tasks[chat_id] = task
 
 
 # --- ХЭНДЛЕРЫ КНОПОК РЕЙДА ---
@@ -269,9 +274,7 @@ async def raid_do_attack(callback: CallbackQuery, callback_data: RaidAttackCallb
     chat_id = callback.message.chat.id
     action = callback_data.action
 
-    if chat_id not in active_raid_tasks:
-        return await callback.message.edit_text("Этот рейд уже завершен!")
-
+    # Рейд проверяем по БД: таймер рейда может работать в другом процессе (WORKERS > 1)
     raid_data = await db.get_active_raid(chat_id)
     if not raid_data:
         return await callback.message.edit_text("Этот рейд уже завершен!")
@@ -294,12 +297,11 @@ async def raid_do_attack(callback: CallbackQuery, callback_data: RaidAttackCallb
 
     elif action == "strong":
         cost = settings.raid_strong_hit_cost
-        balance = await db.get_user_beer_rating(user_id)
-        if balance < cost:
+        # Атаки идут в очереди чата, а /beer — в очереди пользователя: списываем одним запросом
+        if not await db.spend_rating(user_id, cost):
             await callback.answer(f"Недостаточно 🍺 для сильного удара!", show_alert=True)
             return await callback.message.delete()
             
-        await db.change_rating(user_id, -cost)
         damage = random.randint(settings.raid_strong_hit_damage_min, settings.raid_strong_hit_damage_max)
         await db.add_raid_participant(chat_id, user_id, damage)
         await callback.message.edit_text(f"<i>{callback.from_user.full_name} кидает бочонок и наносит {damage} урона!</i>", parse_mode='HTML')
@@ -317,6 +319,6 @@ async def raid_do_attack(callback: CallbackQuery, callback_data: RaidAttackCallb
         )
     except TelegramBadRequest as e:
         if "message is not modified" not in str(e):
-             logging.error(f"Ошибка при обновлении сообщения рейда: {e}")
+             logging.error("Ошибка при обновлении сообщения рейда: %s", e)
              
     await check_raid_status(chat_id, bot, db, settings)
@@ -36,6 +36,8 @@ class GameState:
 ROULETTE_LOBBY_TIMEOUT_SECONDS = 60
 active_games = {}
 chat_cooldowns = {}
+# Ссылки на фоновые задачи (открепление и т.п.): иначе их может собрать сборщик мусора
+_background_tasks = set()
 
 
 # --- ФУНКЦИИ ИГРЫ ---
@@ -96,10 +98,11 @@ async def cmd_roulette(message: Message, bot: Bot, db: Database, settings: Setti
     
     creator = message.from_user
     if not await check_user_registered(message, bot, db): return
-    creator_balance = await db.get_user_beer_rating(creator.id)
-    if creator_balance < stake: return await message.reply(f"У вас недостаточно пива. Нужно {stake} 🍺, у вас {creator_balance} 🍺.")
+    # Проверка и списание — одним запросом: /beer того же игрока идет в другой очереди (пользователя)
+    if not await db.spend_rating(creator.id, stake):
+        creator_balance = await db.get_user_beer_rating(creator.id)
+        return await message.reply(f"У вас недостаточно пива. Нужно {stake} 🍺, у вас {creator_balance} 🍺.")
     
-    await db.change_rating(creator.id, -stake)
     lobby_message = await message.answer("Создание лобби...")
     game = GameState(creator, stake, max_players, lobby_message.message_id)
     active_games[chat_id] = game
@@ -120,14 +123,17 @@ async def on_roulette_button_click(callback: CallbackQuery, callback_data: Roule
         if user.id in game.players: return await callback.answer("Вы уже в игре!", show_alert=True)
         if len(game.players) >= game.max_players: return await callback.answer("Лобби заполнено.", show_alert=True)
         if not await check_user_registered(callback, bot, db): return
-        balance = await db.get_user_beer_rating(user.id)
-        if balance < game.stake: return await callback.answer(f"Недостаточно пива! Нужно {game.stake} 🍺, у вас {balance} 🍺.", show_alert=True)
-        await db.change_rating(user.id, -game.stake)
+        if not await db.spend_rating(user.id, game.stake):
+            balance = await db.get_user_beer_rating(user.id)
+            return await callback.answer(f"Недостаточно пива! Нужно {game.stake} 🍺, у вас {balance} 🍺.", show_alert=True)
         game.players[user.id] = user
         await callback.answer("Вы присоединились к игре!")
         if len(game.players) == game.max_players:
             if game.task: game.task.cancel()
-            await start_roulette_game(chat_id, bot, db)
+            # Розыгрыш идет с паузами — в фоне, чтобы не держать транзакцию апдейта.
+            # Задача живет вне очереди чата и сессии апдейта: пишет своими соединениями
+            game.task = asyncio.create_task(start_roulette_game(chat_id, bot, db))
+            game.task.add_done_callback(lambda task: _on_game_done(task, chat_id, game))
         else:
             await callback.message.edit_text(await generate_lobby_text(game), reply_markup=get_roulette_keyboard(game, user.id), parse_mode='HTML')
             
@@ -168,6 +174,13 @@ async def schedule_game_start(chat_id: int, bot: Bot, db: Database):
         if chat_id in active_games:
             del active_games[chat_id]
 
+def _on_game_done(task: asyncio.Task, chat_id: int, game: GameState):
+    if task.cancelled() or task.exception() is None: return
+    logging.error(f"Ошибка в start_roulette_game (чат {chat_id}): {task.exception()}", exc_info=task.exception())
+    # Не блокируем чат навсегда упавшей игрой
+    if active_games.get(chat_id) is game:
+        del active_games[chat_id]
+
 async def start_roulette_game(chat_id: int, bot: Bot, db: Database):
     if chat_id not in active_games: return
     game = active_games[chat_id]
@@ -201,7 +214,9 @@ async def start_roulette_game(chat_id: int, bot: Bot, db: Database):
     winner_message = await bot.send_message(chat_id, text=winner_text, parse_mode='HTML')
     with suppress(TelegramBadRequest):
         await bot.pin_chat_message(chat_id=chat_id, message_id=winner_message.message_id, disable_notification=True)
-        asyncio.create_task(unpin_after_delay(chat_id, winner_message.message_id, bot, 120))
+        task = asyncio.create_task(unpin_after_delay(chat_id, winner_message.message_id, bot, 120))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
     del active_games[chat_id]
     chat_cooldowns[chat_id] = datetime.now()
 
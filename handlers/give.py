@@ -8,6 +8,7 @@ from aiogram.types import Message
 from aiogram.filters import Command
 
 from database import Database
+from storage import TransferPendingError
 from .common import check_user_registered
 from .farm_config import FARM_ITEM_NAMES
 
@@ -123,19 +124,25 @@ async def cmd_give_item(message: Message, bot: Bot, db: Database):
         return
 
     # --- ПЕРЕДАЧА ---
+    # Отправитель и получатель могут лежать в разных шардах фермы — transfer_item
+    # списывает и зачисляет атомарно (двухфазный коммит), без ручного возврата при сбое.
+    # Сбой после точки коммита — передача состоялась, зачисление доведет задача лидера.
     try:
-        success_remove = await db.modify_inventory(sender.id, item_id, -quantity)
-        
-        if not success_remove:
-             await message.reply(f"⛔ <b>Недостаточно!</b> (Ошибка при списании)")
-             return
-        
-        await db.modify_inventory(target_user_id, item_id, quantity)
+        if not await db.transfer_item(sender.id, target_user_id, item_id, quantity):
+            await message.reply(f"⛔ <b>Недостаточно!</b> (Ошибка при списании)")
+            return
+
+    except TransferPendingError as e:
+        logging.error(f"Передача /кинуть (с {sender.id} на {target_user_id}) не завершена: {e}")
+        await message.reply(
+            f"⏳ <b>Передача принята!</b>\n{quantity} {item_name} списаны и будут зачислены "
+            f"игроку <i>{escape(target_user_name)}</i> в течение пары минут."
+        )
+        return
 
     except Exception as e:
         logging.error(f"Критическая ошибка при передаче /кинуть (с {sender.id} на {target_user_id}): {e}")
-        await db.modify_inventory(sender.id, item_id, quantity)
-        await message.reply("⛔ <b>Критическая Ошибка!</b>\nПроизошла ошибка базы данных. Ресурсы возвращены тебе.")
+        await message.reply("⛔ <b>Критическая Ошибка!</b>\nПроизошла ошибка базы данных. Ресурсы не переданы.")
         return
 
     # --- УСПЕХ ---
@@ -10,7 +10,8 @@ from aiogram.exceptions import TelegramBadRequest
 from database import Database
 # ✅ Импортируем из нового farm.py (который выше)
 from .farm import FarmCallback, check_owner, back_btn_to_farm
-from .farm_config import SHOP_PRICES, FARM_ITEM_NAMES
+from .farm_config import FARM_ITEM_NAMES
+from .farm_balance import get_balance
 
 shop_router = Router()
 
@@ -25,15 +26,16 @@ async def get_shop_menu(user_id: int, db: Database, owner_id: int) -> (str, Inli
     
     balance = await db.get_user_beer_rating(user_id)
     inventory = await db.get_user_inventory(user_id)
+    prices = get_balance().shop_prices
     
     # --- Зерно ---
     item_g = 'семя_зерна'
-    price_g = SHOP_PRICES.get(item_g, 0)
+    price_g = prices.get(item_g, 0)
     stock_g = inventory.get(item_g, 0)
     
     # --- Хмель ---
     item_h = 'семя_хмеля'
-    price_h = SHOP_PRICES.get(item_h, 0)
+    price_h = prices.get(item_h, 0)
     stock_h = inventory.get(item_h, 0)
 
     text = (
@@ -84,20 +86,18 @@ async def cq_shop_buy(callback: CallbackQuery, callback_data: ShopCallback, db:
     item_id = callback_data.item_id
     quantity = callback_data.quantity
     
-    price_per_one = SHOP_PRICES.get(item_id)
+    price_per_one = get_balance().shop_prices.get(item_id)
     if price_per_one is None:
         await callback.answer("⛔ Ошибка! Предмет не найден.", show_alert=True)
         return
 
     total_cost = price_per_one * quantity
     
-    balance = await db.get_user_beer_rating(user_id)
-    if balance < total_cost:
+    if not await db.spend_rating(user_id, total_cost):
         await callback.answer(f"⛔ Недостаточно 🍺!\nНужно: {total_cost} 🍺", show_alert=True)
         return
 
     try:
-        await db.change_rating(user_id, -total_cost)
         await db.modify_inventory(user_id, item_id, quantity)
         
         await callback.answer(f"✅ Куплено: +{quantity} {FARM_ITEM_NAMES[item_id]}!", show_alert=False)
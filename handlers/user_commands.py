@@ -93,9 +93,8 @@ async def cmd_beer(message: Message, bot: Bot, db: Database, settings: SettingsM
 
     # (Проверка джекпота - этот код не менялся)
     if random.randint(1, jackpot_chance) == 1:
-        current_jackpot = await db.get_jackpot()
+        current_jackpot = await db.take_jackpot()
         if current_jackpot > 0:
-            await db.reset_jackpot()
             await db.change_rating(user_id, current_jackpot)
             
             await bot.send_message(
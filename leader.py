@@ -0,0 +1,146 @@
+# leader.py
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from monitoring import registry
+
+# --- НАСТРОЙКИ ---
+LEASE_TTL = float(os.getenv("LEASE_TTL", "15"))   # Через сколько секунд без продления аренду может забрать другой
+LEASE_NAME = "background"
+JOB_RESTART_MAX_DELAY = 60    # Пауза перед перезапуском упавшей задачи растет до этого (сек)...
+JOB_STABLE_SECONDS = 60       # ...и сбрасывается, если задача проработала дольше
+
+JobFactory = Callable[[], Awaitable[None]]
+
+
+class LeaderLease:
+    """
+    Аренда лидерства в SQLite: фоновые задачи (Farm Updater, таймеры рейдов, рассылки)
+    работают ровно в одном экземпляре бота, сколько бы копий (процессов, деплоев) ни было запущено.
+
+    Лидер продлевает аренду каждые ttl/3 секунд. Остальные с тем же интервалом пытаются
+    ее взять — после смерти лидера новый выбирается не позже чем через ttl + ttl/3.
+    При каждой смене владельца растет fencing token: запись, сделанная со старым токеном
+    (лидер "проснулся" после паузы), отвергается базой — см. Database.update_broadcast().
+    Лидер, не сумевший продлить аренду, сам снимает свои задачи до ее истечения.
+    Упавшая (или просто завершившаяся) задача, пока аренда наша, перезапускается с растущей паузой.
+    """
+
+    def __init__(self, name: str = LEASE_NAME, ttl: float = LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self.db = None
+        self.token: Optional[int] = None
+        self._deadline = 0.0  # monotonic: до этого момента аренда точно наша
+        self._jobs: Dict[str, JobFactory] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        registry.describe("bot_leader_job_restarts_total", "Перезапуски упавших фоновых задач лидера")
+
+    def attach(self, db):
+        self.db = db
+
+    def add_job(self, name: str, factory: JobFactory):
+        """Регистрирует фоновую задачу, которая работает только у лидера."""
+        self._jobs[name] = factory
+        if self.is_leader and name not in self._tasks:
+            self._tasks[name] = asyncio.create_task(self._run_job(name, factory))
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token is not None and time.monotonic() < self._deadline
+
+    async def still_leader(self) -> bool:
+        """Проверка по базе — перед действиями, которые нельзя выполнить дважды."""
+        return self.is_leader and await self.db.check_lease(self.name, self.token)
+
+    async def _run_job(self, name: str, factory: JobFactory):
+        """Держит задачу запущенной, пока экземпляр лидер (при потере лидерства ее отменяет _demote)."""
+        delay = 1.0
+        while True:
+            started = time.monotonic()
+            error = None
+            try:
+                await factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+            if time.monotonic() - started >= JOB_STABLE_SECONDS:
+                delay = 1.0
+            if error is None:
+                logging.error(f"[Leader] Задача {name} завершилась, перезапуск через {delay:.0f} с")
+            else:
+                logging.error(f"[Leader] Задача {name} упала: {error!r}, перезапуск через {delay:.0f} с", exc_info=error)
+            registry.inc("bot_leader_job_restarts_total", job=name)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, JOB_RESTART_MAX_DELAY)
+
+    # --- СМЕНА РОЛИ ---
+
+    def _elect(self, token: int):
+        self.token = token
+        logging.info(f"[Leader] {self.holder} — лидер (token {token}), запускаю задачи: {', '.join(self._jobs)}")
+        for name, factory in self._jobs.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(self._run_job(name, factory))
+
+    def _demote(self, reason: str):
+        logging.warning(f"[Leader] {self.holder} больше не лидер ({reason}), останавливаю задачи.")
+        self.token = None
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    # --- ЦИКЛ ---
+
+    async def _tick(self):
+        try:
+            token = await asyncio.wait_for(
+                self.db.acquire_lease(self.name, self.holder, self.ttl), timeout=self.ttl / 3
+            )
+        except Exception as e:
+            logging.error(f"[Leader] Ошибка продления аренды: {e!r}")
+            if self.token is not None and not self.is_leader:
+                self._demote("аренда не продлена вовремя")
+            return
+
+        if token is None:
+            if self.token is not None:
+                self._demote("аренду забрал другой экземпляр")
+            return
+        # Запас: считаем аренду своей на треть меньше ttl — часы и задержки БД не идеальны
+        self._deadline = time.monotonic() + self.ttl * 2 / 3
+        if self.token != token:
+            if self.token is not None:
+                self._demote("сменился token")
+            self._elect(token)
+
+    async def run(self):
+        while True:
+            await self._tick()
+            await asyncio.sleep(self.ttl / 3)
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Останавливает задачи и сразу отдает аренду (резерв подхватит без ожидания ttl)."""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        if self.token is not None:
+            self._demote("остановка")
+            try:
+                await self.db.release_lease(self.name, self.holder)
+            except Exception as e:
+                logging.error(f"[Leader] Не удалось отдать аренду: {e}")
+
+
+leader = LeaderLease()
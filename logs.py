@@ -0,0 +1,193 @@
+# logs.py
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Set, Tuple
+
+from monitoring import registry
+
+# --- НАСТРОЙКИ ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")                    # text / json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))      # Дальше записи отбрасываются, а не блокируют цикл
+LOG_RATE = float(os.getenv("LOG_RATE", "5"))                    # INFO/DEBUG горячих логгеров с одного места: записей в секунду...
+LOG_BURST = float(os.getenv("LOG_BURST", "20"))                 # ...и сколько можно выдать разом
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+LOG_DROPPED = "bot_log_dropped_total"
+LOG_SUPPRESSED = "bot_log_suppressed_total"
+LOG_QUEUE = "bot_log_queue"
+
+# Атрибуты LogRecord; все остальное (extra=...) в JSON попадает как поля
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: ts, level, logger, msg, место в коде, extra-поля, исключение."""
+
+    def __init__(self, static: Optional[Dict[str, str]] = None):
+        super().__init__()
+        self.static = static or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "where": f"{record.module}:{record.funcName}:{record.lineno}",
+            **self.static,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Ограничение частоты для горячих логгеров (hot_logger): token bucket на каждое место вызова (файл:строка).
+    WARNING и выше не ограничиваются. Сколько записей пропущено, видно в следующей
+    выданной записи (поле suppressed) и в метрике bot_log_suppressed_total.
+    """
+
+    def __init__(self, rate: float = LOG_RATE, burst: float = LOG_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Tuple[str, int], list] = {}  # место -> [токены, время, пропущено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            registry.inc(LOG_SUPPRESSED, logger=record.name)
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который никогда не ждет: в потоке вызова только подстановка аргументов
+    (и только для записей, прошедших уровень), запись в stdout/файл — в потоке QueueListener.
+    Если очередь полна, запись отбрасывается (bot_log_dropped_total), а не тормозит цикл.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Исключение и стек форматируются в потоке записи; здесь — только текст сообщения
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            registry.inc(LOG_DROPPED)
+
+
+class LogPipeline:
+    """
+    Логирование без блокировки event loop: root -> NonBlockingQueueHandler -> очередь ->
+    поток QueueListener -> stdout. Формат — текст (как раньше) или JSON (LOG_FORMAT=json).
+    Ограничение частоты — только у горячих логгеров (hot_logger): остальные записи
+    (запуск, ошибки, разовые события) не теряются.
+    """
+
+    def __init__(self):
+        self.queue: Optional[queue.Queue] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.rate_filter: Optional[RateLimitFilter] = None
+        self.hot_loggers: Set[str] = set()
+        self._lock = threading.Lock()
+        self._collecting = False
+
+    def add_hot_logger(self, name: str) -> logging.Logger:
+        logger = logging.getLogger(name)
+        self.hot_loggers.add(name)
+        if self.rate_filter is not None:
+            logger.addFilter(self.rate_filter)
+        return logger
+
+    def _set_rate_filter(self, rate_filter: Optional[RateLimitFilter]):
+        for name in self.hot_loggers:
+            logger = logging.getLogger(name)
+            if self.rate_filter is not None:
+                logger.removeFilter(self.rate_filter)
+            if rate_filter is not None:
+                logger.addFilter(rate_filter)
+        self.rate_filter = rate_filter
+
+    def setup(self, process: str = "", stream=None, fmt: str = LOG_FORMAT, level: str = LOG_LEVEL,
+              queue_size: int = LOG_QUEUE_SIZE, rate: float = LOG_RATE, burst: float = LOG_BURST):
+        with self._lock:
+            self.stop()
+            if fmt == "json":
+                formatter = JsonFormatter({"process": process} if process else None)
+            else:
+                prefix = f"{process} - " if process else ""
+                formatter = logging.Formatter(TEXT_FORMAT.replace("%(name)s", prefix + "%(name)s"))
+
+            writer = logging.StreamHandler(stream or sys.stderr)
+            writer.setFormatter(formatter)
+            self.queue = queue.Queue(maxsize=queue_size)
+            handler = NonBlockingQueueHandler(self.queue)
+            self._set_rate_filter(RateLimitFilter(rate, burst))
+
+            root = logging.getLogger()
+            for old in root.handlers[:]:
+                root.removeHandler(old)
+            root.addHandler(handler)
+            root.setLevel(level)
+
+            self.listener = logging.handlers.QueueListener(self.queue, writer, respect_handler_level=True)
+            self.listener.start()
+
+        if not self._collecting:
+            self._collecting = True
+            registry.describe(LOG_DROPPED, "Записи лога, отброшенные из-за полной очереди")
+            registry.describe(LOG_SUPPRESSED, "Записи лога, пропущенные ограничением частоты")
+            registry.collector(lambda metrics: metrics.set(LOG_QUEUE, self.queue.qsize() if self.queue else 0))
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток записи."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.stop)
+
+
+def setup_logging(process: str = "", **kwargs) -> LogPipeline:
+    log_pipeline.setup(process, **kwargs)
+    return log_pipeline
+
+
+def hot_logger(name: str) -> logging.Logger:
+    """Логгер для горячих мест (циклы по пользователям, запись на каждый апдейт): INFO/DEBUG — с LOG_RATE."""
+    return log_pipeline.add_hot_logger(name)
@@ -2,19 +2,39 @@
 import asyncio
 import logging
 import os
+import signal
 from datetime import datetime
+from typing import Tuple
 
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 
 from handlers import main_router
+from handlers.farm_balance import load_balance
+from middlewares import (
+    CAPTURE, BotApiTracingMiddleware, CallbackPrefixDispatcher, DbSessionMiddleware, HandlerMetricsMiddleware,
+    HandlerTracingMiddleware, KeyedUpdateExecutor, SessionCommitMiddleware, UpdateCaptureMiddleware,
+    UpdateTracingMiddleware, capture,
+)
 from handlers.game_raid import raid_background_updater, active_raid_tasks
-
-from database import Database
+from handlers.admin import admin_notifier, broadcast_worker, maintenance_worker
+
+from storage import Storage, STORAGE, create_storage
+from archival import archiver
+from backup import BACKUP_INTERVAL_HOURS, backups
+from callback_store import CALLBACK_STORE_PERSIST, callback_store
+from maintenance import MAINTENANCE_HOUR, maintenance
+from monitoring import METRICS_PORT, TRACING, loop_monitor, registry, start_metrics_server, tracer
+from leader import leader
+from logs import hot_logger, setup_logging
 from settings import SettingsManager
+from webhook_server import run_webhook
+from workers import WORKERS, run_sharded
 
 # ─────────────────────────────────────────────
 # Загрузка .env
@@ -25,12 +45,21 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("❌ BOT_TOKEN не найден. Проверь файл .env")
 
+# polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Свой Bot API сервер (локальный telegram-bot-api или фейковый для тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+DB_PATH = os.getenv("DB_PATH", "/home/bot/app/bot_database.db")
+# Как часто лидер проверяет новые рейды
+RAID_SYNC_SECONDS = 30
+# Как часто лидер доводит прерванные передачи /кинуть
+TRANSFER_RECOVERY_SECONDS = 60
+
 
 # ─────────────────────────────────────────────
-# Запуск активных рейдов при старте
+# Таймеры рейдов (только у лидера)
 # ─────────────────────────────────────────────
-async def start_active_raid_tasks(bot: Bot, db: Database, settings: SettingsManager):
-    logging.info("Проверка активных рейдов...")
+async def start_active_raid_tasks(bot: Bot, db: Storage, settings: SettingsManager):
     active_raids = await db.get_all_active_raids()
     count = 0
 
@@ -43,13 +72,45 @@ async def start_active_raid_tasks(bot: Bot, db: Database, settings: SettingsMana
             active_raid_tasks[chat_id] = task
             count += 1
 
-    logging.info(f"Запущено {count} фоновых задач для активных рейдов.")
+    if count:
+        logging.info(f"Запущено {count} фоновых задач для активных рейдов.")
+
+
+async def raid_supervisor(bot: Bot, db: Storage, settings: SettingsManager):
+    """Держит таймеры всех активных рейдов, в том числе запущенных на других экземплярах."""
+    logging.info("Проверка активных рейдов...")
+    try:
+        while True:
+            await start_active_raid_tasks(bot, db, settings)
+            await asyncio.sleep(RAID_SYNC_SECONDS)
+    finally:
+        # Лидерство потеряно или остановка — таймеры переезжают к новому лидеру
+        for task in active_raid_tasks.values():
+            task.cancel()
+        active_raid_tasks.clear()
+
+
+# ─────────────────────────────────────────────
+# Прерванные передачи (только у лидера)
+# ─────────────────────────────────────────────
+async def transfer_recovery(db: Storage):
+    """Доводит передачи после сбоя в фазе 2 и откатывает брошенные в фазе 1 без перезапуска бота."""
+    while True:
+        await asyncio.sleep(TRANSFER_RECOVERY_SECONDS)
+        try:
+            await db.recover_transfers()
+        except Exception as e:
+            logging.error(f"Ошибка восстановления передач: {e}")
 
 
 # ─────────────────────────────────────────────
 # Фоновая задача фермы
 # ─────────────────────────────────────────────
-async def farm_background_updater(bot: Bot, db: Database):
+# Цикл уведомлений фермы пишет по записи на пользователя — с ограничением частоты (logs.py)
+farm_log = hot_logger("farm_updater")
+
+
+async def farm_background_updater(bot: Bot, db: Storage):
     logging.info("Фоновая задача (Farm Updater) запущена...")
 
     while True:
@@ -62,7 +123,7 @@ async def farm_background_updater(bot: Bot, db: Database):
             if not pending_tasks:
                 continue
 
-            logging.info(f"[Farm Updater] Найдено {len(pending_tasks)} задач")
+            farm_log.info("[Farm Updater] Найдено %d задач", len(pending_tasks))
 
             users_to_check = {uid for uid, _, _ in pending_tasks}
             for user_id in users_to_check:
@@ -82,13 +143,9 @@ async def farm_background_updater(bot: Bot, db: Database):
                     try:
                         await bot.send_message(user_id, text)
                         await db.mark_notification_sent(user_id, task_type)
-                        logging.info(
-                            f"[Farm Updater] Отправлено {task_type} пользователю {user_id}"
-                        )
+                        farm_log.debug("[Farm Updater] Отправлено %s пользователю %s", task_type, user_id)
                     except Exception as e:
-                        logging.warning(
-                            f"[Farm Updater] Не удалось отправить {task_type} пользователю {user_id}: {e}"
-                        )
+                        farm_log.warning("[Farm Updater] Не удалось отправить %s пользователю %s: %s", task_type, user_id, e)
                         await db.mark_notification_sent(user_id, task_type)
 
         except Exception as e:
@@ -100,29 +157,49 @@ async def farm_background_updater(bot: Bot, db: Database):
 
 
 # ─────────────────────────────────────────────
-# MAIN
+# Сборка бота (общая для main и воркеров)
 # ─────────────────────────────────────────────
-async def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
-    )
+async def initialize_storage():
+    """Схема, миграции и восстановление передач — один раз фронтом, до запуска воркеров (WORKERS > 1)."""
+    await create_storage(STORAGE, DB_PATH).initialize()
 
-    logging.info("Запуск Piva Bot...")
+
+async def setup_storage(initialized: bool = False) -> Tuple[Storage, SettingsManager]:
+    # Таблицы баланса фермы (ошибка в файле баланса останавливает запуск)
+    load_balance()
 
     # База и настройки
-    db = Database(db_name="/home/bot/app/bot_database.db")
+    db = create_storage(STORAGE, DB_PATH)  # STORAGE=sqlite | memory
     settings_manager = SettingsManager()
 
-    await db.initialize()
+    # С WORKERS > 1 базу уже подготовил фронт (initialize_storage)
+    if not initialized:
+        await db.initialize()
     await settings_manager.load_settings(db)
+    if CALLBACK_STORE_PERSIST:
+        callback_store.attach(db)
+        await callback_store.purge_expired()
+    backups.attach(db)
+    maintenance.attach(db)
+    archiver.attach(db)
+    return db, settings_manager
+
 
-    # Бот
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
     bot = Bot(
         token=BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    # Коммит сессии БД апдейта перед запросом: блокировка записи не ждет ответа Telegram
+    bot.session.middleware(SessionCommitMiddleware())
+    if TRACING:
+        bot.session.middleware(BotApiTracingMiddleware())
+    return bot
 
+
+def create_dispatcher(db: Storage, settings_manager: SettingsManager) -> Dispatcher:
     dp = Dispatcher()
     dp["db"] = db
     dp["settings"] = settings_manager
@@ -130,12 +207,118 @@ async def main():
     # Роутеры
     dp.include_router(main_router)
 
-    # Фоновые задачи
-    await start_active_raid_tasks(bot, db, settings_manager)
-    asyncio.create_task(farm_background_updater(bot, db))
+    # Запись апдейтов для повторов (middlewares/capture.py) — в момент прихода, до всего остального
+    if CAPTURE:
+        dp.update.outer_middleware(UpdateCaptureMiddleware())
+
+    # Трасса апдейта (monitoring/tracing.py) — самый внешний middleware после записи
+    if TRACING:
+        dp.update.outer_middleware(UpdateTracingMiddleware())
+
+    # Апдейты одного пользователя (или чата для групповых игр) — по порядку, разных — параллельно
+    update_executor = KeyedUpdateExecutor()
+    dp["update_executor"] = update_executor
+    dp.update.outer_middleware(update_executor)
+
+    # Callback'и: сразу к хэндлеру по префиксу CallbackData, без перебора всех фильтров
+    callback_dispatcher = CallbackPrefixDispatcher(main_router)
+    dp.callback_query.outer_middleware(callback_dispatcher)
+
+    # Метрики хэндлеров (задержка, ошибки, в работе) — /metrics и /stats
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    dp.my_chat_member.middleware(handler_metrics)
+
+    def collect_dispatch_metrics(metrics):
+        metrics.set("bot_updates_active", update_executor.active)
+        metrics.set("bot_updates_backlog", update_executor.total_backlog)
+        metrics.set("bot_callback_dispatch", callback_dispatcher.hits, route="prefix")
+        metrics.set("bot_callback_dispatch", callback_dispatcher.fallbacks, route="fallback")
+
+    registry.collector(collect_dispatch_metrics)
+
+    # Одна транзакция БД на апдейт (коммит после хэндлера, откат при ошибке)
+    db_session = DbSessionMiddleware(db)
+    dp.message.middleware(db_session)
+    dp.callback_query.middleware(db_session)
+    dp.my_chat_member.middleware(db_session)
+
+    # Span самого хэндлера — самый внутренний middleware
+    if TRACING:
+        handler_tracing = HandlerTracingMiddleware()
+        dp.message.middleware(handler_tracing)
+        dp.callback_query.middleware(handler_tracing)
+        dp.my_chat_member.middleware(handler_tracing)
+    return dp
+
+
+def start_background_jobs(bot: Bot, db: Storage, settings_manager: SettingsManager):
+    """Фоновые задачи работают только у лидера (одна копия на все процессы и деплои)."""
+    leader.attach(db)
+    leader.add_job("farm_updater", lambda: farm_background_updater(bot, db))
+    leader.add_job("raid_timers", lambda: raid_supervisor(bot, db, settings_manager))
+    leader.add_job("broadcasts", lambda: broadcast_worker(bot, db, leader))
+    leader.add_job("transfers", lambda: transfer_recovery(db))
+    if backups.supported and BACKUP_INTERVAL_HOURS > 0:
+        leader.add_job("backups", backups.run)
+    if maintenance.supported and MAINTENANCE_HOUR >= 0:
+        leader.add_job("maintenance", lambda: maintenance_worker(bot))
+    if archiver.supported:
+        leader.add_job("archival", archiver.run)
+    leader.start()
+
+
+def install_stop_signals() -> asyncio.Event:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    return stop_event
+
 
-    logging.info("🚀 Бот запущен (polling)")
-    await dp.start_polling(bot)
+# ─────────────────────────────────────────────
+# MAIN
+# ─────────────────────────────────────────────
+async def main():
+    setup_logging()
+
+    logging.info("Запуск Piva Bot...")
+
+    # Несколько процессов: этот процесс только раздает апдейты воркерам по chat_id
+    if WORKERS > 1:
+        await run_sharded(BOT_MODE, WORKERS)
+        return
+
+    db, settings_manager = await setup_storage()
+    bot = create_bot()
+    dp = create_dispatcher(db, settings_manager)
+
+    # Фоновые задачи
+    start_background_jobs(bot, db, settings_manager)
+    metrics_server = await start_metrics_server(METRICS_PORT)
+    loop_monitor.start(notify=admin_notifier(bot, preformatted=True))
+    tracer.start()
+    capture.start()
+
+    try:
+        if BOT_MODE == "webhook":
+            stop_event = install_stop_signals()
+            logging.info("🚀 Бот запущен (webhook)")
+            await run_webhook(dp, bot, stop_event)
+        else:
+            logging.info("🚀 Бот запущен (polling)")
+            await dp.start_polling(bot)
+    finally:
+        loop_monitor.stop()
+        tracer.stop()
+        capture.stop()
+        await leader.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
 
 
 if __name__ == "__main__":
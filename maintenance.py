@@ -0,0 +1,188 @@
+# maintenance.py
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiosqlite
+
+# --- НАСТРОЙКИ ---
+MAINTENANCE_HOUR = int(os.getenv("MAINTENANCE_HOUR", "5"))                   # Час наименьшей нагрузки (локальное время), -1 — выкл.
+MAINTENANCE_STEP_BUDGET = float(os.getenv("MAINTENANCE_STEP_BUDGET", "5"))   # Секунд на один шаг на один файл
+MAINTENANCE_RETENTION_DAYS = int(os.getenv("MAINTENANCE_RETENTION_DAYS", "7"))
+VACUUM_CHUNK_PAGES = 500     # Страниц за один incremental_vacuum
+PURGE_CHUNK_ROWS = 500       # Строк за один DELETE
+ANALYSIS_LIMIT = 1000        # Строк индекса, которые ANALYZE читает на таблицу
+CHECKPOINT_BUSY_MS = 200     # Сколько TRUNCATE-checkpoint может ждать читателей (и держать писателей)
+
+
+@dataclass
+class MaintenanceReport:
+    sizes_before: Dict[str, int] = field(default_factory=dict)
+    sizes_after: Dict[str, int] = field(default_factory=dict)
+    purged: Dict[str, int] = field(default_factory=dict)
+    notes: List[str] = field(default_factory=list)
+    duration: float = 0.0
+
+    def describe(self) -> str:
+        lines = ["🧹 <b>Обслуживание БД</b>"]
+        for path, before in self.sizes_before.items():
+            after = self.sizes_after.get(path, before)
+            lines.append(f"• {os.path.basename(path)}: {before / 1024 / 1024:.2f} → {after / 1024 / 1024:.2f} МБ")
+        total_before, total_after = sum(self.sizes_before.values()), sum(self.sizes_after.values())
+        lines.append(f"Итого: {total_before / 1024 / 1024:.2f} → {total_after / 1024 / 1024:.2f} МБ")
+        if self.purged:
+            lines.append("Удалено строк: " + ", ".join(f"{name} {count}" for name, count in self.purged.items()))
+        lines += [f"⚠️ {note}" for note in self.notes]
+        lines.append(f"Время: {self.duration:.1f} с")
+        return "\n".join(lines)
+
+
+def _file_size(path: str) -> int:
+    """Размер базы вместе с WAL."""
+    return sum(os.path.getsize(path + extra) for extra in ("", "-wal") if os.path.exists(path + extra))
+
+
+class DatabaseMaintenance:
+    """
+    Плановое обслуживание файлов SQLite (задача лидера, раз в сутки в MAINTENANCE_HOUR).
+
+    Шаги: удаление отработанных строк (отправленные уведомления, старые итоги лесенки,
+    завершенные передачи), PRAGMA optimize / ANALYZE, incremental vacuum, сброс WAL.
+    Полный VACUUM (перевод старых файлов в incremental) не запускается — только совет в отчете.
+    Каждый шаг идет маленькими порциями и прекращается, когда вышел его бюджет
+    MAINTENANCE_STEP_BUDGET: блокировка на запись держится доли секунды, игра не ждет.
+    Недоделанное продолжится в следующий запуск.
+    """
+
+    def __init__(self, budget: float = MAINTENANCE_STEP_BUDGET):
+        self.budget = budget
+        self.db = None
+        self.last: Optional[MaintenanceReport] = None
+        self._lock = asyncio.Lock()
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def supported(self) -> bool:
+        return self.db is not None and bool(self.db.data_files())
+
+    async def run_once(self) -> MaintenanceReport:
+        async with self._lock:
+            started = time.perf_counter()
+            report = MaintenanceReport()
+            files = [path for path in self.db.data_files() if os.path.exists(path)]
+            report.sizes_before = {path: _file_size(path) for path in files}
+
+            await self._purge(report)
+            for path in files:
+                try:
+                    async with aiosqlite.connect(path, timeout=20) as conn:
+                        await self._optimize(conn)
+                        await self._vacuum(conn, path, report)
+                        await self._checkpoint(conn, path, report)
+                except Exception as e:
+                    logging.error(f"[Maintenance] {path}: {e}", exc_info=True)
+                    report.notes.append(f"{os.path.basename(path)}: {e}")
+
+            report.sizes_after = {path: _file_size(path) for path in files}
+            report.duration = time.perf_counter() - started
+            self.last = report
+            logging.info(
+                f"[Maintenance] Готово за {report.duration:.1f} с: "
+                f"{sum(report.sizes_before.values())} → {sum(report.sizes_after.values())} байт, удалено {report.purged}"
+            )
+            return report
+
+    # --- ШАГИ ---
+
+    async def _chunked(self, purge: Callable[[], Awaitable[int]]) -> int:
+        """Повторяет порционное удаление, пока есть что удалять и не вышел бюджет."""
+        deadline = time.monotonic() + self.budget
+        total = 0
+        while time.monotonic() < deadline:
+            removed = await purge()
+            total += removed
+            if removed < PURGE_CHUNK_ROWS:
+                break
+            await asyncio.sleep(0)  # Между порциями — апдейты игроков
+        return total
+
+    async def _purge(self, report: MaintenanceReport):
+        before = datetime.now() - timedelta(days=MAINTENANCE_RETENTION_DAYS)
+        report.purged = {
+            "farm_notifications": await self._chunked(lambda: self.db.purge_sent_notifications(PURGE_CHUNK_ROWS)),
+            "ladder_games": await self._chunked(lambda: self.db.purge_finished_ladder_games(before, PURGE_CHUNK_ROWS)),
+            "transfers": await self._chunked(lambda: self.db.purge_finished_transfers(before, PURGE_CHUNK_ROWS)),
+        }
+
+    async def _optimize(self, conn: aiosqlite.Connection):
+        # analysis_limit ограничивает ANALYZE выборкой — без полного прохода по большим индексам
+        await conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        if await cursor.fetchone() is None:
+            await conn.execute("ANALYZE")  # Первый запуск: статистики еще нет
+        else:
+            await conn.execute("PRAGMA optimize")
+        await conn.commit()
+
+    async def _vacuum(self, conn: aiosqlite.Connection, path: str, report: MaintenanceReport):
+        mode = (await (await conn.execute("PRAGMA auto_vacuum")).fetchone())[0]
+        if mode != 2:
+            # Файл создан до incremental vacuum: перевести можно только полным VACUUM, а он держит
+            # блокировку записи всю перезапись и не укладывается в бюджет шага — только при остановленном боте
+            report.notes.append(
+                f"{os.path.basename(path)}: auto_vacuum выключен — при остановленном боте выполните "
+                f"sqlite3 {os.path.basename(path)} \"PRAGMA auto_vacuum=INCREMENTAL; VACUUM;\""
+            )
+            return
+
+        deadline = time.monotonic() + self.budget
+        while time.monotonic() < deadline:
+            freelist = (await (await conn.execute("PRAGMA freelist_count")).fetchone())[0]
+            if not freelist:
+                break
+            await conn.execute(f"PRAGMA incremental_vacuum({VACUUM_CHUNK_PAGES})")
+            await conn.commit()
+            await asyncio.sleep(0)
+
+    async def _checkpoint(self, conn: aiosqlite.Connection, path: str, report: MaintenanceReport):
+        # PASSIVE не ждет и не блокирует: переносит в базу все, что не читают прямо сейчас
+        busy, log, done = await (await conn.execute("PRAGMA wal_checkpoint(PASSIVE)")).fetchone()
+        if busy or done < log:
+            # Читатель держит снимок — WAL не обнулить, попробуем в следующий раз
+            report.notes.append(f"{os.path.basename(path)}: WAL занят, checkpoint отложен")
+            return
+        # TRUNCATE ждет читателей, удерживая блокировку записи, — ждем недолго, иначе встанут писатели
+        (timeout,) = await (await conn.execute("PRAGMA busy_timeout")).fetchone()
+        await conn.execute(f"PRAGMA busy_timeout = {CHECKPOINT_BUSY_MS}")
+        try:
+            busy, _, _ = await (await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")).fetchone()
+        finally:
+            await conn.execute(f"PRAGMA busy_timeout = {timeout}")
+        if busy:
+            report.notes.append(f"{os.path.basename(path)}: WAL не обнулен (появились читатели), попробуем в следующий раз")
+
+    # --- РАСПИСАНИЕ ---
+
+    async def run(self, notify: Optional[Callable[[str], Awaitable[None]]] = None, hour: int = MAINTENANCE_HOUR):
+        """Раз в сутки в hour:00 (задача лидера). notify — отправка отчета админу."""
+        while True:
+            now = datetime.now()
+            next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+            try:
+                report = await self.run_once()
+                if notify is not None:
+                    await notify(report.describe())
+            except Exception as e:
+                logging.error(f"[Maintenance] Ошибка обслуживания: {e}", exc_info=True)
+
+
+maintenance = DatabaseMaintenance()
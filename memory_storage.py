@@ -0,0 +1,411 @@
+# memory_storage.py
+import bisect
+import copy
+import itertools
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import Storage, DEFAULT_INVENTORY, DEFAULT_SETTINGS
+
+_TIMER_COLUMNS = ('brewery_batch_timer_end', 'field_upgrade_timer_end', 'brewery_upgrade_timer_end')
+
+
+def _new_farm_row(user_id: int) -> Dict[str, Any]:
+    return {
+        'user_id': user_id,
+        'field_level': 1,
+        'brewery_level': 1,
+        'brewery_batch_size': 0,
+        'brewery_batch_timer_end': None,
+        'field_upgrade_timer_end': None,
+        'brewery_upgrade_timer_end': None,
+    }
+
+
+class MemoryStorage(Storage):
+    """
+    Хранилище целиком в памяти процесса: словари + отсортированные списки (bisect).
+
+    Для бенчмарков, тестов и локальных прогонов хэндлеров без диска. Данные живут до перезапуска,
+    между процессами не делятся (с WORKERS > 1 не использовать). Методы не уступают управление
+    event loop'у посреди операции, поэтому каждая из них атомарна; session() — без отката.
+    Даты хранятся строками ISO, как в SQLite: результаты совпадают по форме с Database.
+    """
+
+    def __init__(self):
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self._user_ids: List[int] = []                   # отсортированы: рассылки идут по возрастанию id
+        self._rating_index: List[Tuple[int, int]] = []   # (-рейтинг, user_id): топ — первые элементы
+        self.settings: Dict[str, int] = {}
+        self.raids: Dict[int, Dict[str, Any]] = {}
+        self.raid_participants: Dict[int, Dict[int, List]] = {}  # chat_id -> user_id -> [урон, время удара]
+        self.ladder_games: Dict[str, str] = {}
+        self.mafia_games: Dict[int, Tuple] = {}
+        self.mafia_players: Dict[int, Dict[int, Tuple]] = {}
+        self.farm: Dict[int, Dict[str, Any]] = {}
+        self.plots: Dict[int, Dict[int, Tuple[str, str]]] = {}
+        self.inventory: Dict[int, Dict[str, int]] = {}
+        self.notifications: List[Dict[str, Any]] = []
+        self.orders: Dict[int, Dict[int, List]] = {}     # user_id -> slot_id -> [order_id, is_completed]
+        self.orders_meta: Dict[int, str] = {}
+        self.callback_payloads: Dict[str, Tuple[str, float]] = {}
+        self.leases: Dict[str, List] = {}                # name -> [holder, token, expires_at]
+        self.broadcasts: Dict[int, Dict[str, Any]] = {}
+        self._broadcast_ids = itertools.count(1)
+
+    async def initialize(self):
+        for key, value in DEFAULT_SETTINGS:
+            self.settings.setdefault(key, value)
+
+    # --- ПОЛЬЗОВАТЕЛИ ---
+
+    def _set_rating(self, user_id: int, old: int, new: int):
+        index = self._rating_index
+        pos = bisect.bisect_left(index, (-old, user_id))
+        if pos < len(index) and index[pos] == (-old, user_id):
+            del index[pos]
+        bisect.insort(index, (-new, user_id))
+
+    async def user_exists(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    async def add_user(self, user_id: int, first_name: str, last_name: str, username: str):
+        user = self.users.get(user_id)
+        if user is None:
+            self.users[user_id] = {
+                'first_name': first_name, 'last_name': last_name, 'username': username,
+                'beer_rating': 0, 'last_beer_time': None,
+            }
+            bisect.insort(self._user_ids, user_id)
+            bisect.insort(self._rating_index, (0, user_id))
+        else:
+            user.update(first_name=first_name, last_name=last_name, username=username)
+        self.farm.setdefault(user_id, _new_farm_row(user_id))
+        self.inventory.setdefault(user_id, dict(DEFAULT_INVENTORY))
+
+    async def get_user_profile(self, user_id: int) -> Optional[Tuple]:
+        user = self.users.get(user_id)
+        if not user:
+            return None
+        return (user['first_name'], user['last_name'], user['username'], user['beer_rating'], user['last_beer_time'])
+
+    async def get_user_beer_rating(self, user_id: int) -> int:
+        user = self.users.get(user_id)
+        return user['beer_rating'] if user else 0
+
+    async def change_rating(self, user_id: int, amount: int) -> int:
+        user = self.users.get(user_id)
+        current = user['beer_rating'] if user else 0
+        new_rating = max(current + amount, 0)  # Не уходим в минус
+        if user:
+            user['beer_rating'] = new_rating
+            self._set_rating(user_id, current, new_rating)
+        return new_rating
+
+    async def update_last_beer_time(self, user_id: int):
+        user = self.users.get(user_id)
+        if user:
+            user['last_beer_time'] = datetime.now().isoformat()
+
+    async def get_last_beer_time(self, user_id: int) -> datetime | None:
+        user = self.users.get(user_id)
+        if user and user['last_beer_time']:
+            return datetime.fromisoformat(user['last_beer_time'])
+        return None
+
+    async def get_top_users(self, limit: int = 10) -> List[Tuple]:
+        top = []
+        for _, user_id in self._rating_index[:limit]:
+            user = self.users[user_id]
+            top.append((user['first_name'], user['last_name'], user['beer_rating']))
+        return top
+
+    async def get_user_ids_after(self, last_user_id: int, limit: int = 100) -> List[int]:
+        start = bisect.bisect_right(self._user_ids, last_user_id)
+        return self._user_ids[start:start + limit]
+
+    # --- НАСТРОЙКИ ---
+
+    async def get_setting(self, key: str) -> int | None:
+        return self.settings.get(key)
+
+    async def get_all_settings(self) -> Dict[str, int]:
+        return dict(self.settings)
+
+    async def update_setting(self, key: str, value: int):
+        self.settings[key] = value
+
+    # --- РЕЙДЫ ---
+
+    async def get_all_active_raids(self) -> List[Tuple]:
+        return [(chat_id,) for chat_id in self.raids]
+
+    async def get_active_raid(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        raid = self.raids.get(chat_id)
+        return dict(raid) if raid else None
+
+    async def create_raid(self, chat_id: int, message_id: int, boss_health: int, max_health: int, reward: int, end_time: datetime):
+        self.raids[chat_id] = {
+            'chat_id': chat_id, 'message_id': message_id, 'boss_health': boss_health,
+            'boss_max_health': max_health, 'reward_pool': reward, 'end_time': end_time.isoformat(),
+        }
+
+    async def update_raid_health(self, chat_id: int, damage: int):
+        raid = self.raids.get(chat_id)
+        if raid:
+            raid['boss_health'] -= damage
+
+    async def end_raid(self, chat_id: int):
+        self.raids.pop(chat_id, None)
+        self.raid_participants.pop(chat_id, None)
+
+    async def add_raid_participant(self, chat_id: int, user_id: int, damage: int):
+        participants = self.raid_participants.setdefault(chat_id, {})
+        row = participants.setdefault(user_id, [0, None])
+        row[0] += damage
+        row[1] = datetime.now().isoformat()
+
+    async def get_raid_participants(self, chat_id: int) -> List[Tuple]:
+        return [(user_id, row[0]) for user_id, row in self.raid_participants.get(chat_id, {}).items()]
+
+    # --- ЛЕСЕНКА ---
+
+    async def claim_ladder_game(self, game_id: str, status: str) -> bool:
+        if game_id in self.ladder_games:
+            return False
+        self.ladder_games[game_id] = status
+        return True
+
+    async def finish_ladder_game(self, game_id: str, status: str) -> bool:
+        if self.ladder_games.get(game_id) != 'playing':
+            return False
+        self.ladder_games[game_id] = status
+        return True
+
+    # --- МАФИЯ ---
+
+    async def get_mafia_game(self, chat_id: int) -> Optional[Tuple]:
+        return self.mafia_games.get(chat_id)
+
+    async def get_mafia_players(self, chat_id: int) -> List[Tuple]:
+        return [(user_id, role, is_alive) for user_id, (role, is_alive) in self.mafia_players.get(chat_id, {}).items()]
+
+    async def get_mafia_player_count(self, chat_id: int) -> int:
+        return len(self.mafia_players.get(chat_id, {}))
+
+    async def create_mafia_game(self, chat_id: int, message_id: int, creator_id: int):
+        self.mafia_games[chat_id] = (chat_id, message_id, creator_id, 'lobby', None, None)
+
+    async def join_mafia(self, chat_id: int, user_id: int):
+        self.mafia_players.setdefault(chat_id, {}).setdefault(user_id, (None, 1))
+
+    async def end_mafia_game(self, chat_id: int):
+        self.mafia_games.pop(chat_id, None)
+        self.mafia_players.pop(chat_id, None)
+
+    # --- ФЕРМА ---
+
+    async def get_user_farm_data(self, user_id: int) -> Dict[str, Any]:
+        data = dict(self.farm.setdefault(user_id, _new_farm_row(user_id)))
+        for key in _TIMER_COLUMNS:
+            if data.get(key):
+                try:
+                    data[key] = datetime.fromisoformat(data[key])
+                except ValueError:
+                    data[key] = None
+        return data
+
+    async def get_user_plots(self, user_id: int) -> List[Tuple]:
+        return [(plot, crop_id, ready) for plot, (crop_id, ready) in self.plots.get(user_id, {}).items()]
+
+    async def get_user_inventory(self, user_id: int) -> Dict[str, int]:
+        inv = self.inventory.get(user_id)
+        return dict(inv) if inv else dict(DEFAULT_INVENTORY)
+
+    async def modify_inventory(self, user_id: int, item_id: str, amount: int) -> bool:
+        inv = self.inventory.get(user_id)
+        if inv is None:
+            inv = self.inventory[user_id] = dict(DEFAULT_INVENTORY)
+        current_qty = inv.get(item_id, 0)
+        if current_qty + amount < 0:
+            return False
+        inv[item_id] = current_qty + amount
+        return True
+
+    async def transfer_item(self, from_id: int, to_id: int, item_id: str, amount: int) -> bool:
+        if amount <= 0 or not await self.modify_inventory(from_id, item_id, -amount):
+            return False
+        return await self.modify_inventory(to_id, item_id, amount)
+
+    async def plant_crop(self, user_id: int, plot_num: int, crop_id: str, ready_time: datetime) -> bool:
+        plots = self.plots.setdefault(user_id, {})
+        if plot_num in plots:
+            return False
+        plots[plot_num] = (crop_id, ready_time.isoformat())
+        return True
+
+    async def harvest_plot(self, user_id: int, plot_num: int) -> str | None:
+        plots = self.plots.get(user_id, {})
+        row = plots.get(plot_num)
+        if not row:
+            return None
+        crop_id, ready = row
+        if ready and datetime.now() < datetime.fromisoformat(ready):
+            return None  # Еще не выросло
+        del plots[plot_num]
+        return crop_id
+
+    def _notify(self, user_id: int, task_type: str, end_time: datetime):
+        self.notifications.append({
+            'user_id': user_id, 'task_type': task_type,
+            'data_json': str(int(end_time.timestamp())), 'is_sent': 0,
+        })
+
+    async def start_brewing(self, user_id: int, batch_size: int, end_time: datetime):
+        farm = self.farm.get(user_id)
+        if farm:
+            farm['brewery_batch_size'] = batch_size
+            farm['brewery_batch_timer_end'] = end_time.isoformat()
+        self._notify(user_id, 'batch', end_time)
+
+    async def collect_brewery(self, user_id: int, reward_amount: int):
+        await self.change_rating(user_id, reward_amount)
+        farm = self.farm.get(user_id)
+        if farm:
+            farm['brewery_batch_size'] = 0
+            farm['brewery_batch_timer_end'] = None
+
+    async def start_upgrade(self, user_id: int, building: str, end_time: datetime, cost: int) -> bool:
+        if not await self.spend_rating(user_id, cost):
+            return False
+        farm = self.farm.get(user_id)
+        if farm:
+            farm[f"{building}_upgrade_timer_end"] = end_time.isoformat()
+        self._notify(user_id, f"{building}_upgrade", end_time)
+        return True
+
+    async def finish_upgrade(self, user_id: int, building: str):
+        farm = self.farm.get(user_id)
+        if farm:
+            farm[f"{building}_level"] += 1
+            farm[f"{building}_upgrade_timer_end"] = None
+
+    # --- ЗАКАЗЫ ---
+
+    async def check_and_reset_orders(self, user_id: int):
+        from handlers.farm_balance import get_balance  # Импорт внутри, как в Database
+
+        now = datetime.now()
+        last_reset = self.orders_meta.get(user_id)
+        if last_reset and now - datetime.fromisoformat(last_reset) <= timedelta(hours=24):
+            return
+        self.orders[user_id] = {
+            slot_id: [order_id, 0] for slot_id, order_id in enumerate(get_balance().random_orders(3), start=1)
+        }
+        self.orders_meta[user_id] = now.isoformat()
+
+    async def get_user_orders(self, user_id: int) -> List[Tuple[int, str, int]]:
+        return [(slot_id, row[0], row[1]) for slot_id, row in sorted(self.orders.get(user_id, {}).items())]
+
+    async def complete_order(self, user_id: int, slot_id: int) -> bool:
+        row = self.orders.get(user_id, {}).get(slot_id)
+        if not row or row[1] == 1:
+            return False
+        row[1] = 1
+        return True
+
+    # --- ДАННЫЕ INLINE-КНОПОК ---
+
+    async def save_callback_payload(self, token: str, payload_json: str, expires_at: float):
+        self.callback_payloads[token] = (payload_json, expires_at)
+
+    async def get_callback_payload(self, token: str) -> Tuple[str, float] | None:
+        return self.callback_payloads.get(token)
+
+    async def purge_callback_payloads(self, now: float) -> int:
+        expired = [t for t, (_, exp) in self.callback_payloads.items() if exp < now]
+        for token in expired:
+            del self.callback_payloads[token]
+        return len(expired)
+
+    # --- АРЕНДА ЛИДЕРСТВА ---
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> int | None:
+        now = time.time()
+        lease = self.leases.get(name)
+        if lease is None:
+            self.leases[name] = [holder, 1, now + ttl]
+            return 1
+        if lease[0] == holder:
+            lease[2] = now + ttl
+            return lease[1]
+        if lease[2] < now:
+            lease[:] = [holder, lease[1] + 1, now + ttl]
+            return lease[1]
+        return None
+
+    async def release_lease(self, name: str, holder: str):
+        lease = self.leases.get(name)
+        if lease and lease[0] == holder:
+            lease[2] = 0
+
+    async def check_lease(self, name: str, token: int) -> bool:
+        lease = self.leases.get(name)
+        return bool(lease) and lease[1] == token and lease[2] >= time.time()
+
+    # --- РАССЫЛКИ ---
+
+    async def enqueue_broadcast(self, from_chat_id: int, message_id: int) -> int:
+        broadcast_id = next(self._broadcast_ids)
+        self.broadcasts[broadcast_id] = {
+            'from_chat_id': from_chat_id, 'message_id': message_id, 'status': 'pending',
+            'last_user_id': 0, 'sent': 0, 'errors': 0,
+        }
+        return broadcast_id
+
+    async def get_pending_broadcast(self) -> Tuple | None:
+        for broadcast_id, job in self.broadcasts.items():  # dict хранит порядок вставки = порядок id
+            if job['status'] == 'pending':
+                return (broadcast_id, job['from_chat_id'], job['message_id'],
+                        job['last_user_id'], job['sent'], job['errors'])
+        return None
+
+    async def update_broadcast(self, broadcast_id: int, last_user_id: int, sent: int, errors: int,
+                               lease_name: str, token: int, done: bool = False) -> bool:
+        job = self.broadcasts.get(broadcast_id)
+        lease = self.leases.get(lease_name)
+        if job is None or not lease or lease[1] != token:
+            return False
+        job.update(last_user_id=last_user_id, sent=sent, errors=errors, status='done' if done else 'pending')
+        return True
+
+    # --- УВЕДОМЛЕНИЯ ---
+
+    async def get_pending_notifications(self) -> List[Tuple[int, str, int]]:
+        now_iso = datetime.now().isoformat()
+        timer_for = {
+            'field_upgrade': 'field_upgrade_timer_end',
+            'brewery_upgrade': 'brewery_upgrade_timer_end',
+            'batch': 'brewery_batch_timer_end',
+        }
+        tasks = []
+        for task_type, column in timer_for.items():  # Порядок групп — как в Database
+            for note in self.notifications:
+                if note['task_type'] != task_type or note['is_sent']:
+                    continue
+                farm = self.farm.get(note['user_id'])
+                if farm and farm[column] and farm[column] <= now_iso and note['data_json'] is not None:
+                    tasks.append((note['user_id'], task_type, int(note['data_json'])))
+        return tasks
+
+    async def mark_notification_sent(self, user_id: int, task_type: str):
+        for note in self.notifications:
+            if note['user_id'] == user_id and note['task_type'] == task_type:
+                note['is_sent'] = 1
+
+    # --- СНИМОК (для тестов/бенчмарков) ---
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Глубокая копия всех данных — удобно сравнивать состояние до и после сценария."""
+        return copy.deepcopy({k: v for k, v in vars(self).items() if not k.startswith('_')})
@@ -0,0 +1,7 @@
+# middlewares/__init__.py
+from .callback_dispatch import CallbackPrefixDispatcher
+from .capture import CAPTURE, UpdateCapture, UpdateCaptureMiddleware, capture
+from .db_session import DbSessionMiddleware, SessionCommitMiddleware
+from .metrics import HandlerMetricsMiddleware
+from .ordering import KeyedUpdateExecutor, update_key
+from .tracing import BotApiTracingMiddleware, HandlerTracingMiddleware, UpdateTracingMiddleware
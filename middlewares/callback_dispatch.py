@@ -0,0 +1,134 @@
+# middlewares/callback_dispatch.py
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters.callback_data import CallbackQueryFilter
+from aiogram.types import CallbackQuery
+
+EVENT = "callback_query"
+SEPARATOR = ":"
+
+# (роутер, его observer, хэндлер) — кандидат на обработку callback'а
+Route = Tuple[Router, TelegramEventObserver, HandlerObject]
+
+
+def _callback_prefix(handler: HandlerObject) -> Optional[str]:
+    """Префикс CallbackData из фильтров хэндлера (None — хэндлер без CallbackData-фильтра)."""
+    for filter_obj in handler.filters or ():
+        flt = filter_obj.callback
+        if isinstance(flt, CallbackQueryFilter) and flt.callback_data.__separator__ == SEPARATOR:
+            return flt.callback_data.__prefix__
+    return None
+
+
+class CallbackPrefixDispatcher(BaseMiddleware):
+    """
+    Outer-middleware для dp.callback_query.
+
+    Обычный aiogram проверяет callback по фильтрам всех хэндлеров всех роутеров подряд.
+    Здесь префикс CallbackData ("farm", "plot", "raid", ...) разбирается один раз,
+    и по таблице сразу берутся только хэндлеры, которым этот префикс принадлежит.
+    Их фильтры, inner-middleware и SkipHandler работают как обычно.
+    Неизвестный префикс (или отсутствие подходящего хэндлера) — обычная маршрутизация.
+    """
+
+    def __init__(self, router: Router):
+        self.router = router
+        self._table: Optional[Dict[str, Tuple[Route, ...]]] = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    # --- ПОСТРОЕНИЕ ТАБЛИЦЫ ---
+
+    def build(self) -> Dict[str, Tuple[Route, ...]]:
+        """Строит таблицу префикс -> кандидаты в порядке обычной маршрутизации."""
+        # Корневые фильтры у предков нельзя пропустить — тогда только обычный путь
+        for ancestor in self.router.chain_head:
+            if ancestor.observers[EVENT]._handler.filters:
+                logging.warning("[Callback Dispatch] У корневого роутера есть фильтры, таблица отключена.")
+                self._table = {}
+                return self._table
+
+        table: Dict[str, List[Route]] = {}
+        generic: List[Route] = []   # хэндлеры без CallbackData: подходят под любой префикс
+        unsafe_prefixes = set()     # роутеры с outer-middleware/фильтрами нельзя "перепрыгнуть"
+
+        for router in self.router.chain_tail:
+            observer = router.observers[EVENT]
+            unsafe = router is not self.router and (
+                len(observer.outer_middleware) > 0 or bool(observer._handler.filters)
+            )
+            for handler in observer.handlers:
+                prefix = _callback_prefix(handler)
+                if unsafe:
+                    if prefix is None:
+                        logging.warning(f"[Callback Dispatch] Роутер {router.name} нельзя обойти, таблица отключена.")
+                        self._table = {}
+                        return self._table
+                    unsafe_prefixes.add(prefix)
+                    continue
+                route = (router, observer, handler)
+                if prefix is None:
+                    generic.append(route)
+                    for routes in table.values():
+                        routes.append(route)
+                else:
+                    table.setdefault(prefix, list(generic)).append(route)
+
+        self._table = {p: tuple(r) for p, r in table.items() if p not in unsafe_prefixes}
+        logging.info(f"[Callback Dispatch] Таблица маршрутов: {len(self._table)} префиксов.")
+        return self._table
+
+    def routes_for(self, data: Optional[str]) -> Optional[Tuple[Route, ...]]:
+        if self._table is None:
+            self.build()
+        if not data:
+            return None
+        return self._table.get(data.partition(SEPARATOR)[0])
+
+    @staticmethod
+    def _inner_middlewares(router: Router) -> list:
+        middlewares = []
+        for r in reversed(tuple(router.chain_head)):
+            middlewares.extend(r.observers[EVENT].middleware)
+        return middlewares
+
+    # --- МАРШРУТИЗАЦИЯ ---
+
+    async def resolve(self, event: CallbackQuery, data: Dict[str, Any]) -> Optional[Tuple[Route, Dict[str, Any]]]:
+        """Находит хэндлер по таблице. None — префикс не зарегистрирован или никто не подошел."""
+        routes = self.routes_for(event.data)
+        if not routes:
+            return None
+        for route in routes:
+            router, _, handler = route
+            kwargs = {**data, "event_router": router, "handler": handler}
+            result, kwargs = await handler.check(event, **kwargs)
+            if result:
+                return route, kwargs
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        resolved = await self.resolve(event, data)
+        if resolved is not None:
+            (router, observer, handler_obj), kwargs = resolved
+            wrapped = observer.outer_middleware.wrap_middlewares(
+                self._inner_middlewares(router), handler_obj.call
+            )
+            try:
+                self.hits += 1
+                return await wrapped(event, kwargs)
+            except SkipHandler:
+                pass  # Хэндлер отказался — пусть решит обычная маршрутизация
+
+        self.fallbacks += 1
+        return await handler(event, data)
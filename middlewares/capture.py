@@ -0,0 +1,269 @@
+# middlewares/capture.py
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from monitoring import registry
+
+# --- НАСТРОЙКИ ---
+CAPTURE_SAMPLE = float(os.getenv("CAPTURE_SAMPLE", "0"))      # Доля пользователей/чатов, чьи апдейты пишутся; 0 — выкл.
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "captures")
+CAPTURE_FILE_MB = float(os.getenv("CAPTURE_FILE_MB", "100"))  # Ротация по объему JSON до сжатия
+CAPTURE_FILES = int(os.getenv("CAPTURE_FILES", "10"))         # Сколько файлов хранить; 0 — все
+CAPTURE_FLUSH_SECONDS = 5                                     # Сброс gzip на диск не чаще (сжатие лучше)
+CAPTURE = CAPTURE_SAMPLE > 0
+
+# Ключ псевдонимов. Без CAPTURE_SALT — случайный на запуск (воркеры наследуют его через окружение);
+# для повторов на копии базы (tools/replay.py) его нужно знать, поэтому лучше задать явно.
+CAPTURE_SALT_SET = bool(os.getenv("CAPTURE_SALT"))
+CAPTURE_SALT = os.getenv("CAPTURE_SALT") or secrets.token_hex(16)
+os.environ.setdefault("CAPTURE_SALT", CAPTURE_SALT)
+
+CAPTURED = "bot_capture_total"
+
+# --- ПСЕВДОНИМЫ ---
+# id пользователей и чатов заменяются на HMAC от id: стабильно в пределах ключа, знак сохраняется.
+# Псевдонимы лежат в [PSEUDO_MIN, PSEUDO_MIN * 10): их не спутать с настоящими id, повторная
+# обработка их не меняет. Поля id / *_id заменяются всегда, какой бы маленький ни был id;
+# порог ID_MIN — только для чисел внутри текста (суммы, ставки, номера грядок там не трогаются).
+ID_MIN = 10_000_000
+PSEUDO_MIN = 10 ** 13
+_NUMBER = re.compile(r"-?\d{8,14}")
+_WORD = re.compile(r"\w{1,32}")
+
+# *_id, которые не указывают на пользователя или чат (счетчики Telegram) — остаются как есть
+NOT_ID_KEYS = {"update_id", "message_id", "message_thread_id", "reply_to_message_id"}
+DROP_KEYS = {"last_name", "bio", "description", "phone_number", "email", "contact", "location", "venue",
+             "invite_link", "photo", "document", "voice", "video", "video_note", "audio", "animation", "sticker"}
+
+
+def pseudonymize(value: int, salt: str = CAPTURE_SALT) -> int:
+    """Псевдоним id пользователя или чата. 0 — не id, псевдонимы не меняются."""
+    if value == 0 or PSEUDO_MIN <= abs(value) < PSEUDO_MIN * 10:
+        return value
+    digest = hmac.new(salt.encode(), str(abs(value)).encode(), hashlib.sha256).digest()
+    pseudo = PSEUDO_MIN + int.from_bytes(digest[:8], "big") % (9 * PSEUDO_MIN)
+    return -pseudo if value < 0 else pseudo
+
+
+def pseudonymize_username(username: str, salt: str = CAPTURE_SALT) -> str:
+    digest = hmac.new(salt.encode(), username.lower().encode(), hashlib.sha256).hexdigest()
+    return f"u{digest[:12]}"
+
+
+def pseudonymize_numbers(text: str, salt: str = CAPTURE_SALT) -> str:
+    """Похожие на id числа внутри строки (callback_data, аргументы команд, JSON): не меньше ID_MIN."""
+    def replace(match: re.Match) -> str:
+        value = int(match.group())
+        return str(pseudonymize(value, salt)) if abs(value) >= ID_MIN else match.group()
+    return _NUMBER.sub(replace, text)
+
+
+def _anonymize_arg(arg: str, salt: str) -> str:
+    if arg.startswith("@") and len(arg) > 1:
+        return "@" + pseudonymize_username(arg[1:], salt)
+    if arg.lstrip("-").isdigit():
+        return pseudonymize_numbers(arg, salt)
+    return arg if _WORD.fullmatch(arg) else "x" * len(arg)
+
+
+def anonymize_text(text: str, salt: str = CAPTURE_SALT) -> str:
+    """
+    Команды остаются командами (фильтры Command сработают так же): сама команда, числа
+    и короткие слова-аргументы (id ресурсов, ставки) сохраняются, @упоминания — псевдонимы.
+    Прочий текст — "x" той же длины; числа целиком (ввод сумм и id в FSM) — сохраняются.
+    """
+    if text.startswith(("/", "!")):
+        command, *args = text.split()
+        return " ".join([command, *(_anonymize_arg(arg, salt) for arg in args)])
+    if text.strip().lstrip("-").isdigit():
+        return pseudonymize_numbers(text, salt)
+    return "x" * len(text)
+
+
+def is_id_key(key: str) -> bool:
+    """Поле с id пользователя или чата: id, user_id, chat_id, creator_id..."""
+    return (key == "id" or key.endswith("_id")) and key not in NOT_ID_KEYS
+
+
+def anonymize(obj: Any, salt: str = CAPTURE_SALT) -> Any:
+    """Обезличенная копия апдейта (dict из model_dump): id, имена, тексты, контакты, медиа."""
+    if isinstance(obj, list):
+        return [anonymize(item, salt) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    result = {}
+    for key, value in obj.items():
+        if key in DROP_KEYS:
+            continue
+        if isinstance(value, int) and not isinstance(value, bool) and is_id_key(key):
+            result[key] = pseudonymize(value, salt)
+        elif key == "first_name":
+            result[key] = "User"
+        elif key == "title":
+            result[key] = "Chat"
+        elif key == "username" and isinstance(value, str):
+            result[key] = pseudonymize_username(value, salt)
+        elif key in ("text", "caption") and isinstance(value, str):
+            result[key] = anonymize_text(value, salt)
+        elif key == "data" and isinstance(value, str):
+            result[key] = pseudonymize_numbers(value, salt)
+        elif key in ("entities", "caption_entities"):
+            # Смещения прочих сущностей после замены текста неверны, text_mention содержит пользователя
+            result[key] = [e for e in value if e.get("type") == "bot_command"]
+        else:
+            result[key] = anonymize(value, salt)
+    return result
+
+
+class CaptureFileWriter:
+    """
+    Поток записи: обезличивание и gzip вне event loop.
+    Строка — {"ts": время прихода, "update": апдейт}; новый файл по объему, старые удаляются.
+    """
+
+    def __init__(self, directory: str, name: str, max_bytes: int, keep: int):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.path = ""
+        self.queue: queue.Queue = queue.Queue(maxsize=10_000)
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="update-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def put(self, ts: float, update: Dict[str, Any]) -> bool:
+        try:
+            self.queue.put_nowait((ts, update))
+            return True
+        except queue.Full:
+            return False
+
+    def files(self) -> List[str]:
+        prefix = f"{self.name}-"
+        return sorted(
+            os.path.join(self.directory, f) for f in os.listdir(self.directory)
+            if f.startswith(prefix) and f.endswith(".jsonl.gz")
+        )
+
+    def _open(self):
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(self.directory, f"{self.name}-{stamp}.jsonl.gz")
+        stream = gzip.open(self.path, "at", encoding="utf-8", compresslevel=6)
+        if self.keep > 0:
+            for old in self.files()[:-self.keep]:
+                os.remove(old)
+        return stream
+
+    def _run(self):
+        stream = self._open()
+        written = 0
+        flushed = time.monotonic()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                ts, update = item
+                line = json.dumps({"ts": round(ts, 4), "update": anonymize(update)}, ensure_ascii=False) + "\n"
+                try:
+                    if written >= self.max_bytes:
+                        stream.close()
+                        stream = self._open()
+                        written = 0
+                    stream.write(line)
+                    written += len(line)
+                    # Сброс режет поток сжатия на блоки — только в паузах и не чаще раза в несколько секунд
+                    if self.queue.empty() and time.monotonic() - flushed >= CAPTURE_FLUSH_SECONDS:
+                        stream.flush()
+                        flushed = time.monotonic()
+                except OSError as e:
+                    logging.error(f"[Capture] Не удалось записать апдейт: {e}")
+        finally:
+            stream.close()
+
+
+class UpdateCapture:
+    """
+    Запись входящих апдейтов для повторов (tools/replay.py): обезличенный JSONL в gzip.
+
+    Пишутся апдейты CAPTURE_SAMPLE пользователей (выбор по id — сценарии пользователя
+    и чата остаются целыми). В цикле — только model_dump и put_nowait в очередь;
+    обезличивание, JSON и сжатие — в потоке записи. Переполнение очереди — апдейт пропускается.
+    """
+
+    def __init__(self, sample: float = CAPTURE_SAMPLE):
+        self.sample = sample
+        self.writer: Optional[CaptureFileWriter] = None
+        registry.describe(CAPTURED, "Записанные для повторов апдейты (written / dropped)")
+
+    @property
+    def enabled(self) -> bool:
+        return self.writer is not None
+
+    def start(self, name: str = "updates", directory: str = CAPTURE_DIR):
+        if self.sample <= 0:
+            return
+        self.writer = CaptureFileWriter(directory, name, int(CAPTURE_FILE_MB * 1024 * 1024), CAPTURE_FILES)
+        self.writer.start()
+        logging.info(f"[Capture] Апдейты ({self.sample:.0%} пользователей) пишутся в {directory}/{name}-*.jsonl.gz")
+        if not CAPTURE_SALT_SET:
+            logging.warning("[Capture] CAPTURE_SALT не задан: псевдонимы со случайным ключом, "
+                            "повтор на копии базы (tools/replay.py --anonymize-db) будет невозможен")
+
+    def stop(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+    def sampled(self, key: int) -> bool:
+        return self.sample >= 1 or zlib.crc32(str(key).encode()) % 10_000 < self.sample * 10_000
+
+    def record(self, update: Update, key: Optional[int]):
+        writer = self.writer
+        if writer is None or (key is not None and not self.sampled(key)):
+            return
+        dump = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+        registry.inc(CAPTURED, result="written" if writer.put(time.time(), dump) else "dropped")
+
+
+capture = UpdateCapture()
+
+
+class UpdateCaptureMiddleware(BaseMiddleware):
+    """Outer-middleware для dp.update: апдейт записывается в момент прихода, до очереди ключа."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        capture.record(event, user.id if user is not None else chat.id if chat is not None else None)
+        return await handler(event, data)
@@ -0,0 +1,57 @@
+# middlewares/db_session.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+from database import flush_current_session
+from monitoring import tracer
+from storage import Storage
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: один апдейт — одна сессия БД (по соединению на домен).
+
+    Все вызовы db.* внутри хэндлера идут через общие соединения. Коммит — перед каждым
+    вызовом Bot API (SessionCommitMiddleware), при переходе к другому домену и после хэндлера;
+    при исключении откатывается то, что еще не закоммичено. Это не одна транзакция на апдейт:
+    границы коммита описаны в database.py (СЕССИЯ).
+    Долгие хэндлеры (рассылка и т.п.) отключают сессию флагом: flags={"db_session": False}.
+    До хэндлера отмечается активность пользователя: архивный пользователь возвращается
+    в рабочие таблицы раньше, чем хэндлер их прочитает.
+    """
+
+    def __init__(self, db: Storage):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            await self.db.touch_user(user.id)
+        if not get_flag(data, "db_session", default=True):
+            return await handler(event, data)
+        # Span включает и коммит после хэндлера
+        with tracer.span("db.session"):
+            async with self.db.session() as session:
+                data["db_session"] = session
+                return await handler(event, data)
+
+
+class SessionCommitMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: перед вызовом Bot API коммитит сессию БД апдейта.
+    Иначе блокировка записи живет, пока ждем ответа Telegram, и остальные писатели стоят в очереди.
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        await flush_current_session()
+        return await make_request(bot, method)
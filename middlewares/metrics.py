@@ -0,0 +1,71 @@
+# middlewares/metrics.py
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.types import CallbackQuery, TelegramObject
+
+from monitoring import MetricsRegistry, registry
+
+HANDLER_SECONDS = "bot_handler_seconds"
+HANDLER_CALLS = "bot_handler_calls_total"
+HANDLER_ERRORS = "bot_handler_errors_total"
+HANDLER_IN_FLIGHT = "bot_handler_in_flight"
+
+
+def handler_labels(data: Dict[str, Any], event: TelegramObject) -> Dict[str, str]:
+    """Метки апдейта: модуль хэндлера (роутер), имя хэндлера, префикс CallbackData."""
+    handler_obj = data.get("handler")
+    callback = getattr(handler_obj, "callback", None)
+    module = getattr(callback, "__module__", "") or ""
+    prefix = ""
+    if isinstance(event, CallbackQuery) and event.data:
+        prefix = event.data.partition(":")[0]
+    return {
+        "router": module.rpartition(".")[2],
+        "handler": getattr(callback, "__name__", "unknown"),
+        "prefix": prefix,
+    }
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: задержка, число вызовов, ошибки и "в работе" по каждому хэндлеру.
+
+    Регистрируется раньше DbSessionMiddleware — в задержку входит и коммит сессии.
+    Роутеры в проекте без имен, поэтому "router" — модуль хэндлера (farm, game_raid, ...).
+    """
+
+    def __init__(self, metrics: MetricsRegistry = registry):
+        self.metrics = metrics
+        metrics.describe(HANDLER_SECONDS, "Время обработки апдейта хэндлером (с)")
+        metrics.describe(HANDLER_CALLS, "Вызовы хэндлеров по статусу (ok / error / skipped)")
+        metrics.describe(HANDLER_ERRORS, "Исключения в хэндлерах по типу")
+        metrics.describe(HANDLER_IN_FLIGHT, "Апдейтов в обработке сейчас")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = handler_labels(data, event)
+        metrics = self.metrics
+        metrics.add(HANDLER_IN_FLIGHT, 1, **labels)
+        status = "ok"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except SkipHandler:
+            status = "skipped"
+            raise
+        except Exception as e:
+            status = "error"
+            metrics.inc(HANDLER_ERRORS, error=type(e).__name__, **labels)
+            raise
+        finally:
+            metrics.add(HANDLER_IN_FLIGHT, -1, **labels)
+            if status != "skipped":
+                metrics.observe(HANDLER_SECONDS, time.perf_counter() - started, **labels)
+            metrics.inc(HANDLER_CALLS, status=status, **labels)
@@ -0,0 +1,122 @@
+# middlewares/ordering.py
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+# Сколько апдейтов (с разными ключами) обрабатывается одновременно
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# С какой длины очереди одного ключа писать предупреждение в лог
+BACKLOG_WARNING = 20
+
+# Групповые игры: состояние общее на чат, поэтому их апдейты идут в очередь чата.
+# Рейтинг игрока при этом пишут обе очереди (ставка в чате, /beer у пользователя), так что
+# ключ его не защищает: списания атомарны в SQL (change_rating, spend_rating, take_jackpot)
+CHAT_CALLBACK_PREFIXES = frozenset({"roulette", "raid", "raid_attack"})
+CHAT_COMMANDS = frozenset({"roulette"})
+
+
+def update_key(update: Update) -> Optional[str]:
+    """Ключ очереди для апдейта: "chat:<id>" для групповых игр, иначе "user:<id>"."""
+    if update.callback_query:
+        query = update.callback_query
+        prefix = (query.data or "").partition(":")[0]
+        if prefix in CHAT_CALLBACK_PREFIXES and query.message:
+            return f"chat:{query.message.chat.id}"
+        return f"user:{query.from_user.id}"
+
+    if update.message:
+        message = update.message
+        text = message.text or ""
+        if text.startswith("/"):
+            command = text[1:].split(maxsplit=1)[0].split("@")[0].lower() if len(text) > 1 else ""
+            if command in CHAT_COMMANDS:
+                return f"chat:{message.chat.id}"
+        if message.from_user:
+            return f"user:{message.from_user.id}"
+        return f"chat:{message.chat.id}"
+
+    if update.my_chat_member:
+        return f"chat:{update.my_chat_member.chat.id}"
+
+    return None
+
+
+class _KeyQueue:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # Ожидающие получают lock строго по очереди (FIFO)
+        self.pending = 0            # В очереди + в обработке
+
+
+class KeyedUpdateExecutor(BaseMiddleware):
+    """
+    Outer-middleware для dp.update.
+
+    Апдейты одного ключа (пользователь, а для рулетки/рейда — чат) обрабатываются строго
+    по порядку, один за другим: двойной клик по кнопке фермы не перемешает read-modify-write
+    в modify_inventory. Апдейты разных ключей идут параллельно, но не больше `concurrency` сразу.
+    Очередь ключа живет, пока в ней есть апдейты; глобальных блокировок нет.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY):
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queues: Dict[str, _KeyQueue] = {}
+        self.active = 0
+
+    # --- ОЧЕРЕДИ ---
+
+    def backlog(self, key: str) -> int:
+        """Сколько апдейтов ключа ждет или обрабатывается сейчас."""
+        queue = self._queues.get(key)
+        return queue.pending if queue else 0
+
+    def backlogs(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Самые длинные очереди: [(ключ, длина), ...]."""
+        items = sorted(((k, q.pending) for k, q in self._queues.items()), key=lambda kv: kv[1], reverse=True)
+        return items[:limit]
+
+    @property
+    def total_backlog(self) -> int:
+        return sum(q.pending for q in self._queues.values())
+
+    # --- ОБРАБОТКА ---
+
+    async def _run(self, handler, event, data):
+        async with self._slots:
+            self.active += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.active -= 1
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = update_key(event)
+        if key is None:
+            return await self._run(handler, event, data)
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _KeyQueue()
+        queue.pending += 1
+        if queue.pending == BACKLOG_WARNING:
+            logging.warning("[Update Executor] Очередь %s: %s апдейтов.", key, queue.pending)
+
+        data["update_key"] = key
+        try:
+            async with queue.lock:
+                return await self._run(handler, event, data)
+        finally:
+            queue.pending -= 1
+            if queue.pending == 0:
+                del self._queues[key]
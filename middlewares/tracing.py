@@ -0,0 +1,50 @@
+# middlewares/tracing.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+from monitoring import tracer
+from .metrics import handler_labels
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для dp.update, регистрируется первым: корень трассы апдейта.
+    Вложено все остальное — ожидание в очереди ключа, middleware, хэндлер, БД, Bot API.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        with tracer.trace(f"update {event.event_type}", update_id=event.update_id,
+                          user_id=user.id if user is not None else None):
+            return await handler(event, data)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Inner-middleware, регистрируется последним: span самого хэндлера (без остальных middleware)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = handler_labels(data, event)
+        with tracer.span(f"handler {labels['router']}.{labels['handler']}", prefix=labels["prefix"]):
+            return await handler(event, data)
+
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: span на каждый вызов Bot API (sendMessage, editMessageText, ...)."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        with tracer.span(f"telegram.{method.__api_method__}", kind="CLIENT", remote="telegram"):
+            return await make_request(bot, method)
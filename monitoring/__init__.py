@@ -0,0 +1,7 @@
+# monitoring/__init__.py
+from .metrics import Histogram, MetricsRegistry, registry
+from .loop import LoopMonitor, loop_monitor, task_snapshot
+from .profiler import ProfileResult, SamplingProfiler, profiler
+from .http import METRICS_PORT, MetricsServer, start_metrics_server
+from .sql import InstrumentedConnection, instrument_methods, query_stats, sql_template
+from .tracing import NOOP_SPAN, TRACING, Span, Tracer, tracer
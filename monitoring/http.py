@@ -0,0 +1,61 @@
+# monitoring/http.py
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from .metrics import MetricsRegistry, registry
+
+# --- НАСТРОЙКИ ---
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")   # Только локально: наружу — через свой прокси/агент
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))   # 0 — выключено; воркер i слушает METRICS_PORT + 1 + i
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+class MetricsServer:
+    """
+    Локальный HTTP для мониторинга: /metrics (формат Prometheus) и /stats (JSON).
+    Другие модули monitoring добавляют свои страницы через add_route().
+    """
+
+    def __init__(self, metrics: MetricsRegistry = registry):
+        self.metrics = metrics
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self.handle_metrics)
+        self.app.router.add_get("/stats", self.handle_stats)
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_route(self, path: str, handler: Handler):
+        self.app.router.add_get(path, handler)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics.snapshot())
+
+    async def start(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"[Metrics] http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[MetricsServer]:
+    """Поднимает сервер метрик (None — выключен или порт занят: бот работает и без него)."""
+    if port <= 0:
+        return None
+    server = MetricsServer()
+    try:
+        await server.start(host, port)
+    except OSError as e:
+        logging.warning(f"[Metrics] Не удалось занять {host}:{port}: {e}")
+        return None
+    return server
@@ -0,0 +1,143 @@
+# monitoring/loop.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+from .metrics import registry
+
+# --- НАСТРОЙКИ ---
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))   # Как часто меряем задержку планирования (с)
+LOOP_STALL_MS = float(os.getenv("LOOP_STALL_MS", "200"))           # Задержка, которая считается зависанием
+LOOP_ALERT_INTERVAL = float(os.getenv("LOOP_ALERT_INTERVAL", "600"))  # Не чаще одного сообщения админу (с)
+STACK_LIMIT = 25
+TOP_TASKS = 10
+
+LOOP_LAG_SECONDS = "bot_loop_lag_seconds"
+LOOP_STALLS = "bot_loop_stalls_total"
+LOOP_TASKS = "bot_loop_tasks"
+
+# Корзины для задержки цикла: важны миллисекунды
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+@dataclass
+class StallReport:
+    at: float                          # time.time() конца зависания
+    lag: float                         # На сколько опоздал тик (с)
+    stack: str                         # Стек потока цикла, снятый во время зависания
+    tasks: List[Tuple[str, int]] = field(default_factory=list)  # (корутина и где стоит, сколько задач)
+
+    def describe(self, limit: int = 1500) -> str:
+        tasks = "\n".join(f"{count:>4} × {name}" for name, count in self.tasks)
+        stack = self.stack[-limit:] if self.stack else "(стек не снят — зависание короче периода сторожа)"
+        return f"⏱ Цикл событий стоял {self.lag * 1000:.0f} ms\n\nСтек:\n{stack}\n\nЗадачи:\n{tasks}"
+
+
+def task_snapshot(limit: int = TOP_TASKS) -> List[Tuple[str, int]]:
+    """Живые задачи, сгруппированные по корутине и месту, где она сейчас ждет."""
+    counter: Counter = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", repr(coro))
+        frames = task.get_stack(limit=1)
+        if frames:
+            frame = frames[-1]
+            name += f" @ {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+        counter[name] += 1
+    return counter.most_common(limit)
+
+
+class LoopMonitor:
+    """
+    Сторож event loop.
+
+    Тикер в цикле каждые `interval` секунд меряет, на сколько позже запланированного
+    он проснулся (задержка планирования -> гистограмма bot_loop_lag_seconds).
+    Отдельный поток-сторож следит за тиками: если цикл не тикал дольше порога,
+    он снимает стек потока цикла прямо во время зависания — видно, какой хэндлер
+    держит цикл (синхронный JSON, длинный цикл без await и т.п.).
+    Когда зависание кончилось, к стеку добавляется снимок задач; отчет идет в лог,
+    в метрики и (не чаще LOOP_ALERT_INTERVAL) админу.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, stall_ms: float = LOOP_STALL_MS):
+        self.interval = interval
+        self.threshold = stall_ms / 1000
+        self.stalls: Deque[StallReport] = deque(maxlen=20)
+        self.max_lag = 0.0
+        self.notify: Optional[Callable[[str], Awaitable[None]]] = None
+        self._heartbeat = time.monotonic()
+        self._stack: Optional[str] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._last_alert = 0.0
+        registry.describe(LOOP_LAG_SECONDS, "Задержка планирования event loop (с)")
+        registry.describe(LOOP_STALLS, "Зависания event loop дольше LOOP_STALL_MS")
+
+    @property
+    def lag_histogram(self):
+        return registry.histogram(LOOP_LAG_SECONDS, buckets=LAG_BUCKETS)
+
+    def start(self, notify: Optional[Callable[[str], Awaitable[None]]] = None):
+        self.notify = notify
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+        registry.collector(lambda metrics: metrics.set(LOOP_TASKS, len(asyncio.all_tasks())))
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # --- ЦИКЛ ---
+
+    async def _tick(self):
+        histogram = self.lag_histogram
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            histogram.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._on_stall(lag)
+
+    def _watchdog(self):
+        """Поток: снимает стек цикла, пока тот стоит (sys._current_frames)."""
+        period = max(self.threshold / 2, 0.01)
+        captured_for = None
+        while not self._stop.wait(period):
+            heartbeat = self._heartbeat
+            if time.monotonic() - heartbeat < self.interval + self.threshold or captured_for == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            captured_for = heartbeat
+
+    def _on_stall(self, lag: float):
+        report = StallReport(at=time.time(), lag=lag, stack=self._stack or "", tasks=task_snapshot())
+        self._stack = None
+        self.stalls.append(report)
+        registry.inc(LOOP_STALLS)
+        logging.warning(f"[Loop] {report.describe()}")
+        if self.notify is not None and time.monotonic() - self._last_alert >= LOOP_ALERT_INTERVAL:
+            self._last_alert = time.monotonic()
+            asyncio.create_task(self.notify(report.describe()))
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,165 @@
+# monitoring/metrics.py
+import bisect
+from typing import Callable, Dict, List, Tuple
+
+# Границы корзин гистограмм задержек (секунды): от 1 мс до 30 с
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: O(log n) на наблюдение, память не растет."""
+
+    __slots__ = ("buckets", "counts", "count", "total", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина — больше верхней границы (+Inf)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else max(self.max, lower)
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса: счетчики, gauge'и и гистограммы с метками.
+
+    Все обновления — из event loop (без блокировок). Значения, которые дешевле считать
+    при экспорте (длины очередей и т.п.), регистрируются через collector().
+    Экспорт — в текстовом формате Prometheus (render) и словарем (snapshot) для /stats.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self._collectors: List[Callable[["MetricsRegistry"], None]] = []
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    # --- ОБНОВЛЕНИЕ ---
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def add(self, name: str, delta: float, **labels):
+        series = self.gauges.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + delta
+
+    def histogram(self, name: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels) -> Histogram:
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram(buckets)
+        return hist
+
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def collector(self, fn: Callable[["MetricsRegistry"], None]):
+        """fn(registry) вызывается перед каждым экспортом — обновить gauge'и."""
+        self._collectors.append(fn)
+
+    def collect(self):
+        for fn in self._collectors:
+            fn(self)
+
+    # --- ЭКСПОРТ ---
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        self.collect()
+        lines = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name, series in sorted(metrics.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name, series in sorted(self.histograms.items()):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series.items():
+                cumulative = 0
+                for bound, count in zip((*hist.buckets, "+Inf"), hist.counts):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, list]:
+        """Все серии словарем: гистограммы — count/mean/p50/p99/max (в мс)."""
+        self.collect()
+        result: Dict[str, list] = {}
+        for metrics in (self.counters, self.gauges):
+            for name, series in metrics.items():
+                result[name] = [{**dict(labels), "value": value} for labels, value in series.items()]
+        for name, series in self.histograms.items():
+            result[name] = [
+                {
+                    **dict(labels),
+                    "count": hist.count,
+                    "mean_ms": round(hist.mean * 1000, 2),
+                    "p50_ms": round(hist.quantile(0.5) * 1000, 2),
+                    "p99_ms": round(hist.quantile(0.99) * 1000, 2),
+                    "max_ms": round(hist.max * 1000, 2),
+                }
+                for labels, hist in series.items()
+            ]
+        return result
+
+
+registry = MetricsRegistry()
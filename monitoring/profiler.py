@@ -0,0 +1,129 @@
+# monitoring/profiler.py
+import asyncio
+import cProfile
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Tuple
+
+# --- НАСТРОЙКИ ---
+PROFILE_DIR = os.getenv("PROFILE_DIR", "") or os.path.join(tempfile.gettempdir(), "piva-profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))   # Период выборки стека (с)
+PROFILE_MAX_SECONDS = 300
+STACK_DEPTH = 64
+
+
+@dataclass
+class ProfileResult:
+    path: str
+    mode: str                 # sampling / pstats
+    seconds: float
+    samples: int = 0
+    cpu_seconds: float = 0.0  # CPU процесса за время профилирования
+    top: List[Tuple[str, int]] = field(default_factory=list)  # Самые частые "листья" стека
+
+    def describe(self) -> str:
+        lines = [f"🔬 Профиль ({self.mode}) за {self.seconds:.0f} с, CPU {self.cpu_seconds:.1f} с "
+                 f"({self.cpu_seconds / max(self.seconds, 1e-9):.0%})"]
+        if self.samples:
+            lines.append(f"Выборок: {self.samples}")
+            lines += [f"{count / self.samples:>5.1%}  {name}" for name, count in self.top]
+        return "\n".join(lines)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """
+    Профилировщик по запросу (команда /profile).
+
+    sampling — поток раз в PROFILE_INTERVAL снимает стек потока event loop
+    (sys._current_frames) и копит "свернутые" стеки (формат flamegraph.pl / speedscope).
+    Корень каждого стека — корутина текущей asyncio-задачи, так время раскладывается
+    по хэндлерам. Считается wall time: ожидание в select() тоже видно (это простой цикла).
+    pstats — cProfile в потоке цикла (точные вызовы и CPU, но с накладными расходами).
+    Пока профилирование выключено, ничего не работает и ничего не стоит.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, mode: str = "sampling") -> ProfileResult:
+        seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+        async with self._lock:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            cpu_started = time.process_time()
+            if mode == "pstats":
+                result = await self._run_cprofile(seconds, os.path.join(PROFILE_DIR, f"profile_{stamp}.pstats"))
+            else:
+                result = await self._run_sampling(seconds, os.path.join(PROFILE_DIR, f"profile_{stamp}.collapsed"))
+            result.cpu_seconds = time.process_time() - cpu_started
+            return result
+
+    async def _run_cprofile(self, seconds: float, path: str) -> ProfileResult:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        await asyncio.to_thread(profiler.dump_stats, path)
+        return ProfileResult(path=path, mode="pstats", seconds=seconds)
+
+    async def _run_sampling(self, seconds: float, path: str) -> ProfileResult:
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        leaves: Counter = Counter()
+        stop = threading.Event()
+
+        def sample():
+            current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(loop_thread)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None and len(names) < STACK_DEPTH:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                task = current_tasks.get(loop)
+                root = f"task:{getattr(task.get_coro(), '__qualname__', '?')}" if task is not None else "loop"
+                stacks[";".join([root, *reversed(names)])] += 1
+                leaves[names[0]] += 1
+
+        thread = threading.Thread(target=sample, name="profiler", daemon=True)
+        thread.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(thread.join)
+
+        def write():
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        await asyncio.to_thread(write)
+        return ProfileResult(
+            path=path, mode="sampling", seconds=seconds,
+            samples=sum(stacks.values()), top=leaves.most_common(8),
+        )
+
+
+profiler = SamplingProfiler()
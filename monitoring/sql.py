@@ -0,0 +1,203 @@
+# monitoring/sql.py
+import functools
+import inspect
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+from .metrics import Histogram, registry
+from .tracing import tracer
+
+# --- НАСТРОЙКИ ---
+SQL_STATS = os.getenv("SQL_STATS", "1") == "1"               # Учет запросов (доли микросекунды на запрос)
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "50"))           # Порог медленного запроса
+EXPLAIN_INTERVAL = 60                                        # Один EXPLAIN на шаблон не чаще раза в минуту
+MAX_TEMPLATES = 2000                                         # Защита от взрыва числа пар (метод, шаблон)
+
+DB_METHOD_SECONDS = "bot_db_method_seconds"
+DB_QUERY_SECONDS = "bot_db_query_seconds"
+
+# Метод Database, внутри которого выполняется запрос (для атрибуции)
+_current_method: ContextVar[str] = ContextVar("db_method", default="")
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+@functools.lru_cache(maxsize=4096)
+def sql_template(sql: str) -> str:
+    """Шаблон запроса: без лишних пробелов, списки (?, ?, ...) и числа свернуты."""
+    text = _WHITESPACE.sub(" ", sql).strip()
+    text = _PLACEHOLDER_LIST.sub("(?+)", text)
+    return _NUMBER.sub("N", text)
+
+
+class QueryStat:
+    __slots__ = ("template", "method", "count", "total", "hist")
+
+    def __init__(self, template: str, method: str):
+        self.template = template
+        self.method = method
+        self.count = 0
+        self.total = 0.0
+        self.hist = Histogram()
+
+
+class QueryStats:
+    """
+    Счетчики и задержки по шаблонам SQL (выполнение + чтение строк курсора).
+    Ключ — (метод Database, шаблон): один запрос из разных методов учитывается раздельно.
+    """
+
+    def __init__(self, slow_ms: float = SQL_SLOW_MS):
+        self.slow = slow_ms / 1000
+        self.stats: Dict[Tuple[str, str], QueryStat] = {}
+        self.slow_count = 0
+        self._explained: Dict[str, float] = {}
+
+    def record(self, template: str, seconds: float, executed: bool = True):
+        method = _current_method.get()
+        key = (method, template)
+        stat = self.stats.get(key)
+        if stat is None:
+            if len(self.stats) >= MAX_TEMPLATES:
+                key = (method, "<other>")
+                stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = QueryStat(key[1], method)
+        if executed:
+            stat.count += 1
+            stat.hist.observe(seconds)
+        stat.total += seconds
+        registry.observe(DB_QUERY_SECONDS, seconds, method=stat.method or "-")
+
+    def top(self, limit: int = 10) -> List[QueryStat]:
+        return sorted(self.stats.values(), key=lambda s: s.total, reverse=True)[:limit]
+
+    def should_explain(self, template: str) -> bool:
+        now = time.monotonic()
+        if now - self._explained.get(template, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+            return False
+        self._explained[template] = now
+        return True
+
+    def reset(self):
+        self.stats.clear()
+        self._explained.clear()
+        self.slow_count = 0
+
+
+query_stats = QueryStats()
+
+
+async def _log_slow(conn: aiosqlite.Connection, sql: str, parameters: Any, seconds: float, phase: str):
+    query_stats.slow_count += 1
+    template = sql_template(sql)
+    method = _current_method.get() or "-"
+    plan = ""
+    if template.upper().startswith(_EXPLAINABLE) and query_stats.should_explain(template):
+        try:
+            cursor = await conn.execute("EXPLAIN QUERY PLAN " + sql, parameters or ())
+            plan = "\n".join(f"    {row[3]}" for row in await cursor.fetchall())
+        except Exception as e:
+            plan = f"    (EXPLAIN не удался: {e})"
+    logging.warning(
+        f"[SQL] Медленный запрос ({phase}) {seconds * 1000:.1f} ms в {method}: {template}"
+        + (f"\n  План:\n{plan}" if plan else "")
+    )
+
+
+class InstrumentedCursor:
+    """Курсор aiosqlite, который досчитывает время чтения строк к шаблону запроса."""
+
+    def __init__(self, cursor: aiosqlite.Cursor, conn: aiosqlite.Connection, sql: str, parameters: Any):
+        self._cursor = cursor
+        self._conn = conn
+        self._sql = sql
+        self._parameters = parameters
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    async def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = await fetch(*args)
+        elapsed = time.perf_counter() - started
+        query_stats.record(sql_template(self._sql), elapsed, executed=False)
+        if elapsed >= query_stats.slow:
+            await _log_slow(self._conn, self._sql, self._parameters, elapsed, "чтение")
+        return result
+
+    async def fetchone(self):
+        return await self._timed_fetch(self._cursor.fetchone)
+
+    async def fetchall(self):
+        return await self._timed_fetch(self._cursor.fetchall)
+
+    async def fetchmany(self, size: Optional[int] = None):
+        return await self._timed_fetch(self._cursor.fetchmany, size)
+
+
+class InstrumentedConnection:
+    """
+    Обертка над соединением aiosqlite: каждый execute/executemany учитывается в query_stats,
+    медленные запросы пишутся в лог вместе с EXPLAIN QUERY PLAN. Остальное — как у соединения.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def execute(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> InstrumentedCursor:
+        template = sql_template(sql)
+        started = time.perf_counter()
+        with tracer.span("sql", kind="CLIENT", remote="sqlite", sql=template):
+            cursor = await self._conn.execute(sql, parameters)
+        elapsed = time.perf_counter() - started
+        query_stats.record(template, elapsed)
+        if elapsed >= query_stats.slow:
+            await _log_slow(self._conn, sql, parameters, elapsed, "выполнение")
+        return InstrumentedCursor(cursor, self._conn, sql, parameters)
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> aiosqlite.Cursor:
+        template = sql_template(sql)
+        started = time.perf_counter()
+        with tracer.span("sql", kind="CLIENT", remote="sqlite", sql=template):
+            cursor = await self._conn.executemany(sql, parameters)
+        query_stats.record(template, time.perf_counter() - started)
+        return cursor
+
+
+def instrument_methods(cls: type) -> type:
+    """
+    Оборачивает публичные async-методы класса хранилища: время метода (bot_db_method_seconds),
+    имя метода для запросов внутри него (атрибуция в /db_stats) и span db.<метод> в трассе апдейта.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+
+        def wrap(func=func, name=name):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                token = _current_method.set(name)
+                started = time.perf_counter()
+                try:
+                    with tracer.span(f"db.{name}", kind="CLIENT", remote="sqlite"):
+                        return await func(*args, **kwargs)
+                finally:
+                    registry.observe(DB_METHOD_SECONDS, time.perf_counter() - started, method=name)
+                    _current_method.reset(token)
+            return wrapper
+
+        setattr(cls, name, wrap())
+    return cls
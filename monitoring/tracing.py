@@ -0,0 +1,241 @@
+# monitoring/tracing.py
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from .metrics import registry
+
+# --- НАСТРОЙКИ ---
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0"))           # Head: доля апдейтов, которые пишутся всегда
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))      # Tail: апдейты дольше порога (и с ошибкой); 0 — выкл.
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+TRACE_FILE_MB = float(os.getenv("TRACE_FILE_MB", "20"))        # Ротация файла трасс
+TRACE_FILES = int(os.getenv("TRACE_FILES", "5"))               # Сколько старых файлов хранить
+TRACE_MAX_SPANS = 500                                          # Защита от трасс-гигантов (рассылки и т.п.)
+TRACE_SERVICE = "piva-bot"
+TRACING = TRACE_SAMPLE > 0 or TRACE_SLOW_MS > 0
+
+TRACES = "bot_traces_total"
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "sampled", "closed")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+        self.sampled = sampled
+        self.closed = False
+
+
+class Span:
+    """Участок трассы. Время — микросекунды (как в Zipkin)."""
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "remote",
+                 "timestamp", "duration", "tags", "error", "_started", "_token")
+
+    def __init__(self, trace: Trace, parent: Optional["Span"], name: str, kind: Optional[str],
+                 remote: Optional[str], tags: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.kind = kind
+        self.remote = remote
+        self.tags = tags
+        self.error = False
+        self.timestamp = 0
+        self.duration = 0
+        self._started = 0.0
+        self._token = None
+
+    def tag(self, key: str, value: Any):
+        self.tags[key] = value
+
+    def __enter__(self) -> "Span":
+        self.timestamp = int(time.time() * 1_000_000)
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = max(1, int((time.perf_counter() - self._started) * 1_000_000))
+        _current.reset(self._token)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.error = True
+            self.tags["error"] = f"{exc_type.__name__}: {exc}"[:300]
+        trace = self.trace
+        if not trace.closed and len(trace.spans) < TRACE_MAX_SPANS:
+            trace.spans.append(self)
+        if self.parent_id is None:
+            tracer.finish(trace, self)
+        return False
+
+    def to_zipkin(self) -> Dict[str, Any]:
+        entry = {
+            "traceId": self.trace.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "localEndpoint": {"serviceName": tracer.service},
+        }
+        if self.parent_id is not None:
+            entry["parentId"] = self.parent_id
+        if self.kind:
+            entry["kind"] = self.kind
+        if self.remote:
+            entry["remoteEndpoint"] = {"serviceName": self.remote}
+        if self.tags:
+            entry["tags"] = {k: str(v) for k, v in self.tags.items()}
+        return entry
+
+
+class _NoopSpan:
+    """Вне трассы span() ничего не делает и почти ничего не стоит."""
+
+    def tag(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class TraceFileWriter:
+    """Поток записи трасс: одна строка JSON (массив span'ов Zipkin v2) на трассу, ротация по размеру."""
+
+    def __init__(self, directory: str, name: str, max_bytes: int, backups: int):
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue: queue.Queue = queue.Queue(maxsize=1000)
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def put(self, spans: List[Span]) -> bool:
+        try:
+            self.queue.put_nowait(spans)
+            return True
+        except queue.Full:
+            return False
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _run(self):
+        stream = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                spans = self.queue.get()
+                if spans is None:
+                    break
+                line = json.dumps([span.to_zipkin() for span in spans], ensure_ascii=False) + "\n"
+                try:
+                    if stream.tell() >= self.max_bytes:
+                        stream.close()
+                        self._rotate()
+                        stream = open(self.path, "a", encoding="utf-8")
+                    stream.write(line)
+                    if self.queue.empty():
+                        stream.flush()
+                except OSError as e:
+                    logging.error(f"[Tracing] Не удалось записать трассу: {e}")
+        finally:
+            stream.close()
+
+
+class Tracer:
+    """
+    Трассировка апдейтов: апдейт -> middleware -> хэндлер -> вызовы Database / SQL / Bot API.
+
+    Трасса начинается в UpdateTracingMiddleware (tracer.trace), остальное — tracer.span(...)
+    там, где идет работа; span'ы вкладываются через contextvars. Вне трассы span() — no-op.
+    Сэмплирование: head — TRACE_SAMPLE апдейтов пишутся всегда; tail — остальные пишутся,
+    только если апдейт шел дольше TRACE_SLOW_MS или упал. Если оба выключены, трассы не собираются.
+    Формат — Zipkin v2 JSON (одна трасса на строку): POST в /api/v2/spans Zipkin или Jaeger.
+    """
+
+    def __init__(self, sample: float = TRACE_SAMPLE, slow_ms: float = TRACE_SLOW_MS):
+        self.sample = sample
+        self.slow = slow_ms / 1000 if slow_ms > 0 else None
+        self.service = TRACE_SERVICE
+        self.writer: Optional[TraceFileWriter] = None
+        registry.describe(TRACES, "Трассы апдейтов: записанные (head / tail) и отброшенные")
+
+    @property
+    def enabled(self) -> bool:
+        return self.writer is not None and (self.sample > 0 or self.slow is not None)
+
+    def start(self, name: str = "traces", directory: str = TRACE_DIR):
+        if self.sample <= 0 and self.slow is None:
+            return
+        self.writer = TraceFileWriter(directory, name, int(TRACE_FILE_MB * 1024 * 1024), TRACE_FILES)
+        self.writer.start()
+        tail = f"tail > {self.slow * 1000:.0f} ms" if self.slow is not None else "tail выкл."
+        logging.info(f"[Tracing] Трассы пишутся в {self.writer.path} (head {self.sample:.1%}, {tail})")
+
+    def stop(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
+    # --- SPAN'Ы ---
+
+    def trace(self, name: str, kind: Optional[str] = "SERVER", **tags: Any):
+        """Корень новой трассы (или no-op, если трассировка выключена)."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(Trace(random.random() < self.sample), None, name, kind, None, tags)
+
+    def span(self, name: str, kind: Optional[str] = None, remote: Optional[str] = None, **tags: Any):
+        parent = _current.get()
+        if parent is None or parent.trace.closed:
+            return NOOP_SPAN
+        return Span(parent.trace, parent, name, kind, remote, tags)
+
+    def current(self):
+        return _current.get() or NOOP_SPAN
+
+    def finish(self, trace: Trace, root: Span):
+        trace.closed = True
+        if trace.sampled:
+            reason = "head"
+        elif root.error or (self.slow is not None and root.duration >= self.slow * 1_000_000):
+            reason = "tail"
+        else:
+            return
+        writer = self.writer
+        if writer is None:
+            return
+        # В JSON span'ы превращает поток записи: трасса закрыта и больше не меняется
+        registry.inc(TRACES, result=reason if writer.put(trace.spans) else "dropped")
+
+
+tracer = Tracer()
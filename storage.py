@@ -0,0 +1,287 @@
+# storage.py
+import os
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Движок хранилища: sqlite (по умолчанию) | memory (бенчмарки, тесты, локальные прогоны)
+STORAGE = os.getenv("STORAGE", "sqlite").lower()
+
+# --- ЗНАЧЕНИЯ ПО УМОЛЧАНИЮ (общие для всех движков) ---
+DEFAULT_INVENTORY = {
+    'зерно': 0, 'хмель': 0,
+    'семя_зерна': 5, 'семя_хмеля': 3
+}
+
+DEFAULT_SETTINGS = [
+    ('beer_cooldown', 7200), ('jackpot_chance', 100),
+    ('roulette_cooldown', 300), ('roulette_min_bet', 10), ('roulette_max_bet', 1000),
+    ('ladder_min_bet', 10), ('ladder_max_bet', 500),
+    ('raid_boss_health', 1000), ('raid_reward_pool', 5000),
+    ('raid_duration_hours', 24), ('raid_hit_cooldown_minutes', 0),
+    ('raid_strong_hit_cost', 50), ('raid_strong_hit_damage_min', 30), ('raid_strong_hit_damage_max', 60),
+    ('raid_normal_hit_damage_min', 10), ('raid_normal_hit_damage_max', 20),
+    ('raid_reminder_hours', 4),
+    ('mafia_min_players', 4), ('mafia_max_players', 12),
+    ('mafia_lobby_timer', 60), ('mafia_night_timer', 60),
+    ('mafia_day_timer', 120), ('mafia_vote_timer', 60),
+    ('mafia_win_reward', 100), ('mafia_lose_reward', 10),
+    ('mafia_win_authority', 5), ('mafia_lose_authority', 1)
+]
+
+
+class TransferError(Exception):
+    """Сбой передачи предмета (Storage.transfer_item)."""
+
+
+class TransferAbortedError(TransferError):
+    """Сбой до точки коммита: получатель ничего не получил, списанное у отправителя возвращается."""
+
+
+class TransferPendingError(TransferError):
+    """Сбой после точки коммита: передача состоялась и будет доведена до конца (recover_transfers)."""
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища бота. Хэндлеры, middleware и фоновые задачи работают только через него.
+
+    Реализации: Database (SQLite, database.py) и MemoryStorage (словари, memory_storage.py).
+    Форма результатов у всех движков одинаковая — такая, как ее возвращает SQLite
+    (кортежи строк, dict для get_active_raid/get_user_farm_data), чтобы хэндлеры не знали о движке.
+    """
+
+    async def initialize(self):
+        """Создает схему / значения по умолчанию."""
+
+    @asynccontextmanager
+    async def session(self):
+        """Единица работы на апдейт (см. DbSessionMiddleware). По умолчанию — без транзакции."""
+        yield None
+
+    def data_files(self) -> List[str]:
+        """Файлы с данными (для бэкапа). Пусто — движок не хранит данные на диске."""
+        return []
+
+    # --- ПОЛЬЗОВАТЕЛИ ---
+
+    @abstractmethod
+    async def user_exists(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def add_user(self, user_id: int, first_name: str, last_name: str, username: str): ...
+
+    async def touch_user(self, user_id: int, activity: bool = True):
+        """Отмечает активность пользователя (и возвращает его из архива, если движок архивирует)."""
+
+    @abstractmethod
+    async def get_user_profile(self, user_id: int) -> Optional[Tuple]: ...
+
+    @abstractmethod
+    async def get_user_beer_rating(self, user_id: int) -> int: ...
+
+    @abstractmethod
+    async def change_rating(self, user_id: int, amount: int) -> int: ...
+
+    async def spend_rating(self, user_id: int, amount: int) -> bool:
+        """Списывает amount, только если рейтинга хватает. False — не хватило, ничего не списано."""
+        if await self.get_user_beer_rating(user_id) < amount:
+            return False
+        await self.change_rating(user_id, -amount)
+        return True
+
+    @abstractmethod
+    async def update_last_beer_time(self, user_id: int): ...
+
+    @abstractmethod
+    async def get_last_beer_time(self, user_id: int) -> datetime | None: ...
+
+    @abstractmethod
+    async def get_top_users(self, limit: int = 10) -> List[Tuple]: ...
+
+    @abstractmethod
+    async def get_user_ids_after(self, last_user_id: int, limit: int = 100) -> List[int]: ...
+
+    # --- НАСТРОЙКИ И ДЖЕКПОТ ---
+
+    @abstractmethod
+    async def get_setting(self, key: str) -> int | None: ...
+
+    @abstractmethod
+    async def get_all_settings(self) -> Dict[str, int]: ...
+
+    @abstractmethod
+    async def update_setting(self, key: str, value: int): ...
+
+    async def get_jackpot(self) -> int:
+        return await self.get_setting("jackpot_value") or 0
+
+    async def reset_jackpot(self):
+        await self.update_setting("jackpot_value", 0)
+
+    async def take_jackpot(self) -> int:
+        """Забирает весь джекпот (обнуляет банк) и возвращает сумму."""
+        amount = await self.get_jackpot()
+        if amount > 0:
+            await self.reset_jackpot()
+        return amount
+
+    async def increase_jackpot(self, amount: int):
+        current = await self.get_jackpot()
+        await self.update_setting("jackpot_value", current + amount)
+
+    # --- РЕЙДЫ ---
+
+    @abstractmethod
+    async def get_all_active_raids(self) -> List[Tuple]: ...
+
+    @abstractmethod
+    async def get_active_raid(self, chat_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def create_raid(self, chat_id: int, message_id: int, boss_health: int, max_health: int, reward: int, end_time: datetime): ...
+
+    @abstractmethod
+    async def update_raid_health(self, chat_id: int, damage: int): ...
+
+    @abstractmethod
+    async def end_raid(self, chat_id: int): ...
+
+    @abstractmethod
+    async def add_raid_participant(self, chat_id: int, user_id: int, damage: int): ...
+
+    @abstractmethod
+    async def get_raid_participants(self, chat_id: int) -> List[Tuple]: ...
+
+    # --- ЛЕСЕНКА ---
+
+    @abstractmethod
+    async def claim_ladder_game(self, game_id: str, status: str) -> bool: ...
+
+    @abstractmethod
+    async def finish_ladder_game(self, game_id: str, status: str) -> bool: ...
+
+    # --- МАФИЯ ---
+
+    @abstractmethod
+    async def get_mafia_game(self, chat_id: int) -> Optional[Tuple]: ...
+
+    @abstractmethod
+    async def get_mafia_players(self, chat_id: int) -> List[Tuple]: ...
+
+    @abstractmethod
+    async def get_mafia_player_count(self, chat_id: int) -> int: ...
+
+    @abstractmethod
+    async def create_mafia_game(self, chat_id: int, message_id: int, creator_id: int): ...
+
+    @abstractmethod
+    async def join_mafia(self, chat_id: int, user_id: int): ...
+
+    @abstractmethod
+    async def end_mafia_game(self, chat_id: int): ...
+
+    # --- ФЕРМА ---
+
+    @abstractmethod
+    async def get_user_farm_data(self, user_id: int) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    async def get_user_plots(self, user_id: int) -> List[Tuple]: ...
+
+    @abstractmethod
+    async def get_user_inventory(self, user_id: int) -> Dict[str, int]: ...
+
+    @abstractmethod
+    async def modify_inventory(self, user_id: int, item_id: str, amount: int) -> bool: ...
+
+    @abstractmethod
+    async def transfer_item(self, from_id: int, to_id: int, item_id: str, amount: int) -> bool:
+        """False — у отправителя не хватает. Сбой — TransferAbortedError или TransferPendingError."""
+
+    async def recover_transfers(self, older_than: float = 60) -> int:
+        """Доводит прерванные передачи (задача лидера). По умолчанию передача атомарна — нечего доводить."""
+        return 0
+
+    @abstractmethod
+    async def plant_crop(self, user_id: int, plot_num: int, crop_id: str, ready_time: datetime) -> bool: ...
+
+    @abstractmethod
+    async def harvest_plot(self, user_id: int, plot_num: int) -> str | None: ...
+
+    @abstractmethod
+    async def start_brewing(self, user_id: int, batch_size: int, end_time: datetime): ...
+
+    @abstractmethod
+    async def collect_brewery(self, user_id: int, reward_amount: int): ...
+
+    @abstractmethod
+    async def start_upgrade(self, user_id: int, building: str, end_time: datetime, cost: int) -> bool: ...
+
+    @abstractmethod
+    async def finish_upgrade(self, user_id: int, building: str): ...
+
+    # --- ЗАКАЗЫ ---
+
+    @abstractmethod
+    async def check_and_reset_orders(self, user_id: int): ...
+
+    @abstractmethod
+    async def get_user_orders(self, user_id: int) -> List[Tuple[int, str, int]]: ...
+
+    @abstractmethod
+    async def complete_order(self, user_id: int, slot_id: int) -> bool: ...
+
+    # --- ДАННЫЕ INLINE-КНОПОК ---
+
+    @abstractmethod
+    async def save_callback_payload(self, token: str, payload_json: str, expires_at: float): ...
+
+    @abstractmethod
+    async def get_callback_payload(self, token: str) -> Tuple[str, float] | None: ...
+
+    @abstractmethod
+    async def purge_callback_payloads(self, now: float) -> int: ...
+
+    # --- АРЕНДА ЛИДЕРСТВА ---
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> int | None: ...
+
+    @abstractmethod
+    async def release_lease(self, name: str, holder: str): ...
+
+    @abstractmethod
+    async def check_lease(self, name: str, token: int) -> bool: ...
+
+    # --- РАССЫЛКИ ---
+
+    @abstractmethod
+    async def enqueue_broadcast(self, from_chat_id: int, message_id: int) -> int: ...
+
+    @abstractmethod
+    async def get_pending_broadcast(self) -> Tuple | None: ...
+
+    @abstractmethod
+    async def update_broadcast(self, broadcast_id: int, last_user_id: int, sent: int, errors: int,
+                               lease_name: str, token: int, done: bool = False) -> bool: ...
+
+    # --- УВЕДОМЛЕНИЯ ---
+
+    @abstractmethod
+    async def get_pending_notifications(self) -> List[Tuple[int, str, int]]: ...
+
+    @abstractmethod
+    async def mark_notification_sent(self, user_id: int, task_type: str): ...
+
+
+def create_storage(kind: str = STORAGE, path: str = "bot_database.db") -> Storage:
+    """Создает хранилище по имени движка (переменная окружения STORAGE)."""
+    if kind == "sqlite":
+        from database import Database
+        return Database(db_name=path)
+    if kind == "memory":
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Неизвестный движок хранилища: {kind!r} (ожидается sqlite или memory)")
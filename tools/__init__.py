@@ -0,0 +1,2 @@
+# tools/__init__.py
+# (Утилиты для разработки: бенчмарки, нагрузочные тесты. В боте не импортируются.)
@@ -0,0 +1,319 @@
+# tools/bench_database.py
+"""
+Микробенчмарки Database на реалистичных объемах данных.
+
+    python -m tools.bench_database --sizes 10000,100000 --json bench.json
+    python -m tools.bench_database --sizes 1000000 --dir /var/tmp/bench --keep --compare bench.json
+
+Для каждого размера создается (или берется готовая с --keep) база: пользователи, фермы,
+грядки, инвентари, заказы, уведомления, рейды — массовой вставкой (sqlite3, executemany
+в одной транзакции, synchronous=OFF). Схему создает Database.initialize(), как в боте.
+
+Затем каждый метод (--methods, по умолчанию METHODS) вызывается --calls раз подряд
+(single) и столько же раз из --concurrency задач сразу (concurrent). Каждый вызов —
+со своим соединением, как вне апдейта. Пишущие методы меняют данные — база для замеров,
+не для бота.
+
+Результат — JSON (--json): окружение, время заполнения и по строке на (размер, метод, режим)
+с ops/s и перцентилями. --compare старый.json печатает замедления больше --threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+from database import FARM_SHARDS, Database, shard_of
+from handlers.farm_balance import get_balance, load_balance
+from logs import log_pipeline, setup_logging
+
+BATCH = 50_000
+RAID_CHATS = 100
+ITEMS = ("семя_зерна", "семя_хмеля", "зерно", "хмель")
+
+Method = Callable[[Database, "Context"], Awaitable[Any]]
+
+
+class Context:
+    """Случайные аргументы для вызовов: существующие пользователи и чаты."""
+
+    def __init__(self, users: int, rnd: random.Random):
+        self.users = users
+        self.rnd = rnd
+
+    def user(self) -> int:
+        return self.rnd.randint(1, self.users)
+
+    def chat(self) -> int:
+        return -self.rnd.randint(1, RAID_CHATS)
+
+
+METHODS: Dict[str, Method] = {
+    "user_exists": lambda db, c: db.user_exists(c.user()),
+    "get_user_beer_rating": lambda db, c: db.get_user_beer_rating(c.user()),
+    "change_rating": lambda db, c: db.change_rating(c.user(), 1),
+    "get_top_users": lambda db, c: db.get_top_users(10),
+    "touch_user": lambda db, c: db.touch_user(c.user()),
+    "get_user_farm_data": lambda db, c: db.get_user_farm_data(c.user()),
+    "get_user_inventory": lambda db, c: db.get_user_inventory(c.user()),
+    "get_user_plots": lambda db, c: db.get_user_plots(c.user()),
+    "modify_inventory": lambda db, c: db.modify_inventory(c.user(), c.rnd.choice(ITEMS), 1),
+    "check_and_reset_orders": lambda db, c: db.check_and_reset_orders(c.user()),
+    "get_user_orders": lambda db, c: db.get_user_orders(c.user()),
+    "get_pending_notifications": lambda db, c: db.get_pending_notifications(),
+    "get_active_raid": lambda db, c: db.get_active_raid(c.chat()),
+    "add_raid_participant": lambda db, c: db.add_raid_participant(c.chat(), c.user(), 10),
+    "get_raid_participants": lambda db, c: db.get_raid_participants(c.chat()),
+    "get_user_ids_after": lambda db, c: db.get_user_ids_after(c.user(), 100),
+}
+# Тяжелые методы (полный проход по таблицам) — меньше вызовов
+HEAVY = {"get_pending_notifications": 10}
+
+
+# ─────────────────────────────────────────────
+# Заполнение
+# ─────────────────────────────────────────────
+
+def batched(rows: Iterator[tuple], size: int = BATCH) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_insert(path: str, sql: str, rows: Iterator[tuple]) -> int:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    count = 0
+    with conn:
+        for batch in batched(rows):
+            conn.executemany(sql, batch)
+            count += len(batch)
+    conn.close()
+    return count
+
+
+async def seed(db: Database, users: int, rnd: random.Random) -> Dict[str, float]:
+    """Заполняет пустую базу. Возвращает время по таблицам (с)."""
+    now = datetime.now()
+    iso = lambda delta_minutes: (now + timedelta(minutes=delta_minutes)).isoformat()
+    orders = list(get_balance().random_orders(3)) or ["grain_10"]
+    timings: Dict[str, float] = {}
+
+    def timed(name: str, path: str, sql: str, rows: Iterator[tuple]):
+        started = time.perf_counter()
+        bulk_insert(path, sql, rows)
+        timings[name] = round(time.perf_counter() - started, 2)
+
+    timed("users", db.domain_path("core"),
+          "INSERT INTO users (user_id, first_name, last_name, username, beer_rating, last_beer_time, last_seen) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+          ((uid, f"User{uid}", "", f"user{uid}", rnd.randint(0, 5000),
+            iso(-rnd.randint(0, 10_000)) if rnd.random() < 0.7 else None,
+            iso(-rnd.randint(0, 60 * 24 * 90))) for uid in range(1, users + 1)))
+
+    # Ферма — по шардам, как Database раскладывает пользователей
+    shards = db.farm_shards
+    for shard in range(shards):
+        path = db.domain_path(f"farm.{shard}")
+        mine = [uid for uid in range(1, users + 1) if shard_of(uid, shards) == shard]
+        timed(f"user_farm_data.{shard}", path,
+              "INSERT INTO user_farm_data (user_id, field_level, brewery_level, brewery_batch_size, "
+              "brewery_batch_timer_end, field_upgrade_timer_end, brewery_upgrade_timer_end) VALUES (?, ?, ?, ?, ?, ?, ?)",
+              ((uid, rnd.randint(1, 5), rnd.randint(1, 5), 1 if rnd.random() < 0.1 else 0,
+                iso(rnd.randint(-60, 60)) if rnd.random() < 0.1 else None,
+                iso(rnd.randint(-60, 600)) if rnd.random() < 0.02 else None, None) for uid in mine))
+        timed(f"user_plots.{shard}", path,
+              "INSERT INTO user_plots (user_id, plot_number, crop_id, ready_time) VALUES (?, ?, ?, ?)",
+              ((uid, plot, rnd.choice(ITEMS[:2]), iso(rnd.randint(-120, 120)))
+               for uid in mine if rnd.random() < 0.5 for plot in (1, 2)))
+        timed(f"user_inventory.{shard}", path,
+              "INSERT INTO user_inventory (user_id, items_json) VALUES (?, ?)",
+              ((uid, json.dumps({item: rnd.randint(0, 50) for item in ITEMS}, ensure_ascii=False)) for uid in mine))
+        timed(f"user_orders.{shard}", path,
+              "INSERT INTO user_orders (user_id, slot_id, order_id, is_completed) VALUES (?, ?, ?, ?)",
+              ((uid, slot, rnd.choice(orders), rnd.randint(0, 1))
+               for uid in mine if rnd.random() < 0.3 for slot in (1, 2, 3)))
+        timed(f"user_orders_meta.{shard}", path,
+              "INSERT INTO user_orders_meta (user_id, last_reset_time) VALUES (?, ?)",
+              ((uid, iso(-rnd.randint(0, 60 * 48))) for uid in mine if rnd.random() < 0.3))
+
+    # Уведомления: в основном отправленные, ~1% ждут
+    timed("farm_notifications", db.domain_path("notify"),
+          "INSERT INTO farm_notifications (user_id, task_type, data_json, is_sent) VALUES (?, ?, ?, ?)",
+          ((uid, rnd.choice(("batch", "field_upgrade", "brewery_upgrade")), str(rnd.randint(1, 5)),
+            0 if rnd.random() < 0.1 else 1) for uid in range(1, users + 1) if rnd.random() < 0.1))
+
+    games = db.domain_path("games")
+    timed("active_raids", games,
+          "INSERT INTO active_raids (chat_id, message_id, boss_health, boss_max_health, reward_pool, end_time) "
+          "VALUES (?, ?, ?, ?, ?, ?)",
+          ((-chat, chat, 10 ** 9, 10 ** 9, 1000, iso(600)) for chat in range(1, RAID_CHATS + 1)))
+    timed("raid_participants", games,
+          "INSERT OR IGNORE INTO raid_participants (raid_id, user_id, damage_dealt, last_hit_time) VALUES (?, ?, ?, ?)",
+          ((-rnd.randint(1, RAID_CHATS), rnd.randint(1, users), rnd.randint(1, 500), iso(-rnd.randint(0, 600)))
+           for _ in range(min(users, 50_000))))
+
+    for path in db.data_files():
+        conn = sqlite3.connect(path)
+        conn.execute("ANALYZE")
+        conn.close()
+    return timings
+
+
+# ─────────────────────────────────────────────
+# Замеры
+# ─────────────────────────────────────────────
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    values = sorted(latencies)
+    pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+    return {
+        "calls": len(values),
+        "ops_per_s": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def measure(db: Database, method: Method, ctx: Context, calls: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            started = time.perf_counter()
+            await method(db, ctx)
+            latencies.append(time.perf_counter() - started)
+
+    await worker(min(3, calls))  # Прогрев: кэш страниц, подготовленные запросы
+    latencies.clear()
+    started = time.perf_counter()
+    share, extra = divmod(calls, concurrency)
+    await asyncio.gather(*(worker(share + (1 if i < extra else 0)) for i in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def bench_size(args, users: int) -> Tuple[Dict[str, float], List[Dict[str, Any]]]:
+    path = os.path.join(args.dir, f"bench_{users}.db")
+    db = Database(path, farm_shards=args.shards)
+    fresh = not os.path.exists(path)
+    await db.initialize()
+    rnd = random.Random(args.seed)
+    seeding: Dict[str, float] = {}
+    if fresh:
+        started = time.perf_counter()
+        seeding = await seed(db, users, rnd)
+        seeding["total"] = round(time.perf_counter() - started, 2)
+        print(f"[{users}] заполнено за {seeding['total']} с")
+    else:
+        print(f"[{users}] готовая база {path}")
+
+    results = []
+    for name in args.methods:
+        calls = HEAVY.get(name, args.calls)
+        for mode, concurrency in (("single", 1), ("concurrent", args.concurrency)):
+            stats = await measure(db, METHODS[name], Context(users, rnd), calls, concurrency)
+            results.append({"size": users, "method": name, "mode": mode, "concurrency": concurrency, **stats})
+            print(f"[{users}] {name:<26} {mode:<10} {stats['ops_per_s']:>9} ops/s  "
+                  f"p50 {stats['p50_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms")
+
+    if not args.keep:
+        for file in db.data_files():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(file + suffix):
+                    os.remove(file + suffix)
+    return seeding, results
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "commit": commit, "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(), "sql_stats": os.getenv("SQL_STATS", "1"),
+    }
+
+
+def compare(old_path: str, results: List[Dict[str, Any]], threshold: float):
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["size"], r["method"], r["mode"]): r for r in json.load(f)["results"]}
+    print(f"\nСравнение с {old_path} (порог {threshold:.0%} по p50):")
+    found = False
+    for r in results:
+        before = old.get((r["size"], r["method"], r["mode"]))
+        if not before or not before["p50_ms"]:
+            continue
+        change = r["p50_ms"] / before["p50_ms"] - 1
+        if abs(change) >= threshold:
+            found = True
+            mark = "🔴 медленнее" if change > 0 else "🟢 быстрее"
+            print(f"  {mark} {r['size']} {r['method']} {r['mode']}: "
+                  f"{before['p50_ms']} -> {r['p50_ms']} ms ({change:+.0%})")
+    if not found:
+        print("  Изменений больше порога нет.")
+
+
+async def run(args) -> Dict[str, Any]:
+    load_balance()
+    report: Dict[str, Any] = {"env": environment(), "calls": args.calls, "concurrency": args.concurrency,
+                              "shards": args.shards, "seeding": {}, "results": []}
+    for users in args.sizes:
+        seeding, results = await bench_size(args, users)
+        report["seeding"][str(users)] = seeding
+        report["results"].extend(results)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Число пользователей через запятую")
+    parser.add_argument("--methods", default=",".join(METHODS), help="Методы через запятую")
+    parser.add_argument("--calls", type=int, default=500, help="Вызовов метода на режим")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--shards", type=int, default=FARM_SHARDS)
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Где создавать базы")
+    parser.add_argument("--keep", action="store_true", help="Не удалять базы (следующий запуск возьмет готовые)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Порог изменения p50 для --compare")
+    parser.add_argument("--log-level", default="ERROR", help="Уровень логов бота (медленные запросы — WARNING)")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    args.methods = [m for m in args.methods.split(",") if m]
+    unknown = [m for m in args.methods if m not in METHODS]
+    if unknown:
+        raise SystemExit(f"Неизвестные методы: {', '.join(unknown)}. Есть: {', '.join(METHODS)}")
+    os.makedirs(args.dir, exist_ok=True)
+
+    setup_logging(level=args.log_level)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        log_pipeline.stop()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты: {args.json}")
+    if args.compare:
+        compare(args.compare, report["results"], args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# tools/bench_logging.py
+"""
+Бенчмарк логирования: насколько запись логов тормозит event loop.
+
+    python -m tools.bench_logging [--records 2000] [--write-ms 1] [--handlers 20]
+
+Хэндлеры-имитации логируют по INFO на каждый "апдейт" (как Farm Updater на каждое уведомление),
+вывод идет в медленный поток (каждый write ждет --write-ms — забитый pipe, journald, диск).
+Тикер раз в 1 мс меряет задержку цикла. Режимы:
+  sync  — logging.basicConfig, как было: запись в поток прямо в цикле;
+  queue — logs.setup_logging без ограничения частоты: запись в потоке QueueListener;
+  rate  — logs.setup_logging с ограничением частоты (LOG_RATE / LOG_BURST).
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from logs import LOG_BURST, LOG_RATE, log_pipeline, setup_logging
+
+TICK = 0.001
+
+
+class SlowStream:
+    """Поток вывода, каждая запись в который блокирует на write_ms."""
+
+    def __init__(self, write_ms: float):
+        self.delay = write_ms / 1000
+        self.lines = 0
+
+    def write(self, text: str):
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+
+    def flush(self):
+        pass
+
+
+def configure(mode: str, stream: SlowStream):
+    if mode == "sync":
+        log_pipeline.stop()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        logging.basicConfig(level=logging.INFO, stream=stream,
+                            format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    else:
+        setup_logging(stream=stream, rate=LOG_RATE if mode == "rate" else 0, burst=LOG_BURST)
+
+
+async def run(mode: str, records: int, handlers: int, write_ms: float) -> dict:
+    stream = SlowStream(write_ms)
+    configure(mode, stream)
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    async def handler(index: int):
+        for i in range(records // handlers):
+            logging.info(f"[Bench] Апдейт {i} в хэндлере {index}")
+            await asyncio.sleep(0)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(handlers)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick
+    log_pipeline.stop()  # Дописываем очередь, чтобы посчитать выведенные строки
+
+    lags.sort()
+    return {
+        "mode": mode,
+        "elapsed": elapsed,
+        "written": stream.lines,
+        "p50": statistics.median(lags) if lags else 0.0,
+        "p99": lags[int(len(lags) * 0.99)] if lags else 0.0,
+        "max": lags[-1] if lags else 0.0,
+        "stalled": sum(lag for lag in lags if lag >= 0.01),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--handlers", type=int, default=20)
+    parser.add_argument("--write-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = [asyncio.run(run(mode, args.records, args.handlers, args.write_ms)) for mode in ("sync", "queue", "rate")]
+    logging.getLogger().handlers.clear()
+
+    print(f"{args.records} записей, {args.handlers} хэндлеров, write {args.write_ms} ms")
+    print(f"{'режим':<6} {'время, с':>9} {'выведено':>9} {'lag p50':>9} {'lag p99':>9} {'lag max':>9} {'стоял, с':>9}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['elapsed']:>9.2f} {r['written']:>9} {r['p50'] * 1000:>7.2f}ms "
+              f"{r['p99'] * 1000:>7.2f}ms {r['max'] * 1000:>7.1f}ms {r['stalled']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
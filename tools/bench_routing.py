@@ -0,0 +1,104 @@
+# tools/bench_routing.py
+"""
+Бенчмарк маршрутизации callback'ов: сколько стоит найти хэндлер для одного апдейта.
+
+    python -m tools.bench_routing [--rounds 2000]
+
+"linear" — как это делает aiogram: фильтры всех хэндлеров всех роутеров по порядку.
+"prefix" — таблица CallbackPrefixDispatcher. Хэндлеры не вызываются, меряется только поиск.
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Dispatcher
+from aiogram.types import CallbackQuery, User
+
+from handlers import main_router
+from handlers.farm import FarmCallback, PlotCallback, BreweryCallback, UpgradeCallback, OrderCallback
+from handlers.shop import ShopCallback
+from handlers.game_raid import RaidCallbackData, RaidAttackCallbackData
+from handlers.game_ladder import LadderCallbackData, LadderGameState, encode_ladder_token
+from handlers.game_roulette import RouletteCallbackData
+from handlers.admin import AdminCallbackData
+from middlewares import CallbackPrefixDispatcher
+
+USER = User(id=42, is_bot=False, first_name="Bench")
+
+SAMPLES = [
+    AdminCallbackData(action="main").pack(),
+    RaidCallbackData(action="show_attack").pack(),
+    RaidAttackCallbackData(action="normal").pack(),
+    LadderCallbackData(action="play", token=encode_ladder_token(LadderGameState(42, 0, 0, 10, bytes(6), 3), "play", 1)).pack(),
+    RouletteCallbackData(action="join").pack(),
+    FarmCallback(action="main_dashboard", owner_id=42).pack(),
+    FarmCallback(action="show_help", owner_id=42).pack(),
+    PlotCallback(action="harvest", owner_id=42, plot_num=2).pack(),
+    BreweryCallback(action="collect", owner_id=42).pack(),
+    UpgradeCallback(action="buy_field", owner_id=42).pack(),
+    OrderCallback(action="complete", owner_id=42, slot_id=1, order_id="grain_10").pack(),
+    ShopCallback(action="buy", item_id="семя_зерна", quantity=5, owner_id=42).pack(),
+]
+
+
+async def linear_resolve(root, event, data):
+    """Повторяет порядок проверки фильтров aiogram (без вызова хэндлера)."""
+    checks = 0
+    for router in root.chain_tail:
+        for handler in router.observers["callback_query"].handlers:
+            checks += 1
+            result, _ = await handler.check(event, **{**data, "event_router": router, "handler": handler})
+            if result:
+                return handler, checks
+    return None, checks
+
+
+async def prefix_resolve(dispatcher, event, data):
+    routes = dispatcher.routes_for(event.data) or ()
+    resolved = await dispatcher.resolve(event, data)
+    return (resolved[0][2] if resolved else None), len(routes)
+
+
+async def measure(resolve, rounds: int):
+    results = {}
+    for raw in SAMPLES:
+        event = CallbackQuery(id="1", from_user=USER, chat_instance="1", data=raw)
+        data = {"event_from_user": USER}
+        handler, checks = await resolve(event, data)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await resolve(event, data)
+        per_update = (time.perf_counter() - start) / rounds
+        results[raw] = (per_update, checks, handler.callback.__name__ if handler else "-")
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутизации callback'ов")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    dp = Dispatcher()
+    dp.include_router(main_router)
+    dispatcher = CallbackPrefixDispatcher(main_router)
+
+    linear = await measure(lambda e, d: linear_resolve(main_router, e, d), args.rounds)
+    prefix = await measure(lambda e, d: prefix_resolve(dispatcher, e, d), args.rounds)
+
+    print(f"{'callback_data':<42} {'linear µs':>10} {'prefix µs':>10} {'checks':>9}  handler")
+    total_linear = total_prefix = 0.0
+    for raw in SAMPLES:
+        l_time, l_checks, l_name = linear[raw]
+        p_time, p_checks, p_name = prefix[raw]
+        total_linear += l_time
+        total_prefix += p_time
+        mark = "" if l_name == p_name else "  ⚠ РАЗНЫЕ ХЭНДЛЕРЫ"
+        print(f"{raw[:42]:<42} {l_time * 1e6:>10.1f} {p_time * 1e6:>10.1f} {l_checks:>4}→{p_checks:<4}  {p_name}{mark}")
+
+    n = len(SAMPLES)
+    print(f"\nСреднее на апдейт: linear {total_linear / n * 1e6:.1f} µs, "
+          f"prefix {total_prefix / n * 1e6:.1f} µs (x{total_linear / max(total_prefix, 1e-12):.1f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
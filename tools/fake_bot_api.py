@@ -0,0 +1,405 @@
+# tools/fake_bot_api.py
+"""
+Фейковый Telegram Bot API (aiohttp) для сквозных тестов пропускной способности без Telegram.
+
+    python -m tools.fake_bot_api --port 8081 --users 500 --rate 200 --latency-ms 30 --flood-chat 1
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=1:fake python main.py
+
+Методы: getUpdates (long polling), sendMessage, editMessageText, answerCallbackQuery,
+pinChatMessage, copyMessage, sendDocument, а также getMe, setWebhook / deleteWebhook.
+Остальные методы отвечают True (и считаются в статистике отдельно).
+
+Задержка ответа — --latency-ms ± --jitter-ms. Флуд-контроль как у Telegram: ответ 429
+с retry_after, если чат получает больше --flood-chat сообщений в секунду или бот в целом —
+больше --flood-global; --flood-prob — случайные 429 с заданной вероятностью.
+
+Апдейты генерируют виртуальные пользователи из tools.loadgen (--users, --rate, --mix):
+жмут кнопки из клавиатур, которые бот им прислал. Бот забирает апдейты через getUpdates,
+а после setWebhook сервер сам шлет их на webhook бота (с секретом и max_connections),
+как настоящий Telegram. Задержка "от апдейта до первого ответа бота в этот чат" —
+сквозная задержка бота; отчет — раз в --report секунд и на GET /stats.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+from aiogram.types import InlineKeyboardMarkup
+
+from tools.loadgen import (
+    BOT_ID, GROUP_BASE, SCENARIOS, Pacer, UpdateIds, VirtualUser, World, parse_mix, percentiles,
+)
+
+SEND_METHODS = {"sendMessage", "editMessageText", "copyMessage", "sendDocument"}
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Рейды без настоящей базы не поднять — по умолчанию их нет (можно добавить через --mix)
+FAKE_MIX = "farm_browse=4,farm_plant=2,brewing=1,roulette=1,ladder=1,beer=3"
+RESPONSE_TIMEOUT = 10.0   # Столько ждем ответа бота на апдейт, потом считаем его потерянным
+
+
+class FloodControl:
+    """Скользящее окно в 1 с на чат и на бота целиком."""
+
+    def __init__(self, per_chat: float, per_bot: float, probability: float):
+        self.per_chat = per_chat
+        self.per_bot = per_bot
+        self.probability = probability
+        self._chats: Dict[int, Deque[float]] = defaultdict(deque)
+        self._bot: Deque[float] = deque()
+
+    @staticmethod
+    def _hit(window: Deque[float], limit: float, now: float) -> Optional[int]:
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if limit and len(window) >= limit:
+            return max(1, int(1.0 - (now - window[0])) + 1)
+        window.append(now)
+        return None
+
+    def check(self, chat_id: int) -> Optional[int]:
+        """None — можно отправлять, иначе retry_after (с)."""
+        if self.probability and random.random() < self.probability:
+            return random.randint(1, 5)
+        now = time.monotonic()
+        if self.per_bot:
+            retry = self._hit(self._bot, self.per_bot, now)
+            if retry:
+                return retry
+        if self.per_chat:
+            return self._hit(self._chats[chat_id], self.per_chat, now)
+        return None
+
+
+class FakeTelegram:
+    """Состояние фейкового Telegram: очередь апдейтов, клавиатуры чатов, ожидающие ответа апдейты."""
+
+    def __init__(self, args):
+        self.args = args
+        self.flood = FloodControl(args.flood_chat, args.flood_global, args.flood_prob)
+        self.updates: Deque[Dict[str, Any]] = deque()
+        self.new_updates = asyncio.Event()
+        self.keyboards: Dict[int, Tuple[int, InlineKeyboardMarkup]] = {}
+        self.update_ids = UpdateIds()
+        self.message_ids = itertools.count(1)
+        self.webhook: Optional[Dict[str, Any]] = None
+
+        self.calls: Counter = Counter()
+        self.floods: Counter = Counter()
+        self.delivered = 0
+        self.lost = 0
+        # Ожидающие ответа апдейты: чат -> [[шаг, время, future]], id callback'а -> тот же элемент
+        self._pending_chats: Dict[int, Deque[list]] = defaultdict(deque)
+        self._pending_callbacks: Dict[str, list] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.started = time.monotonic()
+
+    # --- АПДЕЙТЫ ---
+
+    def push(self, step: str, update: Dict[str, Any]) -> asyncio.Future:
+        """Ставит апдейт в очередь; future завершится, когда бот ответит в этот чат."""
+        entry = [step, time.monotonic(), asyncio.get_running_loop().create_future()]
+        query = update.get("callback_query")
+        chat_id = (query["message"] if query else update["message"])["chat"]["id"]
+        self._pending_chats[chat_id].append(entry)
+        if query:
+            self._pending_callbacks[query["id"]] = entry
+        self.updates.append(update)
+        self.new_updates.set()
+        return entry[2]
+
+    def _answered(self, entry: list):
+        step, started, future = entry
+        if not future.done():
+            future.set_result(None)
+            self.latencies[step].append(time.monotonic() - started)
+
+    def responded(self, chat_id: Optional[int] = None, callback_id: Optional[str] = None):
+        """Первый ответ бота закрывает самый старый ожидающий апдейт чата (или сам callback)."""
+        if callback_id is not None:
+            entry = self._pending_callbacks.pop(callback_id, None)
+            if entry is not None:
+                self._answered(entry)
+            return
+        pending = self._pending_chats.get(chat_id)
+        while pending:
+            entry = pending.popleft()
+            if not entry[2].done():
+                self._answered(entry)
+                break
+        if pending is not None and not pending:
+            del self._pending_chats[chat_id]
+
+    def take(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        return list(itertools.islice(self.updates, limit))
+
+    # --- ОТВЕТЫ ---
+
+    def bot_user(self) -> Dict[str, Any]:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    def message(self, params: Dict[str, Any], chat_id: int, message_id: Optional[int] = None) -> Dict[str, Any]:
+        message_id = message_id or next(self.message_ids)
+        result = {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": self.bot_user(),
+        }
+        if params.get("text"):
+            result["text"] = params["text"]
+        markup = params.get("reply_markup")
+        if markup:
+            markup = json.loads(markup) if isinstance(markup, str) else markup
+            if "inline_keyboard" in markup:
+                result["reply_markup"] = markup
+                self.keyboards[chat_id] = (message_id, InlineKeyboardMarkup.model_validate(markup))
+        return result
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.calls[method] += 1
+        chat_id = int(params["chat_id"]) if str(params.get("chat_id", "")).lstrip("-").isdigit() else None
+
+        if method in SEND_METHODS and chat_id is not None:
+            retry_after = self.flood.check(chat_id)
+            if retry_after:
+                self.floods[method] += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {retry_after}",
+                             "parameters": {"retry_after": retry_after}}
+
+        if method == "getMe":
+            result: Any = self.bot_user()
+        elif method == "sendMessage":
+            result = self.message(params, chat_id)
+        elif method == "editMessageText":
+            result = self.message(params, chat_id, int(params["message_id"])) if chat_id is not None else True
+        elif method == "sendDocument":
+            result = self.message(params, chat_id)
+            result["document"] = {"file_id": f"doc{result['message_id']}", "file_unique_id": f"u{result['message_id']}",
+                                  "file_name": params.get("document_name", "document")}
+        elif method == "copyMessage":
+            result = {"message_id": next(self.message_ids)}
+        elif method == "setWebhook":
+            self.webhook = {"url": params["url"], "secret": params.get("secret_token", ""),
+                            "max_connections": int(params.get("max_connections") or 40)}
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook = None
+            result = True
+        else:
+            result = True  # answerCallbackQuery, pinChatMessage, deleteMessage, sendChatAction, ...
+
+        if method == "answerCallbackQuery":
+            self.responded(callback_id=params.get("callback_query_id"))
+        elif chat_id is not None and method != "sendChatAction":
+            self.responded(chat_id)
+        return 200, {"ok": True, "result": result}
+
+    # --- ОТЧЕТ ---
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        everything = [v for values in self.latencies.values() for v in values]
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "delivered": self.delivered,
+            "answered": len(everything),
+            "lost": self.lost,
+            "answered_per_s": round(len(everything) / elapsed, 1) if elapsed else 0,
+            "latency": percentiles(everything) if everything else {},
+            "steps": {step: percentiles(values) for step, values in sorted(self.latencies.items()) if values},
+            "calls": dict(self.calls.most_common()),
+            "flood_429": dict(self.floods),
+            "webhook": bool(self.webhook),
+        }
+
+
+# ─────────────────────────────────────────────
+# HTTP
+# ─────────────────────────────────────────────
+
+async def read_params(request: web.Request) -> Dict[str, Any]:
+    params: Dict[str, Any] = dict(request.query)
+    if request.content_type == "application/json":
+        params.update(await request.json())
+    elif request.can_read_body:
+        for key, value in (await request.post()).items():
+            if isinstance(value, web.FileField):
+                params[f"{key}_name"] = value.filename
+                value.file.read()
+            else:
+                params[key] = value
+    return params
+
+
+def create_app(telegram: FakeTelegram) -> web.Application:
+    args = telegram.args
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await read_params(request)
+        if args.latency_ms or args.jitter_ms:
+            delay = args.latency_ms + random.uniform(-args.jitter_ms, args.jitter_ms)
+            await asyncio.sleep(max(0.0, delay) / 1000)
+
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            limit = int(params.get("limit") or 100)
+            deadline = time.monotonic() + float(params.get("timeout") or 0)
+            while True:
+                updates = telegram.take(offset, limit)
+                if updates or time.monotonic() >= deadline:
+                    break
+                telegram.new_updates.clear()
+                with_timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    await asyncio.wait_for(telegram.new_updates.wait(), with_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            telegram.calls[method] += 1
+            telegram.delivered += len(updates)
+            return web.json_response({"ok": True, "result": updates})
+
+        status, body = await telegram.call(method, params)
+        return web.json_response(body, status=status)
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(telegram.stats())
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_route("*", "/bot{token}/{method}", handle)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+async def webhook_pusher(telegram: FakeTelegram):
+    """Как Telegram после setWebhook: POST апдейтов на webhook бота, 503/ошибки — повтор."""
+    async with aiohttp.ClientSession() as session:
+        in_flight: set = set()
+        while True:
+            if telegram.webhook is None:
+                await asyncio.sleep(0.05)
+                continue
+            if not telegram.updates:
+                telegram.new_updates.clear()
+                await telegram.new_updates.wait()
+                continue
+            hook = telegram.webhook
+            while len(in_flight) >= hook["max_connections"]:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight = {t for t in in_flight if not t.done()}
+            update = telegram.updates.popleft()
+
+            async def deliver(update=update, hook=hook):
+                headers = {SECRET_HEADER: hook["secret"]} if hook["secret"] else {}
+                for attempt in range(5):
+                    try:
+                        async with session.post(hook["url"], json=update, headers=headers) as response:
+                            if response.status == 200:
+                                telegram.delivered += 1
+                                return
+                    except aiohttp.ClientError:
+                        pass
+                    await asyncio.sleep(0.2 * (attempt + 1))
+                telegram.lost += 1
+
+            in_flight.add(asyncio.create_task(deliver()))
+
+
+async def generate(telegram: FakeTelegram, args):
+    """Виртуальные пользователи: апдейт -> ждем ответа бота -> следующий шаг сценария."""
+    world = World([GROUP_BASE - i for i in range(args.groups)],
+                  [GROUP_BASE - args.groups - i for i in range(args.groups)])
+    users = [VirtualUser(i, telegram, telegram.update_ids) for i in range(args.users)]
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    pacer = Pacer(args.rate)
+
+    async def virtual_user(vu: VirtualUser):
+        await asyncio.sleep(random.random())
+        await telegram.push("/start", vu.message("/start"))  # Регистрация, как у живого пользователя
+        while True:
+            for step, update in SCENARIOS[random.choices(names, weights)[0]](vu, world):
+                await pacer.wait()
+                try:
+                    await asyncio.wait_for(telegram.push(step, update), RESPONSE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    telegram.lost += 1
+                    break
+
+    await asyncio.gather(*(virtual_user(vu) for vu in users))
+
+
+async def report(telegram: FakeTelegram, every: float):
+    while True:
+        await asyncio.sleep(every)
+        s = telegram.stats()
+        lat = s["latency"]
+        logging.info(
+            f"[Fake API] {s['elapsed_s']} с: доставлено {s['delivered']}, отвечено {s['answered']} "
+            f"({s['answered_per_s']}/с), потеряно {s['lost']}, 429: {sum(s['flood_429'].values())}; "
+            f"p50 {lat.get('p50_ms', 0)} ms, p99 {lat.get('p99_ms', 0)} ms; вызовы {s['calls']}"
+        )
+
+
+async def serve(args):
+    telegram = FakeTelegram(args)
+    runner = web.AppRunner(create_app(telegram))
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logging.info(f"[Fake API] Слушаю http://{args.host}:{args.port} (TELEGRAM_API_URL для бота)")
+
+    tasks = [asyncio.create_task(webhook_pusher(telegram)), asyncio.create_task(report(telegram, args.report))]
+    if args.users:
+        tasks.append(asyncio.create_task(generate(telegram, args)))
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        result = telegram.stats()
+        await runner.cleanup()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--flood-chat", type=float, default=0, help="Сообщений в секунду на чат (0 — без лимита)")
+    parser.add_argument("--flood-global", type=float, default=0, help="Сообщений в секунду на бота (0 — без лимита)")
+    parser.add_argument("--flood-prob", type=float, default=0, help="Доля случайных 429")
+    parser.add_argument("--users", type=int, default=0, help="Виртуальных пользователей (0 — апдейтов нет)")
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=100, help="Апдейтов в секунду, 0 — без ограничения")
+    parser.add_argument("--mix", default=FAKE_MIX)
+    parser.add_argument("--duration", type=float, default=0, help="Секунд работы (0 — до Ctrl+C)")
+    parser.add_argument("--report", type=float, default=10, help="Период отчета в лог (с)")
+    parser.add_argument("--json", help="Итоговая статистика в JSON-файл")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+# tools/loadgen.py
+"""
+Нагрузочный тест: синтетические апдейты через настоящий Dispatcher (main_router со всеми
+middleware) и настоящую базу, но с ботом-заглушкой вместо Telegram.
+
+    python -m tools.loadgen --db /tmp/loadgen.db --users 200 --rate 300 --duration 30
+    python -m tools.loadgen --mix farm_browse=3,raid=2,beer=1 --rate 0 --concurrency 64 --json out.json
+
+Сценарии (--mix, вес сценария): farm_browse — листает ферму; farm_plant — сажает и собирает;
+brewing — варит и собирает пиво; raid — шторм ударов по боссам в групповых чатах;
+roulette — лобби рулетки (/roulette и "Присоединиться"); ladder — партии лесенки по кнопкам;
+beer — спам /beer и /top.
+Виртуальный пользователь проходит сценарий шаг за шагом и жмет кнопки из последней
+клавиатуры, которую ему "прислал" бот (токены лесенки, payload'ы посадки — как в жизни).
+
+--rate — апдейтов в секунду на всех (0 — без ограничения, столько, сколько успевает бот),
+--concurrency — сколько апдейтов обрабатывается одновременно, --api-ms — задержка "Telegram".
+Для open-loop нагрузки пользователей должно хватать: каждый шлет следующий апдейт
+только после ответа на предыдущий.
+
+Отчет: апдейты/с, перцентили задержки по шагам, вызовы Bot API, вызовы Database и
+SQL-запросы на апдейт, задержка event loop. База берется из --db (создается, если ее нет) —
+не запускайте на рабочей базе.
+
+--max-p99-ms — проверка для регрессий: при p99 выше порога код выхода 1, например
+    python -m tools.loadgen --users 100 --rate 0 --concurrency 32 --api-ms 50 \\
+        --mix farm_browse=1,farm_plant=1,brewing=1 --duration 15 --max-p99-ms 1000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import InlineKeyboardMarkup, Message, MessageId, User
+
+BOT_ID = 1
+USER_BASE = 10_000_000
+GROUP_BASE = -1_000_000_000_000
+START_BALANCE = 100_000
+START_ITEMS = ("семя_зерна", "семя_хмеля", "зерно", "хмель")
+
+# Методы, которые возвращают Message (остальные — True)
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument", "sendPhoto"}
+
+Update = Dict[str, Any]
+Step = Tuple[str, Update]
+
+
+# ─────────────────────────────────────────────
+# Бот-заглушка
+# ─────────────────────────────────────────────
+
+class StubSession(BaseSession):
+    """
+    Сессия бота без сети: считает вызовы Bot API, ждет --api-ms и отвечает правдоподобно.
+    Запоминает последнее сообщение с inline-клавиатурой в каждом чате — по нему
+    виртуальные пользователи жмут кнопки.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.keyboards: Dict[int, Tuple[int, InlineKeyboardMarkup]] = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if name == "getMe":
+            return User(id=bot.id, is_bot=True, first_name="Load Bot", username="loadgen_bot")
+        if name == "copyMessage":
+            return MessageId(message_id=next(self._message_ids))
+        if name not in MESSAGE_METHODS:
+            return True
+
+        chat_id = int(method.chat_id) if getattr(method, "chat_id", None) is not None else 0
+        message_id = getattr(method, "message_id", None) or next(self._message_ids)
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, InlineKeyboardMarkup):
+            self.keyboards[chat_id] = (message_id, markup)
+        return Message.model_validate(
+            bot_message(chat_id, message_id, getattr(method, "text", None) or ""),
+            context={"bot": bot},
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def chat_dict(chat_id: int) -> Dict[str, Any]:
+    if chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": f"Load {chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": "Load"}
+
+
+def bot_message(chat_id: int, message_id: int, text: str = "") -> Dict[str, Any]:
+    return {
+        "message_id": message_id, "date": int(time.time()), "chat": chat_dict(chat_id),
+        "from": {"id": BOT_ID, "is_bot": True, "first_name": "Load Bot", "username": "loadgen_bot"},
+        "text": text or "...",
+    }
+
+
+# ─────────────────────────────────────────────
+# Виртуальные пользователи и сценарии
+# ─────────────────────────────────────────────
+
+class UpdateIds:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def __next__(self) -> int:
+        return next(self._ids)
+
+
+class VirtualUser:
+    def __init__(self, index: int, session: StubSession, update_ids: UpdateIds):
+        self.id = USER_BASE + index
+        self.session = session
+        self.update_ids = update_ids
+        self.user = {"id": self.id, "is_bot": False, "first_name": f"Load{index}", "username": f"load{index}"}
+
+    def message(self, text: str, chat_id: Optional[int] = None) -> Update:
+        chat_id = chat_id or self.id
+        update_id = next(self.update_ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "chat": chat_dict(chat_id),
+                "from": self.user, "text": text,
+            },
+        }
+
+    def callback(self, data: str, chat_id: Optional[int] = None) -> Update:
+        chat_id = chat_id or self.id
+        update_id = next(self.update_ids)
+        message_id = self.session.keyboards.get(chat_id, (1, None))[0]
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id), "from": self.user, "chat_instance": str(chat_id),
+                "data": data, "message": bot_message(chat_id, message_id),
+            },
+        }
+
+    def buttons(self, prefix: str, chat_id: Optional[int] = None) -> List[str]:
+        """callback_data кнопок последней клавиатуры чата, начинающиеся с prefix."""
+        _, markup = self.session.keyboards.get(chat_id or self.id, (0, None))
+        if markup is None:
+            return []
+        return [b.callback_data for row in markup.inline_keyboard for b in row
+                if b.callback_data and b.callback_data.startswith(prefix)]
+
+
+class World:
+    """Общие для сценариев чаты: группы с рейдами и группы для рулетки."""
+
+    def __init__(self, raid_chats: List[int], roulette_chats: List[int]):
+        self.raid_chats = raid_chats
+        self.roulette_chats = roulette_chats
+
+
+FARM_PAGES = ("main_dashboard", "view_plots", "inventory", "orders_menu", "upgrades", "shop", "show_help")
+
+
+def farm_browse(vu: VirtualUser, world: World) -> Iterator[Step]:
+    from handlers.farm import FarmCallback
+    yield "/farm", vu.message("/farm")
+    for _ in range(random.randint(2, 6)):
+        action = random.choice(FARM_PAGES)
+        yield f"farm:{action}", vu.callback(FarmCallback(action=action, owner_id=vu.id).pack())
+
+
+def farm_plant(vu: VirtualUser, world: World) -> Iterator[Step]:
+    from handlers.farm import FarmCallback, PlotCallback
+    yield "farm:view_plots", vu.callback(FarmCallback(action="view_plots", owner_id=vu.id).pack())
+    plot = random.randint(1, 2)
+    yield "plot:harvest", vu.callback(PlotCallback(action="harvest", owner_id=vu.id, plot_num=plot).pack())
+    yield "plot:plant_menu", vu.callback(PlotCallback(action="plant_menu", owner_id=vu.id, plot_num=plot).pack())
+    seeds = vu.buttons("p:plant_do")
+    if seeds:
+        yield "plot:plant_do", vu.callback(random.choice(seeds))
+
+
+def brewing(vu: VirtualUser, world: World) -> Iterator[Step]:
+    from handlers.farm import BreweryCallback
+    yield "brew:brew_menu", vu.callback(BreweryCallback(action="brew_menu", owner_id=vu.id).pack())
+    brew = vu.buttons("brew:brew_do")
+    if brew:
+        yield "brew:brew_do", vu.callback(brew[0])
+    yield "brew:collect", vu.callback(BreweryCallback(action="collect", owner_id=vu.id).pack())
+
+
+def raid(vu: VirtualUser, world: World) -> Iterator[Step]:
+    from handlers.game_raid import RaidAttackCallbackData, RaidCallbackData
+    chat_id = random.choice(world.raid_chats)
+    yield "raid:show_attack", vu.callback(RaidCallbackData(action="show_attack").pack(), chat_id)
+    for _ in range(random.randint(1, 3)):
+        action = "normal" if random.random() < 0.7 else "strong"
+        yield f"raid_attack:{action}", vu.callback(RaidAttackCallbackData(action=action).pack(), chat_id)
+
+
+def roulette(vu: VirtualUser, world: World) -> Iterator[Step]:
+    from handlers.game_roulette import RouletteCallbackData, active_games, chat_cooldowns
+    chat_id = random.choice(world.roulette_chats)
+    if chat_id in active_games:
+        yield "roulette:join", vu.callback(RouletteCallbackData(action="join").pack(), chat_id)
+    else:
+        chat_cooldowns.pop(chat_id, None)  # Иначе чат 5 минут стоит без игр
+        yield "/roulette", vu.message(f"/roulette 10 {random.randint(2, 6)}", chat_id)
+
+
+def ladder(vu: VirtualUser, world: World) -> Iterator[Step]:
+    yield "/ladder", vu.message("/ladder 10")
+    for _ in range(10):
+        moves = vu.buttons("ladder:play:")
+        if not moves:
+            break
+        if random.random() < 0.15 and vu.buttons("ladder:cash_out"):
+            yield "ladder:cash_out", vu.callback(vu.buttons("ladder:cash_out")[0])
+            break
+        yield "ladder:play", vu.callback(random.choice(moves))
+
+
+def beer(vu: VirtualUser, world: World) -> Iterator[Step]:
+    for _ in range(random.randint(1, 3)):
+        yield "/beer", vu.message("/beer")
+    if random.random() < 0.3:
+        yield "/top", vu.message("/top")
+
+
+SCENARIOS = {
+    "farm_browse": farm_browse,
+    "farm_plant": farm_plant,
+    "brewing": brewing,
+    "raid": raid,
+    "roulette": roulette,
+    "ladder": ladder,
+    "beer": beer,
+}
+DEFAULT_MIX = "farm_browse=4,farm_plant=2,brewing=1,raid=3,roulette=1,ladder=1,beer=3"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Неизвестный сценарий: {name}. Есть: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ─────────────────────────────────────────────
+# Прогон
+# ─────────────────────────────────────────────
+
+class Pacer:
+    """Общий темп: не больше rate апдейтов в секунду (0 — без ограничения)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(self._next, now)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    @property
+    def updates(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return {"count": len(values), "p50_ms": round(pick(0.5), 2), "p90_ms": round(pick(0.9), 2),
+            "p99_ms": round(pick(0.99), 2), "max_ms": round(values[-1] * 1000, 2)}
+
+
+def db_counters() -> Tuple[int, int]:
+    """(вызовы методов Database, SQL-запросы) с начала процесса."""
+    from monitoring import query_stats, registry
+    from monitoring.sql import DB_METHOD_SECONDS
+    methods = sum(h.count for h in registry.histograms.get(DB_METHOD_SECONDS, {}).values())
+    return methods, sum(stat.count for stat in query_stats.stats.values())
+
+
+async def prepare(db, bot, settings, users: List[VirtualUser], groups: int) -> World:
+    """Регистрирует пользователей с запасом пива и семян, поднимает рейды в группах."""
+    for vu in users:
+        await db.add_user(vu.id, vu.user["first_name"], "", vu.user["username"])
+        await db.change_rating(vu.id, START_BALANCE)
+        for item in START_ITEMS:
+            await db.modify_inventory(vu.id, item, 1000)
+
+    raid_chats = [GROUP_BASE - i for i in range(groups)]
+    roulette_chats = [GROUP_BASE - groups - i for i in range(groups)]
+    from handlers.game_raid import RaidCallbackData
+    from aiogram.types import InlineKeyboardButton
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⚔️", callback_data=RaidCallbackData(action="show_attack").pack()),
+    ]])
+    for chat_id in raid_chats:
+        if await db.get_active_raid(chat_id):
+            continue
+        message = await bot.send_message(chat_id, "🚨 Рейд (нагрузочный тест)", reply_markup=keyboard)
+        health = settings.raid_boss_health * 1000  # Чтобы босс не умер посреди теста
+        await db.create_raid(chat_id, message.message_id, health, health, settings.raid_reward_pool,
+                             datetime.now() + timedelta(hours=settings.raid_duration_hours))
+    return World(raid_chats, roulette_chats)
+
+
+async def run(args) -> Dict[str, Any]:
+    os.environ["DB_PATH"] = args.db
+    os.environ.setdefault("BOT_TOKEN", f"{BOT_ID}:loadgen")
+    import main as app  # После DB_PATH: main читает настройки при импорте
+    from logs import setup_logging
+    from monitoring import loop_monitor
+
+    setup_logging(level=args.log_level)
+    db, settings_manager = await app.setup_storage()
+    bot = app.create_bot()
+    session = StubSession(args.api_ms / 1000)
+    session.middleware = bot.session.middleware  # Трассировка Bot API и т.п. — как у настоящей сессии
+    bot.session = session
+    dp = app.create_dispatcher(db, settings_manager)
+
+    update_ids = UpdateIds()
+    users = [VirtualUser(i, session, update_ids) for i in range(args.users)]
+    world = await prepare(db, bot, settings_manager, users, args.groups)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+
+    results = Results()
+    pacer = Pacer(args.rate)
+    slots = asyncio.Semaphore(args.concurrency)
+    session.calls.clear()
+    methods_before, queries_before = db_counters()
+    loop_monitor.start()
+    deadline = time.monotonic() + args.duration
+
+    async def feed(step: str, update: Update):
+        await pacer.wait()
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as e:
+                results.errors[f"{step}: {type(e).__name__}: {e}"[:160]] += 1
+            results.latencies[step].append(time.perf_counter() - started)
+
+    async def virtual_user(vu: VirtualUser):
+        await asyncio.sleep(random.random() * min(1.0, args.duration / 10))  # Не все в одну миллисекунду
+        while time.monotonic() < deadline:
+            scenario = SCENARIOS[random.choices(names, weights)[0]]
+            for step, update in scenario(vu, world):
+                if time.monotonic() >= deadline:
+                    return
+                await feed(step, update)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(vu) for vu in users))
+    elapsed = time.perf_counter() - started
+    loop_monitor.stop()
+    methods, queries = db_counters()
+
+    updates = max(results.updates, 1)
+    all_latencies = [v for values in results.latencies.values() for v in values]
+    return {
+        "users": args.users, "rate": args.rate, "concurrency": args.concurrency, "api_ms": args.api_ms,
+        "duration_s": round(elapsed, 2),
+        "updates": results.updates,
+        "updates_per_s": round(results.updates / elapsed, 1),
+        "latency": percentiles(all_latencies) if all_latencies else {},
+        "steps": {step: percentiles(values) for step, values in sorted(results.latencies.items())},
+        "db_calls_per_update": round((methods - methods_before) / updates, 2),
+        "sql_per_update": round((queries - queries_before) / updates, 2),
+        "api_calls_per_update": round(sum(session.calls.values()) / updates, 2),
+        "api_calls": dict(session.calls.most_common()),
+        "loop_lag_max_ms": round(loop_monitor.max_lag * 1000, 1),
+        "errors": dict(results.errors.most_common(20)),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    lat = report["latency"]
+    print(f"Апдейтов: {report['updates']} за {report['duration_s']} с — {report['updates_per_s']} апд/с "
+          f"(пользователей {report['users']}, rate {report['rate'] or '∞'}, concurrency {report['concurrency']}, "
+          f"api {report['api_ms']} ms)")
+    if lat:
+        print(f"Задержка: p50 {lat['p50_ms']} ms, p90 {lat['p90_ms']} ms, p99 {lat['p99_ms']} ms, max {lat['max_ms']} ms")
+    print(f"На апдейт: Database {report['db_calls_per_update']}, SQL {report['sql_per_update']}, "
+          f"Bot API {report['api_calls_per_update']}; lag цикла max {report['loop_lag_max_ms']} ms")
+    print()
+    print(f"{'шаг':<22} {'кол-во':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for step, s in report["steps"].items():
+        print(f"{step:<22} {s['count']:>7} {s['p50_ms']:>8} {s['p90_ms']:>8} {s['p99_ms']:>8} {s['max_ms']:>8}")
+    print()
+    print("Bot API: " + ", ".join(f"{name} {count}" for name, count in report["api_calls"].items()))
+    if report["errors"]:
+        print("\nОшибки:")
+        for text, count in report["errors"].items():
+            print(f"{count:>6} × {text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="loadgen.db", help="База для теста (не рабочая!)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=5, help="Групп с рейдом и групп для рулетки")
+    parser.add_argument("--rate", type=float, default=200, help="Апдейтов в секунду, 0 — без ограничения")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--api-ms", type=float, default=0, help="Задержка ответа Bot API")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Записать отчет в JSON-файл ('-' — в stdout)")
+    parser.add_argument("--max-p99-ms", type=float, default=0,
+                        help="Проверка: код выхода 1, если p99 задержки выше (0 — без проверки)")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    p99 = report["latency"].get("p99_ms", 0)
+    if args.max_p99_ms and p99 > args.max_p99_ms:
+        print(f"\n❌ p99 {p99} ms выше порога {args.max_p99_ms:g} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
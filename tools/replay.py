@@ -0,0 +1,332 @@
+# tools/replay.py
+"""
+Повтор записанных апдейтов (middlewares/capture.py) через настоящий Dispatcher на копии базы.
+
+    CAPTURE_SALT=... python -m tools.replay captures/updates-*.jsonl.gz --db /home/bot/app/bot_database.db
+    python -m tools.replay captures/*.jsonl.gz --db prod.db --speed 10 --skip 3600 --duration 900
+    python -m tools.replay captures/*.jsonl.gz --db prod.db --speed 0 --concurrency 64 --json run.json
+
+--speed 1 — в реальном темпе записи, N — в N раз быстрее, 0 — так быстро, как успевает бот
+(не больше --concurrency апдейтов одновременно). --skip / --duration вырезают окно из записи
+(секунды от первого апдейта) — например, вечерний пик рейдов.
+
+База: все файлы --db (core, домены, шарды фермы) копируются online backup API в --workdir
+и обезличиваются тем же ключом, что и запись (CAPTURE_SALT или --salt): id пользователей
+и чатов в таблицах и JSON заменяются псевдонимами, строки фермы переезжают в шарды
+по новым id, имена стираются. Рабочая база не меняется. Без --db — пустая база.
+
+Бот — заглушка (StubSession из tools.loadgen, --api-ms — задержка "Telegram"); фоновые
+задачи (уведомления фермы, таймеры рейдов) не запускаются. Админ-команды не сработают:
+ADMIN_ID не совпадает с псевдонимом.
+
+Отчет: апдейты/с, перцентили задержки по командам и префиксам callback'ов, отставание
+от расписания записи, вызовы Database / SQL / Bot API на апдейт, задержка event loop.
+"""
+import argparse
+import asyncio
+import gzip
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from tools.loadgen import BOT_ID, Results, StubSession, db_counters, percentiles
+
+Record = Tuple[float, Dict[str, Any]]
+
+# Колонки с именами людей и чатов: замена (None — NULL)
+NAME_COLUMNS = {"first_name": "User", "last_name": None, "title": "Chat"}
+# Целочисленные *_id базы, не указывающие на пользователя или чат (как NOT_ID_KEYS записи)
+NOT_ID_COLUMNS = {"message_id", "slot_id"}
+
+
+# ─────────────────────────────────────────────
+# Чтение записи
+# ─────────────────────────────────────────────
+
+def read_capture(path: str) -> Iterator[Record]:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Оборванная последняя строка
+                yield record["ts"], record["update"]
+    except (EOFError, gzip.BadGzipFile, zlib.error):
+        # Запись бота, который не успел закрыть файл: все до последнего сброса читается
+        print(f"⚠️ {path}: файл оборван, прочитано до обрыва", file=sys.stderr)
+
+
+def records(paths: List[str], skip: float, duration: float, limit: int) -> Iterator[Record]:
+    """Апдейты всех файлов (воркеры, ротация) по времени прихода, в окне [skip, skip + duration)."""
+    merged = heapq.merge(*(read_capture(p) for p in sorted(paths)), key=lambda r: r[0])
+    first: Optional[float] = None
+    count = 0
+    for ts, update in merged:
+        if first is None:
+            first = ts
+        offset = ts - first
+        if offset < skip:
+            continue
+        if duration and offset >= skip + duration:
+            break
+        yield ts, update
+        count += 1
+        if limit and count >= limit:
+            break
+
+
+def update_kind(update: Dict[str, Any]) -> str:
+    """Метка для отчета: команда, префикс callback_data или тип апдейта."""
+    message = update.get("message") or update.get("edited_message")
+    if message is not None:
+        text = message.get("text") or ""
+        if text.startswith(("/", "!")):
+            return text.split()[0].split("@")[0]
+        return "message"
+    callback = update.get("callback_query")
+    if callback is not None:
+        return "cb:" + (callback.get("data") or "").split(":")[0]
+    return next((key for key in update if key != "update_id"), "unknown")
+
+
+# ─────────────────────────────────────────────
+# Копия базы
+# ─────────────────────────────────────────────
+
+def copy_database(source: str, workdir: str) -> str:
+    """Копирует все файлы базы source в workdir (имена сохраняются). Возвращает путь к core."""
+    from backup import _copy_consistent
+    from database import Database
+
+    target = os.path.join(workdir, os.path.basename(source))
+    files = Database(source).data_files()
+    pairs = [(src, dst) for src, dst in zip(files, Database(target).data_files()) if os.path.exists(src)]
+    _copy_consistent(pairs, files[0], pages=1024, sleep=0)
+    return target
+
+
+def anonymize_database(core_path: str, salt: str):
+    """Обезличивает копию тем же ключом, что и запись, и раскладывает ферму по шардам заново."""
+    from database import Database, shard_of
+    from middlewares.capture import is_id_key, pseudonymize, pseudonymize_numbers, pseudonymize_username
+
+    db = Database(core_path)
+    for path in db.data_files():
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path)
+        conn.create_function("pseudo", 1, lambda v: pseudonymize(v, salt) if isinstance(v, int) else v,
+                             deterministic=True)
+        conn.create_function("pseudo_text", 1, lambda v: pseudonymize_numbers(v, salt) if isinstance(v, str) else v,
+                             deterministic=True)
+        conn.create_function("pseudo_name", 1, lambda v: pseudonymize_username(v, salt) if v else v,
+                             deterministic=True)
+        with conn:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+            for table in tables:
+                assignments, params = [], []
+                for _, column, kind, *_ in conn.execute(f'PRAGMA table_info("{table}")'):
+                    # Целочисленное сродство по правилам SQLite: *_archive из CREATE TABLE AS объявлены как INT
+                    if "INT" in kind.upper() and column not in NOT_ID_COLUMNS and (
+                            is_id_key(column) or column in ("from_user", "to_user")):
+                        assignments.append(f'"{column}" = pseudo("{column}")')
+                    elif column.endswith("_json"):
+                        assignments.append(f'"{column}" = pseudo_text("{column}")')
+                    elif column == "username":
+                        assignments.append(f'"{column}" = pseudo_name("{column}")')
+                    elif column in NAME_COLUMNS:
+                        assignments.append(f'"{column}" = ?')
+                        params.append(NAME_COLUMNS[column])
+                if assignments:
+                    conn.execute(f'UPDATE "{table}" SET {", ".join(assignments)}', params)
+        conn.close()
+
+    # Шард фермы считается от user_id: у псевдонима он другой
+    shards = db.farm_shards
+    if shards <= 1:
+        return
+    for shard in range(shards):
+        path = db.domain_path(f"farm.{shard}")
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path)
+        conn.create_function("shard_of", 1, lambda v: shard_of(v, shards) if isinstance(v, int) else shard,
+                             deterministic=True)
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        tables = [t for t in tables
+                  if any(col[1] == "user_id" for col in conn.execute(f'PRAGMA table_info("{t}")'))]
+        for other in range(shards):
+            if other == shard or not os.path.exists(db.domain_path(f"farm.{other}")):
+                continue
+            conn.execute("ATTACH DATABASE ? AS other", (db.domain_path(f"farm.{other}"),))
+            with conn:
+                for table in tables:
+                    conn.execute(f'INSERT INTO other."{table}" SELECT * FROM main."{table}" '
+                                 f'WHERE shard_of(user_id) = ?', (other,))
+            conn.execute("DETACH DATABASE other")
+        with conn:
+            for table in tables:
+                conn.execute(f'DELETE FROM "{table}" WHERE shard_of(user_id) != ?', (shard,))
+        conn.close()
+
+
+# ─────────────────────────────────────────────
+# Повтор
+# ─────────────────────────────────────────────
+
+async def run(args) -> Dict[str, Any]:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="replay_")
+    os.makedirs(workdir, exist_ok=True)
+    if args.db:
+        started = time.perf_counter()
+        db_path = copy_database(args.db, workdir)
+        anonymize_database(db_path, args.salt)
+        print(f"База: копия {args.db} в {workdir}, обезличена за {time.perf_counter() - started:.1f} с",
+              file=sys.stderr)
+    else:
+        db_path = os.path.join(workdir, "replay.db")
+
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", f"{BOT_ID}:replay")
+    import main as app  # После DB_PATH: main читает настройки при импорте
+    from logs import setup_logging
+    from monitoring import loop_monitor
+
+    setup_logging(level=args.log_level)
+    db, settings_manager = await app.setup_storage()
+    bot = app.create_bot()
+    session = StubSession(args.api_ms / 1000)
+    session.middleware = bot.session.middleware
+    bot.session = session
+    dp = app.create_dispatcher(db, settings_manager)
+
+    results = Results()
+    lags: List[float] = []
+    slots = asyncio.Semaphore(args.concurrency)
+    tasks = set()
+    first_ts = last_ts = 0.0
+
+    async def feed(kind: str, update: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            results.errors[f"{kind}: {type(e).__name__}: {e}"[:160]] += 1
+        finally:
+            results.latencies[kind].append(time.perf_counter() - started)
+            slots.release()
+
+    methods_before, queries_before = db_counters()
+    loop_monitor.start()
+    started = time.perf_counter()
+    for ts, update in records(args.captures, args.skip, args.duration, args.limit):
+        if not first_ts:
+            first_ts = ts
+        last_ts = ts
+        if args.speed > 0:
+            due = started + (ts - first_ts) / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await slots.acquire()
+        if args.speed > 0:
+            # Отставание от расписания записи: бот (или --concurrency) не успевает за темпом
+            lags.append(max(0.0, time.perf_counter() - due))
+        task = asyncio.create_task(feed(update_kind(update), update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    loop_monitor.stop()
+    methods, queries = db_counters()
+    await session.close()
+
+    updates = max(results.updates, 1)
+    all_latencies = [v for values in results.latencies.values() for v in values]
+    steps = sorted(results.latencies.items(), key=lambda item: -len(item[1]))[:args.top]
+    return {
+        "captures": args.captures, "db": args.db or "", "workdir": workdir,
+        "speed": args.speed, "concurrency": args.concurrency, "api_ms": args.api_ms,
+        "captured_s": round(last_ts - first_ts, 2),
+        "duration_s": round(elapsed, 2),
+        "updates": results.updates,
+        "updates_per_s": round(results.updates / elapsed, 1) if elapsed else 0.0,
+        "captured_per_s": round(results.updates / (last_ts - first_ts), 1) if last_ts > first_ts else 0.0,
+        "latency": percentiles(all_latencies) if all_latencies else {},
+        "schedule_lag": percentiles(lags) if lags else {},
+        "steps": {kind: percentiles(values) for kind, values in steps},
+        "db_calls_per_update": round((methods - methods_before) / updates, 2),
+        "sql_per_update": round((queries - queries_before) / updates, 2),
+        "api_calls_per_update": round(sum(session.calls.values()) / updates, 2),
+        "api_calls": dict(session.calls.most_common()),
+        "loop_lag_max_ms": round(loop_monitor.max_lag * 1000, 1),
+        "errors": dict(results.errors.most_common(20)),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    lat = report["latency"]
+    speed = f"x{report['speed']:g}" if report["speed"] > 0 else "max"
+    print(f"Апдейтов: {report['updates']} за {report['duration_s']} с — {report['updates_per_s']} апд/с "
+          f"(в записи {report['captured_s']} с, {report['captured_per_s']} апд/с; скорость {speed}, "
+          f"concurrency {report['concurrency']}, api {report['api_ms']} ms)")
+    if lat:
+        print(f"Задержка: p50 {lat['p50_ms']} ms, p90 {lat['p90_ms']} ms, p99 {lat['p99_ms']} ms, max {lat['max_ms']} ms")
+    lag = report["schedule_lag"]
+    if lag:
+        print(f"Отставание от записи: p50 {lag['p50_ms']} ms, p99 {lag['p99_ms']} ms, max {lag['max_ms']} ms")
+    print(f"На апдейт: Database {report['db_calls_per_update']}, SQL {report['sql_per_update']}, "
+          f"Bot API {report['api_calls_per_update']}; lag цикла max {report['loop_lag_max_ms']} ms")
+    print()
+    print(f"{'апдейт':<28} {'кол-во':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for kind, s in report["steps"].items():
+        print(f"{kind[:28]:<28} {s['count']:>7} {s['p50_ms']:>8} {s['p90_ms']:>8} {s['p99_ms']:>8} {s['max_ms']:>8}")
+    print()
+    print("Bot API: " + ", ".join(f"{name} {count}" for name, count in report["api_calls"].items()))
+    if report["errors"]:
+        print("\nОшибки:")
+        for text, count in report["errors"].items():
+            print(f"{count:>6} × {text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="Файлы записи (*.jsonl.gz)")
+    parser.add_argument("--db", help="База, с которой снимается копия (сама не меняется)")
+    parser.add_argument("--workdir", help="Куда положить копию базы (по умолчанию — временная папка)")
+    parser.add_argument("--salt", default=os.getenv("CAPTURE_SALT"), help="Ключ псевдонимов записи (CAPTURE_SALT)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Множитель темпа записи, 0 — максимум")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--skip", type=float, default=0, help="Пропустить первые N секунд записи")
+    parser.add_argument("--duration", type=float, default=0, help="Секунд записи после --skip (0 — до конца)")
+    parser.add_argument("--limit", type=int, default=0, help="Не больше N апдейтов")
+    parser.add_argument("--api-ms", type=float, default=0, help="Задержка ответа Bot API")
+    parser.add_argument("--top", type=int, default=25, help="Строк в таблице по видам апдейтов")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Записать отчет в JSON-файл ('-' — в stdout)")
+    args = parser.parse_args()
+    if args.db and not args.salt:
+        raise SystemExit("Для копии базы нужен ключ записи: CAPTURE_SALT или --salt")
+
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        return
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
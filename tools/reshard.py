@@ -0,0 +1,134 @@
+# tools/reshard.py
+"""
+Офлайн-решардинг данных фермы: раскладывает user_farm_data, user_plots, user_inventory,
+user_orders и user_orders_meta (и их архивные копии) по новому числу файлов-шардов.
+
+    python -m tools.reshard --to 4 [--db bot_database.db] [--force]
+
+Бот должен быть остановлен (проверяется по аренде лидера и журналу передач).
+Новые шарды собираются во временных файлах *.new, старые файлы остаются рядом
+с суффиксом .pre-reshard — после проверки их можно удалить вручную.
+После решардинга бот запускается с FARM_SHARDS=<новое число>.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+from database import ARCHIVE_SUFFIX, FARM_SCHEMA, FARM_TABLES, farm_shard_path, shard_of
+
+DB_PATH = os.getenv("DB_PATH", "bot_database.db")
+
+BATCH = 1000
+
+
+def stored_shards(core: sqlite3.Connection) -> int:
+    try:
+        row = core.execute("SELECT value FROM db_meta WHERE key = 'farm_shards'").fetchone()
+    except sqlite3.OperationalError:
+        return 1
+    return int(row[0]) if row else 1
+
+
+def check_offline(core: sqlite3.Connection) -> list:
+    """Причины, по которым решардинг сейчас небезопасен."""
+    problems = []
+    try:
+        active = core.execute("SELECT holder FROM leases WHERE expires_at > ?", (time.time(),)).fetchall()
+        problems += [f"аренда лидера активна ({holder}) — бот запущен?" for holder, in active]
+    except sqlite3.OperationalError:
+        pass
+    try:
+        pending = core.execute(
+            "SELECT COUNT(*) FROM transfers WHERE state IN ('preparing', 'committed')"
+        ).fetchone()[0]
+        if pending:
+            problems.append(f"незавершенных передач: {pending} (запустите бота, он их восстановит)")
+    except sqlite3.OperationalError:
+        pass
+    return problems
+
+
+def copy_shard(src_path: str, targets: list, new_count: int) -> int:
+    src = sqlite3.connect(src_path)
+    src.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    copied = 0
+    for table in (*FARM_TABLES, *(t + ARCHIVE_SUFFIX for t in FARM_TABLES), "transfer_markers"):
+        exists = src.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if not exists:
+            continue
+        cursor = src.execute(f"SELECT * FROM {table}")
+        columns = [col[0] for col in cursor.description]
+        user_col = columns.index("user_id")
+        insert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        while rows := cursor.fetchmany(BATCH):
+            for row in rows:
+                targets[shard_of(row[user_col], new_count)].execute(insert, row)
+            copied += len(rows)
+    src.close()
+    return copied
+
+
+def move_aside(path: str, suffix: str):
+    for extra in ("", "-wal", "-shm"):
+        if os.path.exists(path + extra):
+            os.replace(path + extra, path + suffix + extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-решардинг данных фермы")
+    parser.add_argument("--db", default=DB_PATH, help="основной файл базы (core)")
+    parser.add_argument("--to", type=int, required=True, help="новое число шардов")
+    parser.add_argument("--force", action="store_true", help="не проверять, что бот остановлен")
+    args = parser.parse_args()
+
+    if args.to < 1:
+        sys.exit("--to должно быть >= 1")
+    core = sqlite3.connect(args.db)
+    old_count = stored_shards(core)
+    if old_count == args.to:
+        sys.exit(f"Данные уже разложены на {old_count} шард(ов).")
+    problems = check_offline(core)
+    if problems and not args.force:
+        sys.exit("Решардинг отменен:\n  " + "\n  ".join(problems))
+
+    old_paths = [farm_shard_path(args.db, i, old_count) for i in range(old_count)]
+    new_paths = [farm_shard_path(args.db, i, args.to) for i in range(args.to)]
+
+    started = time.perf_counter()
+    targets = []
+    for path in new_paths:
+        if os.path.exists(path + ".new"):
+            os.remove(path + ".new")
+        conn = sqlite3.connect(path + ".new")
+        for statement in FARM_SCHEMA:
+            conn.execute(statement)
+        targets.append(conn)
+
+    copied = 0
+    for path in old_paths:
+        if os.path.exists(path):
+            copied += copy_shard(path, targets, args.to)
+            print(f"  {path}: скопирован")
+    for conn in targets:
+        conn.commit()
+        conn.close()
+
+    # Подмена файлов: сначала убираем старые (имена могут совпадать с новыми), потом ставим новые
+    for path in old_paths:
+        move_aside(path, ".pre-reshard")
+    for path in new_paths:
+        os.replace(path + ".new", path)
+
+    core.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT)")
+    core.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES ('farm_shards', ?)", (str(args.to),))
+    core.commit()
+    core.close()
+
+    print(f"Готово: {old_count} → {args.to} шард(ов), строк: {copied}, "
+          f"{time.perf_counter() - started:.1f} с. Запускайте бота с FARM_SHARDS={args.to}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# webhook_server.py
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+from typing import Any, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+# --- НАСТРОЙКИ (из окружения) ---
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")                 # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")           # Пусто — случайный секрет на каждый запуск
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Прием апдейтов от Telegram по webhook (aiohttp).
+
+    Запрос проверяется по секретному токену, апдейт ставится в обработку отдельной задачей,
+    и Telegram сразу получает 200. Если в обработке уже `queue_size` апдейтов — отвечаем 503,
+    и Telegram повторит доставку позже (backpressure вместо бесконечной очереди в памяти).
+    При остановке новые апдейты не принимаются (503), а начатые дорабатываются (drain).
+    Порядок апдейтов одного пользователя/чата обеспечивает KeyedUpdateExecutor: задачи стартуют в порядке прихода.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: str = WEBHOOK_SECRET,
+        path: str = WEBHOOK_PATH,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        **workflow_data: Any,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.path = path
+        self.queue_size = queue_size
+        self.workflow_data = workflow_data
+        self._tasks: Set[asyncio.Task] = set()
+        self._draining = False
+        self._runner: Optional[web.AppRunner] = None
+        self.accepted = 0
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    # --- HTTP ---
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self._draining or len(self._tasks) >= self.queue_size:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning("[Webhook] Некорректный апдейт: %s", e)
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.accepted += 1
+        return web.Response(status=200)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "pending": self.pending,
+            "queue_size": self.queue_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "draining": self._draining,
+        })
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update, **self.workflow_data)
+        except Exception as e:
+            logging.error("[Webhook] Ошибка обработки апдейта %s: %s", update.update_id, e, exc_info=True)
+
+    # --- ЗАПУСК / ОСТАНОВКА ---
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, url: str = WEBHOOK_URL):
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"[Webhook] Сервер слушает {host}:{port}{self.path}")
+
+        if url:
+            await self.bot.set_webhook(
+                url=url.rstrip("/") + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            logging.info(f"[Webhook] Webhook установлен: {url.rstrip('/')}{self.path}")
+        else:
+            logging.info("[Webhook] WEBHOOK_URL не задан — webhook в Telegram не регистрируется.")
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Перестает принимать апдейты и ждет завершения начатых."""
+        self._draining = True
+        if self._tasks:
+            logging.info(f"[Webhook] Дорабатываем {len(self._tasks)} апдейтов...")
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                logging.warning(f"[Webhook] Не успели обработать {len(pending)} апдейтов за {timeout} с.")
+                for task in pending:
+                    task.cancel()
+
+    async def stop(self):
+        await self.drain()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        logging.info("[Webhook] Сервер остановлен.")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, stop_event: asyncio.Event, **workflow_data: Any):
+    """Поднимает webhook-сервер и работает, пока не выставлен stop_event."""
+    server = WebhookServer(dp, bot, **workflow_data)
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data, **workflow_data)
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data, **workflow_data)
+        await bot.session.close()
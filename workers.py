@@ -0,0 +1,361 @@
+# workers.py
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from handlers.farm_balance import balance_sync
+from logs import setup_logging
+from storage import STORAGE
+from middlewares import capture
+from monitoring import METRICS_PORT, loop_monitor, registry, start_metrics_server, tracer
+from webhook_server import (
+    SECRET_HEADER, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL,
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_DRAIN_TIMEOUT, WebhookServer,
+)
+
+# --- НАСТРОЙКИ ---
+WORKERS = int(os.getenv("WORKERS", "1"))                        # 1 — обычный режим в одном процессе
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))   # Воркер i слушает 127.0.0.1:(BASE + i)
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000")) # Очередь фронта к одному воркеру
+WORKER_PATH = "/update"
+WORKER_RESTART_MAX_DELAY = 60    # Пауза перед перезапуском упавшего воркера растет до этого (сек)...
+WORKER_STABLE_SECONDS = 60       # ...и сбрасывается, если воркер проработал дольше
+
+# Апдейты, у которых чат лежит в event["chat"]
+_CHAT_EVENTS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                "my_chat_member", "chat_member", "chat_join_request")
+
+
+def shard_for(chat_id: int, count: int) -> int:
+    """Номер воркера для чата. Стабилен между перезапусками (без hash() с солью)."""
+    return chat_id % count
+
+
+def raw_chat_id(raw: Dict[str, Any]) -> int:
+    """
+    chat_id из сырого апдейта (dict из JSON), без разбора в модели aiogram.
+    Callback — чат сообщения с кнопкой; события без чата — id пользователя.
+    """
+    for name in _CHAT_EVENTS:
+        event = raw.get(name)
+        if event:
+            return event["chat"]["id"]
+    query = raw.get("callback_query")
+    if query:
+        message = query.get("message")
+        if message and message.get("chat"):
+            return message["chat"]["id"]
+        return query["from"]["id"]
+    for event in raw.values():
+        if isinstance(event, dict) and isinstance(event.get("from"), dict):
+            return event["from"]["id"]
+    return 0
+
+
+# ─────────────────────────────────────────────
+# Воркер
+# ─────────────────────────────────────────────
+# Каждый воркер — полноценный бот (main_router, middleware, своя память),
+# но апдейты получает не от Telegram, а от фронта по локальному HTTP.
+# Все апдейты одного чата попадают в один воркер, поэтому состояние игр в памяти
+# (active_games, ladder_timeouts, FSM) остается согласованным.
+
+async def run_worker(index: int, count: int, port: int, secret: str):
+    import main as app  # Отложенный импорт: main сам импортирует этот модуль
+
+    db, settings_manager = await app.setup_storage(initialized=True)
+    bot = app.create_bot()
+    dp = app.create_dispatcher(db, settings_manager)
+    dp["worker_index"] = index
+
+    # Фоновые задачи — у того воркера (или экземпляра), кто держит аренду лидера
+    app.start_background_jobs(bot, db, settings_manager)
+    # Баланс фермы — в памяти каждого воркера: /reload_balance из соседнего доходит через БД
+    balance_task = asyncio.create_task(balance_sync(db))
+
+    stop_event = app.install_stop_signals()
+    server = WebhookServer(dp, bot, secret=secret, path=WORKER_PATH)
+    await server.start(host="127.0.0.1", port=port, url="")
+    metrics_server = await start_metrics_server(METRICS_PORT + 1 + index) if METRICS_PORT > 0 else None
+    loop_monitor.start(notify=app.admin_notifier(bot, preformatted=True))
+    tracer.start(f"traces-worker{index}")  # Свой файл у каждого процесса
+    capture.start(f"updates-worker{index}")
+    logging.info(f"🚀 Воркер {index}/{count} запущен (порт {port})")
+    try:
+        await stop_event.wait()
+    finally:
+        balance_task.cancel()
+        loop_monitor.stop()
+        await server.stop()
+        tracer.stop()
+        capture.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await app.leader.stop()
+        await bot.session.close()
+
+
+def worker_entry(index: int, count: int, port: int, secret: str):
+    """Точка входа процесса-воркера."""
+    setup_logging(f"worker{index}")
+    asyncio.run(run_worker(index, count, port, secret))
+
+
+# ─────────────────────────────────────────────
+# Фронт
+# ─────────────────────────────────────────────
+
+class ShardForwarder:
+    """
+    Раздает апдейты воркерам по chat_id.
+
+    На каждый воркер — своя очередь и одна задача-отправитель: апдейты одного чата
+    уходят в воркер строго по порядку. Если воркер занят (503) или еще не поднялся —
+    отправитель ждет и повторяет, а очередь копится до WORKER_QUEUE_SIZE (дальше — backpressure).
+    """
+
+    def __init__(self, count: int, secret: str, base_port: int = WORKER_BASE_PORT,
+                 queue_size: int = WORKER_QUEUE_SIZE):
+        self.count = count
+        self.secret = secret
+        self.base_port = base_port
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in range(count)]
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.forwarded = [0] * count
+        self.offset: Optional[int] = None  # Polling: следующий update_id (подтверждается при остановке)
+
+    def backlog(self) -> List[int]:
+        return [q.qsize() for q in self.queues]
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(headers={SECRET_HEADER: self.secret})
+        self._tasks = [asyncio.create_task(self._forward(i)) for i in range(self.count)]
+
+    def submit_nowait(self, raw: Dict[str, Any]) -> bool:
+        """Для webhook: False — очередь воркера полна, Telegram должен повторить позже."""
+        try:
+            self.queues[shard_for(raw_chat_id(raw), self.count)].put_nowait(raw)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def submit(self, raw: Dict[str, Any]):
+        """Для polling: ждет места в очереди (опрос Telegram притормаживает сам)."""
+        await self.queues[shard_for(raw_chat_id(raw), self.count)].put(raw)
+
+    async def _forward(self, index: int):
+        url = f"http://127.0.0.1:{self.base_port + index}{WORKER_PATH}"
+        queue = self.queues[index]
+        while True:
+            raw = await queue.get()
+            delay = 0.1
+            try:
+                while True:
+                    try:
+                        async with self._session.post(url, json=raw) as resp:
+                            if resp.status == 200:
+                                self.forwarded[index] += 1
+                                break
+                            if resp.status < 500:
+                                logging.error("[Shards] Воркер %s отклонил апдейт: HTTP %s", index, resp.status)
+                                break
+                    except aiohttp.ClientError:
+                        pass  # Воркер еще стартует или перезапускается
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 5)
+            finally:
+                queue.task_done()
+
+    async def close(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Досылает накопленное (не дольше timeout) и останавливает отправителей."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"[Shards] Не досланы апдейты: {self.backlog()}")
+        for task in self._tasks:
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+
+async def _poll(bot, forwarder: ShardForwarder, allowed_updates: List[str], stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(offset=forwarder.offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error(f"[Shards] Ошибка получения апдейтов: {e}")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            await forwarder.submit(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            forwarder.offset = update.update_id + 1
+
+
+async def _confirm_offset(bot, offset: Optional[int]):
+    """Подтверждает Telegram разосланные апдейты: иначе после перезапуска они придут второй раз."""
+    if offset is None:
+        return
+    try:
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+    except Exception as e:
+        logging.error(f"[Shards] Не удалось подтвердить offset {offset}: {e}")
+
+
+class WorkerSupervisor:
+    """Держит count процессов-воркеров: упавший перезапускается с растущей паузой."""
+
+    def __init__(self, count: int, secret: str):
+        self.count = count
+        self.secret = secret
+        self.processes: List[multiprocessing.Process] = []
+        self._ctx = multiprocessing.get_context("spawn")
+        self._started: List[float] = []
+        self._delays: List[float] = []
+        self._stopping = False
+        registry.describe("bot_shard_worker_restarts_total", "Перезапуски упавших воркеров")
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        process = self._ctx.Process(
+            target=worker_entry,
+            args=(index, self.count, WORKER_BASE_PORT + index, self.secret),
+            name=f"piva-worker-{index}",
+        )
+        process.start()
+        return process
+
+    def start(self):
+        self.processes = [self._spawn(index) for index in range(self.count)]
+        self._started = [time.monotonic()] * self.count
+        self._delays = [1.0] * self.count
+
+    async def _restart(self, index: int):
+        process = self.processes[index]
+        if time.monotonic() - self._started[index] >= WORKER_STABLE_SECONDS:
+            self._delays[index] = 1.0
+        delay = self._delays[index]
+        logging.error(f"[Shards] Воркер {index} завершился (код {process.exitcode}), перезапуск через {delay:.0f} с")
+        registry.inc("bot_shard_worker_restarts_total", worker=index)
+        await asyncio.sleep(delay)
+        self._delays[index] = min(delay * 2, WORKER_RESTART_MAX_DELAY)
+        if not self._stopping:
+            self.processes[index] = self._spawn(index)
+            self._started[index] = time.monotonic()
+
+    async def run(self):
+        restarting: Dict[int, asyncio.Task] = {}
+        try:
+            while not self._stopping:
+                for index, process in enumerate(self.processes):
+                    if process.exitcode is not None and index not in restarting:
+                        restarting[index] = asyncio.create_task(self._restart(index))
+                for index in [i for i, task in restarting.items() if task.done()]:
+                    restarting.pop(index)
+                await asyncio.sleep(1)
+        finally:
+            for task in restarting.values():
+                task.cancel()
+
+    async def stop(self, timeout: float):
+        self._stopping = True
+        for process in self.processes:
+            if process.exitcode is None:
+                process.terminate()  # SIGTERM: воркер дорабатывает начатые апдейты
+        for process in self.processes:
+            await asyncio.to_thread(process.join, timeout)
+
+
+def _front_app(forwarder: ShardForwarder, secret: str) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            raw = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not forwarder.submit_nowait(raw):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response(status=200)
+
+    async def handle_health(request: web.Request) -> web.Response:
+        return web.json_response({"backlog": forwarder.backlog(), "forwarded": forwarder.forwarded})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", handle_health)
+    return app
+
+
+async def run_sharded(mode: str, count: int):
+    """Фронт: поднимает count воркеров и раздает им апдейты (polling или webhook)."""
+    import main as app
+    from handlers import main_router
+
+    if STORAGE == "memory":
+        # У каждого воркера были бы свои данные: рейтинг, ферма и игры разъехались бы между процессами
+        raise RuntimeError("STORAGE=memory не поддерживает WORKERS > 1: данные не делятся между процессами")
+
+    # Схему и миграции готовит фронт: воркеры не гоняют их одновременно
+    await app.initialize_storage()
+
+    internal_secret = secrets.token_urlsafe(32)
+    supervisor = WorkerSupervisor(count, internal_secret)
+    supervisor.start()
+    supervising = asyncio.create_task(supervisor.run())
+
+    bot = app.create_bot()
+    forwarder = ShardForwarder(count, internal_secret)
+    await forwarder.start()
+    stop_event = app.install_stop_signals()
+    allowed_updates = main_router.resolve_used_update_types()
+    runner = None
+
+    # Метрики фронта: очереди к воркерам (метрики хэндлеров — у каждого воркера на своем порту)
+    def collect_forwarder_metrics(metrics):
+        for index, (backlog, forwarded) in enumerate(zip(forwarder.backlog(), forwarder.forwarded)):
+            metrics.set("bot_shard_backlog", backlog, worker=index)
+            metrics.set("bot_shard_forwarded_total", forwarded, worker=index)
+
+    registry.collector(collect_forwarder_metrics)
+    metrics_server = await start_metrics_server(METRICS_PORT)
+
+    try:
+        if mode == "webhook":
+            secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+            runner = web.AppRunner(_front_app(forwarder, secret))
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=secret,
+                    allowed_updates=allowed_updates,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS,
+                )
+            logging.info(f"🚀 Фронт запущен (webhook), воркеров: {count}")
+            await stop_event.wait()
+        else:
+            logging.info(f"🚀 Фронт запущен (polling), воркеров: {count}")
+            poller = asyncio.create_task(_poll(bot, forwarder, allowed_updates, stop_event))
+            await stop_event.wait()
+            poller.cancel()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await forwarder.close()
+        if mode != "webhook":
+            await _confirm_offset(bot, forwarder.offset)
+        supervising.cancel()
+        await supervisor.stop(WEBHOOK_DRAIN_TIMEOUT + 5)
+        await bot.session.close()
+        logging.info("[Shards] Фронт и воркеры остановлены.")